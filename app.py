@@ -1,256 +1,383 @@
 import json
+import math
+import time
+import uuid
+import flask
 import dash
 import dash_table
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
 from dash.exceptions import PreventUpdate
+import numpy
 import pandas
 
-from scbapi.scbcontroller import DataController, SimpleQuery, Queries
+from scbapi.scbcontroller import DataController, SimpleQuery
+from scbapi.scbstat import ResponseFormatEnum
+from scbapi.scbmap import VectorTiles
+from scbapi.scbresult import QueryResult, RegionYearMatrix
+from scbapi.scbexport import ExportFormatEnum
+from scbapi.scbjobs import Job, JobStateEnum, JobLimitError
+from scbapi.scbregistry import RegistryToken
 from scbapi.scbutils import MappingTools
 from scbapi.scbconfig import Config
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
+# Number of rows on a page of the data table
+TABLE_PAGE_SIZE = 50
+
 # Colors for default color scale
 DEFAULT_COLORS = ["#edf8fb", "#bfd3e6", "#9ebcda", "#8c96c6", "#8c6bb1", "#88419d", "#6e016b"]
 
-# TODO Serialize query collection and add to local store?
 # Initialize data controller and get data frames
-data_controller = DataController(local_path=Config.fixtures('FOLDER'))
+data_controller = DataController(local_path=Config.path(Config.fixtures('FOLDER')),
+                                 snapshot_path=Config.path(Config.snapshot('SOURCE')))
+
+# Table catalogue is refreshed in the background, searches only use the local index
+if Config.catalogue('AUTO_REFRESH').lower() == 'true':
+    data_controller.refresh_catalogue()
 
 
-def get_dataframe_cols(data_dict=None):
-    return [{"name": i, "id": i} for i in data_dict["COLUMN_NAMES"]]
+def get_budget(name: str) -> float:
+    # Latency budget of a callback in seconds, expired results are served if new data takes longer
+    return float(Config.serving('BUDGET_' + name))
 
 
-def get_dataframe(data_dict=None):
-    df_data: pandas.DataFrame = pandas.DataFrame.from_dict(data_dict["DATAFRAME"]).astype({"region": str})
-    return df_data.to_dict('records')
+def get_data_status(data_dict: dict, revalidating: bool) -> str:
+    # Marker for data served from an expired result
+    if data_dict is None or not data_dict.get('STALE'):
+        return ''
+    fetched = time.strftime('%Y-%m-%d %H:%M', time.localtime(data_dict['FETCHED_AT']))
+    return 'Showing data from {fetched}, {state}'.format(
+        fetched=fetched, state='refreshing...' if revalidating else 'SCB is not available')
 
 
-def get_line_chart(data_dict: dict):
-    df_data: pandas.DataFrame = pandas.DataFrame.from_dict(data_dict["DATAFRAME"])
-    df = df_data.groupby(by='year', as_index=False).sum()
+def get_dataframe_cols(result: QueryResult):
+    return [{"name": i, "id": i} for i in result.columns]
 
+
+def get_line_chart(df: pandas.DataFrame, value_col: str):
     return \
         dict(
             data=[dict(
                 x=df["year"],
-                y=df[data_dict["VALUE_COLUMN"]],
+                y=df[value_col],
                 mode='lines+markers',
                 type='scatter'
             )]
         )
 
 
-def get_map_chart(data_dict: dict, map_dict: dict, classifier=None):
-    df_data: pandas.DataFrame = pandas.DataFrame.from_dict(data_dict["DATAFRAME"]).astype({"region": str})
-    df = df_data.groupby(by='region', as_index=False).sum()
-
-    # Calculate colorscale using classifier
-    color_scale = MappingTools.get_colorscale(df=df, column=data_dict["VALUE_COLUMN"],
-                                              colors=DEFAULT_COLORS, classifier=classifier)
-    return \
-        dict(
-            data=[dict(
-                geojson=map_dict,
-                locations=df.region,
-                z=df[data_dict["VALUE_COLUMN"]],
-                colorscale=color_scale,
-                zauto=True,
-                marker_opacity=0.8,
-                marker_line_width=0,
-                visible=True,
-                type='choroplethmapbox'
-            )],
-            layout=dict(
-                mapbox=dict(
-                    layers=[],
-                    style="carto-positron",
-                    zoom=5,
-                    center={"lat": 57.78145, "lon": 14.15618},
-                ),
-                margin={"r": 0, "t": 5, "l": 0, "b": 0},
-                clickmode='event+select'
-            )
-        )
-
-
-app.layout = html.Div(children=[
-    # In memory store to persist and share query result between callbacks
-    dcc.Store(id='query_data'),
+def get_map_layers(df: pandas.DataFrame, value_col: str, color_scale, tile_url: str, vmin=None, vmax=None):
+    # One vector tile layer for each class, tiles contain the regions of the class only
+    df = df.dropna(subset=[value_col])
+    colors = MappingTools.get_class_colors(df=df, column=value_col, colorscale=color_scale, vmin=vmin, vmax=vmax)
+    if len(colors) == 0:
+        return []
 
-    # In memory store to persist and share query collection between callbacks
-    dcc.Store(id='query_collection'),
+    class_colors = pandas.Series(colors, index=df.index)
 
-    dcc.Tabs(id="tabs",
-             parent_className='custom-tabs',
-             className='custom-tabs-container',
-             children=[
-                 # Tab for mapping data
-                 dcc.Tab(label='Map',
-                         className='custom-tab',
-                         selected_className='custom-tab--selected',
-                         children=[
-                             html.Div([
+    return \
+        [dict(
+            sourcetype='vector',
+            source=[tile_url + '?keys=' + ','.join(df.region[class_colors == color])],
+            sourcelayer=VectorTiles.LAYER_NAME,
+            type='fill',
+            color=color,
+            opacity=0.8
+        ) for color in class_colors.unique()]
+
+
+def get_map_values(matrix: RegionYearMatrix) -> dict:
+    # Values of every year and the totals, the data part of the map figure. The slider selects a frame on client side
+    return dict(locations=matrix.keys, years=matrix.years, frames=matrix.values.T.tolist(),
+                total=matrix.totals.tolist())
+
+
+def get_map_style(matrix: RegionYearMatrix, classifier=None, tile_url: str = None) -> dict:
+    # Calculate colorscale using classifier, bins are shared by all years
+    color_scale = matrix.colorscale(colors=DEFAULT_COLORS, classifier=classifier)
+    total_scale = matrix.colorscale(colors=DEFAULT_COLORS, classifier=classifier, totals=True)
+
+    zmin, zmax = numpy.nanmin(matrix.values), numpy.nanmax(matrix.values)
+    total_zmin, total_zmax = numpy.nanmin(matrix.totals), numpy.nanmax(matrix.totals)
+
+    # With vector tiles regions are drawn by map layers, only the tiles in view are loaded
+    layers, total_layers = [], []
+    if tile_url is not None:
+        layers = [get_map_layers(pandas.DataFrame({'region': matrix.keys, 'value': matrix.column(year)}), 'value',
+                                 color_scale, tile_url, vmin=zmin, vmax=zmax) for year in matrix.years]
+        total_layers = get_map_layers(pandas.DataFrame({'region': matrix.keys, 'value': matrix.totals}), 'value',
+                                      total_scale, tile_url)
+
+    return dict(colorscale=color_scale, zmin=zmin, zmax=zmax, layers=layers,
+                total_colorscale=total_scale, total_zmin=total_zmin, total_zmax=total_zmax, total_layers=total_layers)
+
+
+def serve_layout():
+    # Layout is built per page load, so the query collection token is always current
+    registry_token: RegistryToken = data_controller.registry.token()
+
+    return html.Div(children=[
+        # In memory store to persist and share query result between callbacks
+        dcc.Store(id='query_data'),
+
+        # Identifies the page for background jobs, the result job of the selected statistic is polled
+        dcc.Store(id='client_id', data=uuid.uuid4().hex),
+        dcc.Store(id='query_job'),
+        dcc.Interval(id='job-interval', interval=int(Config.jobs('POLL_INTERVAL')), disabled=True),
+
+        # In memory store with the registry version and labels of the query collection
+        dcc.Store(id='query_collection', data=registry_token),
+
+        # Changes of the query collection to be merged into the store on client side
+        dcc.Store(id='query_delta'),
+
+        # Region geometries are sent once for each selected map, map updates only send values and colors
+        dcc.Store(id='map_geometry'),
+        dcc.Store(id='map_values'),
+        dcc.Store(id='map_style'),
+
+        dcc.Tabs(id="tabs",
+                 parent_className='custom-tabs',
+                 className='custom-tabs-container',
+                 children=[
+                     # Tab for mapping data
+                     dcc.Tab(label='Map',
+                             className='custom-tab',
+                             selected_className='custom-tab--selected',
+                             children=[
                                  html.Div([
-                                     html.P('Data sources:'),
-                                     dcc.Dropdown(
-                                         options=[{'label': v["query"]["name"], 'value': k} for (k, v) in
-                                                  data_controller.queries.items()],
-                                         id='stat-dropdown'
-                                     )
-                                 ], style={'width': '30%', 'display': 'inline-block'}),
+                                     html.Div([
+                                         html.P('Data sources:'),
+                                         dcc.Dropdown(
+                                             options=registry_token['labels'],
+                                             id='stat-dropdown'
+                                         ),
+                                         html.Div(id='job-status')
+                                     ], style={'width': '30%', 'display': 'inline-block'}),
+                                     html.Div([
+                                         html.P('Classifiers: '),
+                                         dcc.Dropdown(
+                                             options=[{'label': v, 'value': k} for (k, v) in
+                                                      MappingTools.CLASSIFIERS.items()],
+                                             value=list(MappingTools.CLASSIFIERS.keys())[0],
+                                             clearable=False,
+                                             id='classifier-dropdown'
+                                         )
+                                     ], style={'width': '30%', 'display': 'inline-block'}),
+                                     html.Div([
+                                         html.P('Regions: '),
+                                         dcc.Dropdown(
+                                             options=[{'label': key.title(), 'value': key} for key in
+                                                      data_controller.map_keys],
+                                             value=data_controller.resolve_map_key(),
+                                             clearable=False,
+                                             id='map-dropdown'
+                                         )
+                                     ], style={'width': '30%', 'display': 'inline-block'}),
+                                 ], style={'width': '75%'}),
                                  html.Div([
-                                     html.P('Classifiers: '),
-                                     dcc.Dropdown(
-                                         options=[{'label': v, 'value': k} for (k, v) in
-                                                  MappingTools.CLASSIFIERS.items()],
-                                         value=list(MappingTools.CLASSIFIERS.keys())[0],
-                                         clearable=False,
-                                         id='classifier-dropdown'
+                                     html.Button('Play', id='year-play'),
+                                     html.Div([
+                                         dcc.Slider(
+                                             id='year-slider',
+                                             min=0,
+                                             max=0,
+                                             step=1,
+                                             value=0,
+                                             marks={0: 'All'},
+                                             updatemode='drag'
+                                         )
+                                     ], style={'width': '80%', 'display': 'inline-block', 'padding': '0 20px'}),
+                                     dcc.Interval(id='year-interval', interval=1000, disabled=True)
+                                 ], style={'width': '49%', 'padding': '10px 0'}),
+                                 html.Div([
+                                     dcc.Graph(
+                                         id='sweden-choropleth',
+                                         figure=dict(
+                                             data=[dict(
+                                                 zauto=True,
+                                                 marker_opacity=0.8,
+                                                 marker_line_width=0,
+                                                 visible=True,
+                                                 type='choroplethmapbox'
+                                             )],
+                                             layout=dict(
+                                                 mapbox=dict(
+                                                     layers=[],
+                                                     style="carto-positron",
+                                                     zoom=5,
+                                                     center={"lat": 57.78145, "lon": 14.15618},
+                                                 ),
+                                                 margin={"r": 0, "t": 5, "l": 0, "b": 0},
+                                                 clickmode='event+select'
+                                             )
+                                         )
                                      )
-                                 ], style={'width': '30%', 'display': 'inline-block'}),
-                             ], style={'width': '50%'}),
-                             html.Div([
-                                 dcc.Graph(
-                                     id='sweden-choropleth',
-                                     figure=dict(
-                                         data=[dict(
-                                             zauto=True,
-                                             marker_opacity=0.8,
-                                             marker_line_width=0,
-                                             visible=True,
-                                             type='choroplethmapbox'
-                                         )],
-                                         layout=dict(
-                                             mapbox=dict(
-                                                 layers=[],
-                                                 style="carto-positron",
-                                                 zoom=5,
-                                                 center={"lat": 57.78145, "lon": 14.15618},
-                                             ),
-                                             margin={"r": 0, "t": 5, "l": 0, "b": 0},
-                                             clickmode='event+select'
+                                 ], style={'display': 'inline-block', 'width': '49%'}),
+                                 html.Div([
+                                     dcc.Graph(
+                                         id='sweden-timeseries',
+                                         figure=dict(
+                                             data=[dict(
+                                                 mode='lines+markers',
+                                                 type='scatter'
+                                             )]
                                          )
                                      )
-                                 )
-                             ], style={'display': 'inline-block', 'width': '49%'}),
-                             html.Div([
-                                 dcc.Graph(
-                                     id='sweden-timeseries',
-                                     figure=dict(
-                                         data=[dict(
-                                             mode='lines+markers',
-                                             type='scatter'
-                                         )]
+                                 ], style={'display': 'inline-block', 'width': '49%'})
+                             ]),
+
+                     # Tab for data table
+                     dcc.Tab(label='Data',
+                             className='custom-tab',
+                             selected_className='custom-tab--selected',
+                             children=[
+                                 html.Div([
+                                     html.A('Download CSV', id='export-csv', href=''),
+                                     ' | ',
+                                     html.A('Download Parquet', id='export-parquet', href='')
+                                 ], style={'padding': '10px'}),
+                                 html.Div([
+                                     dash_table.DataTable(
+                                         id='table-data',
+                                         style_cell={'minWidth': '0px', 'maxWidth': '80px', },
+                                         fixed_rows={'headers': True, 'data': 0},
+                                         page_action='custom',
+                                         page_current=0,
+                                         page_count=1,
+                                         page_size=TABLE_PAGE_SIZE,
+                                         sort_action='custom',
+                                         sort_mode='multi',
+                                         sort_by=[],
+                                         filter_action='custom',
+                                         filter_query=''
+                                     )
+                                 ], style={'padding': '10px'})
+                             ]),
+
+                     # Tab for query details
+                     dcc.Tab(label='Query',
+                             className='custom-tab',
+                             selected_className='custom-tab--selected',
+                             children=[
+                                 html.Div([
+                                     html.P('Find table:'),
+                                     dcc.Input(
+                                         id="catalogue-search",
+                                         type="text",
+                                         placeholder='Search table titles and variables',
+                                         style={'width': '100%'}
+                                     ),
+                                     dcc.Dropdown(
+                                         id='catalogue-results',
+                                         options=[],
+                                         placeholder='Select table'
+                                     ),
+                                     html.P('Query path:'),
+                                     dcc.Input(
+                                         id="query-path",
+                                         type="text",
+                                         style={'width': '100%'}
+                                     ),
+                                     html.P('Query key:'),
+                                     dcc.Input(
+                                         id="query-key",
+                                         type="text",
+                                         style={'width': '100%'}
+                                     ),
+                                     html.P('Query name:'),
+                                     dcc.Input(
+                                         id="query-name",
+                                         type="text",
+                                         style={'width': '100%'}
+                                     ),
+                                     html.P('Query (simplified):'),
+                                     dcc.Textarea(
+                                         id="query-simplified",
+                                         rows=12,
+                                         style={'width': '100%'}
+                                     ),
+                                     html.P('Response format:'),
+                                     dcc.Dropdown(
+                                         options=[{'label': fmt.value, 'value': fmt.value} for fmt in
+                                                  ResponseFormatEnum],
+                                         value=ResponseFormatEnum.JSON.value,
+                                         clearable=False,
+                                         id='query-format'
+                                     ),
+                                     dcc.Checklist(
+                                         options=[{'label': 'Values are counts, sum regions for coarser maps',
+                                                   'value': 'additive'}],
+                                         value=[],
+                                         id='query-additive'
+                                     ),
+                                     html.Button('Save', id='query-save-button'),
+                                     html.Div(
+                                         id="query-save-result", style={'color': 'red'}
+                                     ),
+                                     html.Br(),
+                                     html.P('Query (final):'),
+                                     dcc.Markdown(
+                                         id="query-final",
+                                         children='''> No data''',
+                                     ),
+                                     html.P('Query variables:'),
+                                     dcc.Markdown(
+                                         id="query-variables",
+                                         children='''> No data''',
                                      )
-                                 )
-                             ], style={'display': 'inline-block', 'width': '49%'})
-                         ]),
-
-                 # Tab for data table
-                 dcc.Tab(label='Data',
-                         className='custom-tab',
-                         selected_className='custom-tab--selected',
-                         children=[
-                             html.Div([
-                                 dash_table.DataTable(
-                                     id='table-data',
-                                     style_cell={'minWidth': '0px', 'maxWidth': '80px', },
-                                     fixed_rows={'headers': True, 'data': 0},
-                                     virtualization=True,
-                                     page_action='none'
-                                 )
-                             ], style={'padding': '10px'})
-                         ]),
-
-                 # Tab for query details
-                 dcc.Tab(label='Query',
-                         className='custom-tab',
-                         selected_className='custom-tab--selected',
-                         children=[
-                             html.Div([
-                                 html.P('Query path:'),
-                                 dcc.Input(
-                                     id="query-path",
-                                     type="text",
-                                     style={'width': '100%'}
-                                 ),
-                                 html.P('Query key:'),
-                                 dcc.Input(
-                                     id="query-key",
-                                     type="text",
-                                     style={'width': '100%'}
-                                 ),
-                                 html.P('Query name:'),
-                                 dcc.Input(
-                                     id="query-name",
-                                     type="text",
-                                     style={'width': '100%'}
-                                 ),
-                                 html.P('Query (simplified):'),
-                                 dcc.Textarea(
-                                     id="query-simplified",
-                                     rows=12,
-                                     style={'width': '100%'}
-                                 ),
-                                 html.Button('Save', id='query-save-button'),
-                                 html.Div(
-                                     id="query-save-result", style={'color': 'red'}
-                                 ),
-                                 html.Br(),
-                                 html.P('Query (final):'),
-                                 dcc.Markdown(
-                                     id="query-final",
-                                     children='''> No data''',
-                                 ),
-                                 html.P('Query variables:'),
-                                 dcc.Markdown(
-                                     id="query-variables",
-                                     children='''> No data''',
-                                 )
-                             ], style={'padding': '10px', 'width': '60%'})
-                         ])
-             ]),
-])
+                                 ], style={'padding': '10px', 'width': '60%'})
+                             ])
+                 ]),
+    ])
+
+
+app.layout = serve_layout
 
 
 @app.callback(
-    [Output('query_collection', 'data'),
+    [Output('query_delta', 'data'),
      Output('query-save-result', 'children')],
     [Input('query-save-button', 'n_clicks')],
     [State('query_collection', 'data'),
      State('query-path', 'value'),
      State('query-key', 'value'),
      State('query-name', 'value'),
-     State('query-simplified', 'value')]
+     State('query-simplified', 'value'),
+     State('query-format', 'value'),
+     State('query-additive', 'value')]
 )
-def save_query_to_collection(n_clicks, stored_queries, path, key, name, simple_query):
+def save_query_to_collection(n_clicks, stored_token, path, key, name, simple_query, response_format, additive):
     if n_clicks is None:
         raise PreventUpdate
 
     # Initialize parameters
     status = ''
+    since: int = stored_token['version'] if stored_token is not None else 0
 
-    # Get queries from store or read defaults
-    if stored_queries is None:
-        queries = data_controller.queries
-    else:
-        queries = stored_queries
-
-    # Create new query and add it the collection
+    # Create new query and add it to the registry, only the changes are sent back
     try:
-        query: SimpleQuery = SimpleQuery(path=path, name=name, simple_query=json.loads(simple_query))
-        queries = data_controller.add_query(query_key=key, query=query, query_dict=queries)
+        query: SimpleQuery = SimpleQuery(path=path, name=name, simple_query=json.loads(simple_query),
+                                         response_format=response_format, additive='additive' in (additive or []))
+        delta: RegistryToken = data_controller.save_query(query_key=key, query=query, since=since)
     except Exception as e:
         status = 'Error: {error}'.format(error=e)
+        delta: RegistryToken = data_controller.registry.token(since=since)
 
-    # Get queries collection and store it
-    return queries, status
+    return delta, status
+
+
+# Merge changes into the query collection store without sending the collection back
+app.clientside_callback(
+    ClientsideFunction('scbdash', 'merge_query_delta'),
+    Output('query_collection', 'data'),
+    [Input('query_delta', 'data')],
+    [State('query_collection', 'data')]
+)
 
 
 @app.callback(
@@ -258,11 +385,22 @@ def save_query_to_collection(n_clicks, stored_queries, path, key, name, simple_q
      Output('query-name', 'value'),
      Output('query-key', 'value'),
      Output('query-simplified', 'value'),
+     Output('query-format', 'value'),
+     Output('query-additive', 'value'),
      Output('query-final', 'children'),
      Output('query-variables', 'children')],
-    [Input('stat-dropdown', 'value')],
-    [State('query_collection', 'data')])
-def load_query_details(statistic, stored_queries):
+    [Input('stat-dropdown', 'value'),
+     Input('catalogue-results', 'value')],
+    [State('catalogue-results', 'options')])
+def load_query_details(statistic, table_path, table_options):
+    # Table selected from the catalogue only fills in path and name
+    triggered = [itm['prop_id'] for itm in dash.callback_context.triggered]
+    if 'catalogue-results.value' in triggered:
+        if table_path is None:
+            raise PreventUpdate
+        title = next((opt['title'] for opt in table_options or [] if opt['value'] == table_path), dash.no_update)
+        return (table_path, title) + (dash.no_update,) * 6
+
     if statistic is None:
         raise PreventUpdate
 
@@ -272,26 +410,33 @@ def load_query_details(statistic, stored_queries):
     # TODO Show status in a separate DIV
     status = ''
 
-    # Get queries from store or read defaults
-    if stored_queries is None:
-        queries: Queries = data_controller.queries
-    else:
-        queries: Queries = stored_queries
-
-    # Read single query
+    # Read single query, metadata comes from the registry
     try:
-        query: SimpleQuery = data_controller.get_query(query_key=statistic, query_dict=queries)
+        query: SimpleQuery = data_controller.get_query(query_key=statistic)
         return \
             query.path, \
             query.name, \
             statistic, \
             json.dumps(query.simple_query), \
-            json_template.format(code=json.dumps([a.dict() for a in query.query], indent=4)), \
+            query.response_format, \
+            ['additive'] if query.additive else [], \
+            json_template.format(code=json.dumps(query.request_body['query'], indent=4)), \
             json_template.format(code=query.info.json(skip_defaults=True, ensure_ascii=False, indent=4))
     except Exception as e:
         status = 'Error: {error}'.format(error=e)
 
-    return '', '', '', '', '> No data', '> No data'
+    return '', '', '', '', ResponseFormatEnum.JSON.value, [], '> No data', '> No data'
+
+
+@app.callback(
+    Output('catalogue-results', 'options'),
+    [Input('catalogue-search', 'value')])
+def search_catalogue(text):
+    if not text:
+        return []
+
+    return [{'label': '{title} ({path})'.format(**itm), 'value': itm['path'], 'title': itm['title']}
+            for itm in data_controller.catalogue.search(text)]
 
 
 @app.callback(
@@ -299,71 +444,327 @@ def load_query_details(statistic, stored_queries):
      Output('stat-dropdown', 'options')],
     [Input('query_collection', 'modified_timestamp')],
     [State('query_collection', 'data')])
-def reset_after_change(ts, queries):
-    if ts is None:
+def reset_after_change(ts, registry_token):
+    if ts is None or registry_token is None:
         raise PreventUpdate
 
     # update select options too
-    options = [{'label': v["query"]['name'], 'value': k} for (k, v) in queries.items()]
-    return None, options
+    return None, registry_token['labels']
 
 
 @app.callback(
-    Output('query_data', 'data'),
+    Output('query_job', 'data'),
     [Input('stat-dropdown', 'value')],
-    [State('query_collection', 'data')])
-def clean_data(statistic, stored_queries):
+    [State('client_id', 'data')])
+def clean_data(statistic, client_id):
     if statistic is None:
+        data_controller.jobs.cancel_owner(client_id)
         raise PreventUpdate
 
-    # Get queries from store or read defaults
-    if stored_queries is None:
-        queries: Queries = data_controller.queries
-    else:
-        queries: Queries = stored_queries
+    # Data is fetched in the background, the job is polled until the result is ready
+    try:
+        job: Job = data_controller.submit_result(owner=client_id, query_key=statistic)
+    except JobLimitError as e:
+        return {'id': None, 'key': statistic, 'error': str(e)}
+
+    return {'id': job.id, 'key': statistic, 'error': None}
+
+
+@app.callback(
+    [Output('query_data', 'data'),
+     Output('job-status', 'children'),
+     Output('job-interval', 'disabled')],
+    [Input('query_job', 'data'),
+     Input('job-interval', 'n_intervals')],
+    [State('query_data', 'data')])
+def poll_job(job_token, n_intervals, query_data):
+    if job_token is None:
+        raise PreventUpdate
+
+    if job_token['id'] is None:
+        return dash.no_update, 'Error: {error}'.format(error=job_token['error']), True
+
+    job: Job = data_controller.jobs.get(job_token['id'])
+    if job is None or job.state == JobStateEnum.CANCELLED:
+        return dash.no_update, '', True
+    if job.state == JobStateEnum.FAILED:
+        return dash.no_update, 'Error: {error}'.format(error=job.error), True
+    if job.state != JobStateEnum.DONE:
+        return dash.no_update, '{message} ({progress:.0%})'.format(message=job.message or 'Queued',
+                                                                    progress=job.progress), False
+
+    # Expired data is delivered first and again once the revalidation replaced it
+    status = data_controller.result_status(query_key=job.key)
+    if query_data is not None and query_data.get('FETCHED_AT') == status['fetched_at'] and \
+            query_data.get('STALE') == status['stale']:
+        return dash.no_update, get_data_status(query_data, status['revalidating']), not status['revalidating']
 
     # get data
-    data_dict = data_controller.data_dict(query_key=statistic, query_dict=queries)
-    return data_dict
+    data_dict = data_controller.data_dict(query_key=job.key, budget=get_budget('TABLE'))
+    return data_dict, get_data_status(data_dict, status['revalidating']), not status['revalidating']
 
 
 @app.callback(
     [Output('table-data', 'columns'),
-     Output('table-data', 'data')],
-    [Input('query_data', 'modified_timestamp')],
-    [State('query_data', 'data')])
-def display_columsn(ts, data_dict):
-    if ts is None:
+     Output('table-data', 'page_current'),
+     Output('table-data', 'page_count')],
+    [Input('query_data', 'modified_timestamp'),
+     Input('table-data', 'sort_by'),
+     Input('table-data', 'filter_query')],
+    [State('table-data', 'page_size'),
+     State('stat-dropdown', 'value')])
+def display_columns(ts, sort_by, filter_query, page_size, statistic):
+    if ts is None or statistic is None:
         raise PreventUpdate
 
-    return get_dataframe_cols(data_dict), get_dataframe(data_dict)
+    # New data, sort orders and filters start on the first page, pages end with the filtered rows
+    result: QueryResult = data_controller.get_result(query_key=statistic, budget=get_budget('TABLE'))
+    triggered = [itm['prop_id'] for itm in dash.callback_context.triggered]
+    columns = dash.no_update if all(itm.startswith('table-data.') for itm in triggered) else \
+        get_dataframe_cols(result)
+    page_count: int = math.ceil(result.row_count(filter_query) / (page_size or TABLE_PAGE_SIZE))
+
+    return columns, 0, max(page_count, 1)
 
 
 @app.callback(
-    Output('sweden-choropleth', 'figure'),
+    Output('table-data', 'data'),
+    [Input('query_data', 'modified_timestamp'),
+     Input('table-data', 'page_current'),
+     Input('table-data', 'page_size'),
+     Input('table-data', 'sort_by'),
+     Input('table-data', 'filter_query')],
+    [State('stat-dropdown', 'value')])
+def display_page(ts, page_current, page_size, sort_by, filter_query, statistic):
+    if ts is None or statistic is None:
+        raise PreventUpdate
+
+    # Only the visible page is sent, paging, sorting and filtering run on the cached result
+    result: QueryResult = data_controller.get_result(query_key=statistic, budget=get_budget('TABLE'))
+    return result.page(page_current or 0, page_size or TABLE_PAGE_SIZE, sort_by=sort_by, filter_query=filter_query)
+
+
+@app.callback(
+    [Output('export-csv', 'href'),
+     Output('export-parquet', 'href')],
+    [Input('stat-dropdown', 'value')])
+def update_export_links(statistic):
+    if statistic is None:
+        return '', ''
+
+    return '/export/{}.{}'.format(statistic, ExportFormatEnum.CSV.value), \
+           '/export/{}.{}'.format(statistic, ExportFormatEnum.PARQUET.value)
+
+
+@app.callback(
+    Output('map_geometry', 'data'),
+    [Input('map-dropdown', 'value')])
+def load_map_geometry(map_key):
+    # With vector tiles the geometries are not sent to the browser
+    if data_controller.tiles_enabled:
+        raise PreventUpdate
+
+    return data_controller.map_dict(map_key=map_key)
+
+
+@app.callback(
+    [Output('map_values', 'data'),
+     Output('year-slider', 'max'),
+     Output('year-slider', 'marks')],
     [Input('query_data', 'modified_timestamp'),
+     Input('map-dropdown', 'value')],
+    [State('stat-dropdown', 'value')])
+def prepare_map_values(ts, map_key, statistic):
+    if ts is None or statistic is None:
+        raise PreventUpdate
+
+    # Result is pivoted once, the first slider position shows all years. Coarser maps are rolled up
+    # from the loaded result.
+    matrix: RegionYearMatrix = data_controller.region_year_matrix(query_key=statistic, map_key=map_key,
+                                                                  budget=get_budget('MAP'))
+    marks = {0: 'All', **{i + 1: year for i, year in enumerate(matrix.years)}}
+
+    return get_map_values(matrix), len(matrix.years), marks
+
+
+@app.callback(
+    Output('map_style', 'data'),
+    [Input('map_values', 'data'),
      Input('classifier-dropdown', 'value')],
-    [State('query_data', 'data')])
-def display_selected_data(ts, classifier, data_dict):
-    if ts is None:
+    [State('stat-dropdown', 'value'),
+     State('map-dropdown', 'value')])
+def prepare_map_style(map_values, classifier, statistic, map_key):
+    if map_values is None or statistic is None:
+        raise PreventUpdate
+
+    matrix: RegionYearMatrix = data_controller.region_year_matrix(query_key=statistic, map_key=map_key,
+                                                                  budget=get_budget('MAP'))
+    if numpy.isnan(matrix.values).all():
+        raise PreventUpdate
+
+    tile_url = None
+    if data_controller.tiles_enabled:
+        # Template for absolute tile URLs, mapbox fills in the tile coordinates
+        tile_url = '{host}tiles/{map_key}/'.format(host=flask.request.host_url,
+                                                   map_key=data_controller.resolve_map_key(map_key))
+        tile_url += '{z}/{x}/{y}.pbf'
+
+    return get_map_style(matrix, classifier, tile_url=tile_url)
+
+
+# Figure is assembled on client side from the stored geometry, values and colors of the selected year
+app.clientside_callback(
+    ClientsideFunction('scbdash', 'map_figure'),
+    Output('sweden-choropleth', 'figure'),
+    [Input('map_values', 'data'),
+     Input('map_style', 'data'),
+     Input('year-slider', 'value')],
+    [State('map_geometry', 'data')]
+)
+
+
+@app.callback(
+    [Output('year-interval', 'disabled'),
+     Output('year-play', 'children')],
+    [Input('year-play', 'n_clicks')],
+    [State('year-interval', 'disabled')])
+def toggle_animation(n_clicks, disabled):
+    if n_clicks is None:
         raise PreventUpdate
 
-    print(data_dict)
-    fig = get_map_chart(data_dict, data_controller.map_dict(), classifier)
-    return fig
+    return not disabled, 'Play' if not disabled else 'Pause'
+
+
+# Animation steps through the years on client side
+app.clientside_callback(
+    ClientsideFunction('scbdash', 'next_year'),
+    Output('year-slider', 'value'),
+    [Input('year-interval', 'n_intervals')],
+    [State('year-slider', 'value'),
+     State('year-slider', 'max')]
+)
 
 
 @app.callback(
     Output('sweden-timeseries', 'figure'),
-    [Input('query_data', 'modified_timestamp')],
-    [State('query_data', 'data')])
-def display_selected_data(ts, data_dict):
-    if ts is None:
+    [Input('query_data', 'modified_timestamp'),
+     Input('sweden-choropleth', 'clickData'),
+     Input('sweden-choropleth', 'selectedData')],
+    [State('stat-dropdown', 'value'),
+     State('map-dropdown', 'value')])
+def display_selected_data(ts, click_data, selected_data, statistic, map_key):
+    if ts is None or statistic is None:
         raise PreventUpdate
 
-    print(data_dict)
-    fig = get_line_chart(data_dict)
-    return fig
+    # Clicked or selected regions are summed from their rows of the result, a new statistic shows the whole country
+    triggered = [itm['prop_id'] for itm in dash.callback_context.triggered]
+    regions = None
+    if 'sweden-choropleth.clickData' in triggered:
+        regions = data_controller.selected_regions(click_data, map_key=map_key)
+    elif 'sweden-choropleth.selectedData' in triggered:
+        regions = data_controller.selected_regions(selected_data, map_key=map_key)
+
+    # National series is aggregated by the API, one row per year. It does not depend on the selected map.
+    budget = get_budget('SERIES')
+    result: QueryResult = data_controller.get_result(query_key=statistic, budget=budget)
+    if regions is None:
+        df = data_controller.time_series(query_key=statistic, budget=budget)
+    else:
+        df = data_controller.time_series(query_key=statistic, map_key=map_key, regions=regions, budget=budget)
+
+    return get_line_chart(df, result.value_col)
+
+
+@app.server.route('/tiles/<map_key>/<int:z>/<int:x>/<int:y>.pbf')
+def serve_tile(map_key, z, x, y):
+    keys = flask.request.args.get('keys')
+    tile = data_controller.get_tile(z, x, y, map_key=map_key, keys=keys.split(',') if keys is not None else None)
+
+    # Empty tiles are not sent
+    if tile is None:
+        return flask.Response(status=204)
+
+    return flask.Response(tile, mimetype='application/x-protobuf', headers={'Cache-Control': 'public, max-age=3600'})
+
+
+@app.server.route('/catalogue/search')
+def search_tables():
+    limit = flask.request.args.get('limit', 20, type=int)
+    return flask.jsonify(data_controller.catalogue.search(flask.request.args.get('q', ''), limit=limit))
+
+
+@app.server.route('/catalogue/suggest')
+def suggest_terms():
+    limit = flask.request.args.get('limit', 10, type=int)
+    return flask.jsonify(data_controller.catalogue.suggest(flask.request.args.get('q', ''), limit=limit))
+
+
+@app.server.route('/stats/requests')
+def request_stats():
+    return flask.jsonify(data_controller.request_stats())
+
+
+@app.server.route('/analytics')
+def analytics():
+    query_keys = [key for key in flask.request.args.get('queries', '').split(',') if key]
+    map_key = flask.request.args.get('map_key')
+    if len(query_keys) == 0 or any(key not in data_controller.registry for key in query_keys) or \
+            (map_key is not None and map_key not in data_controller.map_keys):
+        flask.abort(404)
+
+    cube = data_controller.analytics(query_keys=query_keys, map_key=map_key, budget=get_budget('DATA'))
+    year = flask.request.args.get('year', cube.years[-1] if len(cube.years) > 0 else None)
+    correlation_year = flask.request.args.get('correlation_year')
+    if any(itm is not None and itm not in cube.years for itm in [year, correlation_year]):
+        flask.abort(404)
+
+    # NaN is not valid JSON, missing values are sent as null
+    correlation = cube.correlation_frame(year=correlation_year)
+    regions = cube.year_frame(year) if year is not None else pandas.DataFrame()
+    return flask.Response(json.dumps({
+        'statistics': cube.statistics,
+        'years': cube.years,
+        'year': year,
+        'correlation': correlation.astype(object).where(correlation.notnull(), None).values.tolist(),
+        'regions': regions.astype(object).where(regions.notnull(), None).to_dict('records'),
+    }), mimetype='application/json')
+
+
+@app.server.route('/admin/memory')
+def memory_report():
+    # Memory ledger lists query keys and sizes, it is only served where it is enabled
+    if Config.memory('REPORT').lower() != 'true':
+        flask.abort(404)
+
+    return flask.jsonify(data_controller.memory_report())
+
+
+@app.server.route('/jobs/<job_id>')
+def job_status(job_id):
+    job: Job = data_controller.jobs.get(job_id)
+    if job is None:
+        flask.abort(404)
+
+    return flask.jsonify(job.status())
+
+
+@app.server.route('/export/<query_key>.<file_format>')
+def export_result(query_key, file_format):
+    if file_format not in [fmt.value for fmt in ExportFormatEnum] or query_key not in data_controller.registry:
+        flask.abort(404)
+
+    file_name = '{key}.{ext}'.format(key=query_key, ext=file_format)
+
+    # Plain CSV downloads are streamed from the cached result chunk by chunk
+    if file_format == ExportFormatEnum.CSV.value and flask.request.range is None:
+        result: QueryResult = data_controller.get_result(query_key=query_key)
+        return flask.Response(flask.stream_with_context(data_controller.exporter.iter_csv(result.df)),
+                              mimetype='text/csv',
+                              headers={'Content-Disposition': 'attachment; filename={}'.format(file_name)})
+
+    # Parquet and resumed downloads are served from the export file, with support for range requests
+    path = data_controller.export_result(query_key=query_key, file_format=file_format)
+    return flask.send_file(str(path), as_attachment=True, attachment_filename=file_name, conditional=True)
 
 
 if __name__ == '__main__':
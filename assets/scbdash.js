@@ -0,0 +1,66 @@
+window.scbdash = Object.assign({}, window.scbdash, {
+    // Merge registry changes into the query collection store
+    merge_query_delta: function(delta, collection) {
+        if (!delta) {
+            return collection;
+        }
+        if (!collection || delta.version < collection.version) {
+            return collection || delta;
+        }
+
+        var labels = collection.labels.filter(function(label) {
+            return !delta.labels.some(function(changed) { return changed.value === label.value; });
+        });
+
+        return {version: delta.version, labels: labels.concat(delta.labels)};
+    },
+
+    // Build choropleth from the geometry kept in the browser and the values and colors of the selected year
+    map_figure: function(values, style, year, geometry) {
+        var frame = (values && year && year <= values.years.length) ? year - 1 : -1;
+        var layout = {
+            mapbox: {
+                layers: [],
+                style: 'carto-positron',
+                zoom: 5,
+                center: {lat: 57.78145, lon: 14.15618}
+            },
+            margin: {r: 0, t: 5, l: 0, b: 0},
+            clickmode: 'event+select',
+            uirevision: 'map'
+        };
+
+        if (style) {
+            layout.mapbox.layers = (frame >= 0 ? style.layers[frame] : style.total_layers) || [];
+        }
+
+        if (!values || !style || !geometry) {
+            // Vector tile layers draw the regions, the trace only keeps the map visible
+            return {data: [{lat: [], lon: [], type: 'scattermapbox'}], layout: layout};
+        }
+
+        return {
+            data: [{
+                geojson: geometry,
+                locations: values.locations,
+                z: frame >= 0 ? values.frames[frame] : values.total,
+                colorscale: frame >= 0 ? style.colorscale : style.total_colorscale,
+                zmin: frame >= 0 ? style.zmin : style.total_zmin,
+                zmax: frame >= 0 ? style.zmax : style.total_zmax,
+                zauto: false,
+                marker: {opacity: 0.8, line: {width: 0}},
+                visible: true,
+                type: 'choroplethmapbox'
+            }],
+            layout: layout
+        };
+    },
+
+    // Next year of the animation, the first slider position (all years) is skipped
+    next_year: function(n_intervals, year, max) {
+        if (!max) {
+            return 0;
+        }
+        return (year || 0) % max + 1;
+    }
+});
@@ -1,8 +1,43 @@
-from .scbconfig import *
+import importlib
 
-Config.initialize()
+# Public names and the modules defining them. Modules are imported on first access,
+# so importing the package does not load pandas, geopandas or boto3.
+_EXPORTS = {
+    'Config': 'scbconfig',
+    'MappingTools': 'scbutils',
+    'Colorscale': 'scbutils',
+    'QueryTypesEnum': 'scbstat',
+    'ResponseFormatEnum': 'scbstat',
+    'ResultColumn': 'scbstat',
+    'FilterSelection': 'scbstat',
+    'FilterItem': 'scbstat',
+    'QueryVariable': 'scbstat',
+    'QueryInfo': 'scbstat',
+    'BaseQuery': 'scbstat',
+    'CalcQuery': 'scbstat',
+    'Query': 'scbstat',
+    'SimpleQuery': 'scbstat',
+    'MERCATOR_ORIGIN': 'scbmap',
+    'TileIndex': 'scbmap',
+    'RegionEnum': 'scbmap',
+    'Region': 'scbmap',
+    'VectorTiles': 'scbmap',
+    'MapHandler': 'scbmap',
+    'DataController': 'scbcontroller',
+    'QueryDataTemplate': 'scbcontroller',
+}
 
-from .scbutils import *
-from .scbstat import *
-from .scbmap import *
-from .scbcontroller import *
+__all__ = list(_EXPORTS.keys())
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+    value = getattr(importlib.import_module('.' + _EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
@@ -0,0 +1,70 @@
+import argparse
+
+from scbapi.scbconfig import Config
+from scbapi.scbstartup import import_report
+
+
+def build_snapshot(folder: str, local_path: str, workers: int, query_keys=None):
+    """
+    Fetch all default queries within the API rate limit and write them to a snapshot
+    """
+    from scbapi.scbcontroller import DataController
+    from scbapi.scbsnapshot import SnapshotBuilder, RateLimiter, RateLimitedAdapter
+    from scbapi.scbstat import get_session
+
+    limiter = RateLimiter(calls=int(Config.snapshot('RATE_CALLS')), period=float(Config.snapshot('RATE_PERIOD')))
+    get_session().mount(Config.api('URL'), RateLimitedAdapter(limiter, pool_maxsize=workers))
+
+    controller = DataController(local_path=local_path, registry_path=':memory:')
+    manifest = SnapshotBuilder(controller, folder=folder, workers=workers).build(query_keys=query_keys)
+
+    for key, entry in manifest['queries'].items():
+        print('{}: {} rows in {} files'.format(key, entry['rows'], len(entry['files'])))
+
+
+def crawl_catalogue(path: str):
+    """
+    Refresh the table catalogue within the API rate limit
+    """
+    from scbapi.scbcontroller import DataController
+    from scbapi.scbcatalogue import TableCatalogue
+
+    catalogue = TableCatalogue(Config.path(Config.catalogue('DATABASE')))
+    changed = catalogue.crawl(DataController.fetch_catalogue, path=path)
+    print('{} tables, {} changed'.format(len(catalogue), changed))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m scbapi')
+    commands = parser.add_subparsers(dest='command')
+
+    importtime = commands.add_parser('importtime', help='report where import time is spent')
+    importtime.add_argument('statement', nargs='?', default='import scbapi',
+                            help='import statement to measure, e.g. "from scbapi.scbstat import QueryInfo"')
+    importtime.add_argument('--top', type=int, default=15, help='number of packages and modules listed')
+
+    snapshot = commands.add_parser('snapshot', help='write results of all default queries to a Parquet snapshot')
+    snapshot.add_argument('--folder', default=Config.path(Config.snapshot('FOLDER')), help='snapshot folder')
+    snapshot.add_argument('--local-path', default=Config.path(Config.fixtures('FOLDER')),
+                          help='folder with map and query definitions, empty to load them from S3')
+    snapshot.add_argument('--workers', type=int, default=int(Config.snapshot('WORKERS')),
+                          help='number of queries fetched in parallel')
+    snapshot.add_argument('query_keys', nargs='*', help='queries to include, by default all')
+
+    catalogue = commands.add_parser('catalogue', help='crawl the API navigation tree into the table catalogue')
+    catalogue.add_argument('--path', default='', help='level below the API root to crawl, by default all')
+
+    args = parser.parse_args(argv)
+    if args.command == 'importtime':
+        print(import_report(statement=args.statement, top=args.top))
+    elif args.command == 'snapshot':
+        build_snapshot(folder=args.folder, local_path=args.local_path or None, workers=args.workers,
+                       query_keys=args.query_keys or None)
+    elif args.command == 'catalogue':
+        crawl_catalogue(path=args.path)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+from typing import Any, Dict, List
+
+import numpy
+import pandas
+
+from scbapi.scbresult import RegionYearMatrix
+
+
+class AnalyticsCube(object):
+    """
+    Dense region x year x statistic cube of several query results, rows are aligned to the map keys and years
+    to the union of the result years. Missing values are NaN. Z-scores, ranks, changes from the previous year
+    and correlations between statistics are computed once for the whole cube.
+    """
+
+    def __init__(self, matrices: List[RegionYearMatrix], statistics: List[str]):
+        keys: List[str] = matrices[0].keys if len(matrices) > 0 else []
+        if any(matrix.keys != keys for matrix in matrices):
+            raise ValueError('matrices are not aligned to the same regions')
+
+        self.keys: List[str] = list(keys)
+        self.statistics: List[str] = list(statistics)
+        self.years: List[str] = sorted({year for matrix in matrices for year in matrix.years})
+
+        year_positions: Dict[str, int] = {year: pos for pos, year in enumerate(self.years)}
+        self.values: numpy.ndarray = numpy.full((len(self.keys), len(self.years), len(matrices)), numpy.nan)
+        for pos, matrix in enumerate(matrices):
+            self.values[:, [year_positions[year] for year in matrix.years], pos] = matrix.values
+
+        self._compute()
+
+    def _compute(self):
+        """
+        Derived measures of all regions, years and statistics
+        """
+        values: numpy.ndarray = self.values
+        valid: numpy.ndarray = ~numpy.isnan(values)
+        filled: numpy.ndarray = numpy.where(valid, values, 0.0)
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # Z-scores across the regions of each year and statistic
+            count: numpy.ndarray = valid.sum(axis=0)
+            mean: numpy.ndarray = filled.sum(axis=0) / count
+            std: numpy.ndarray = numpy.sqrt(numpy.where(valid, (values - mean) ** 2, 0.0).sum(axis=0) / count)
+            self.zscores: numpy.ndarray = numpy.where(std > 0, (values - mean) / std, numpy.nan)
+
+            # Change from the previous year
+            self.deltas: numpy.ndarray = numpy.full(values.shape, numpy.nan)
+            self.deltas[:, 1:, :] = values[:, 1:, :] - values[:, :-1, :]
+            self.growth: numpy.ndarray = numpy.full(values.shape, numpy.nan)
+            self.growth[:, 1:, :] = numpy.where(values[:, :-1, :] != 0, self.deltas[:, 1:, :] / values[:, :-1, :],
+                                                numpy.nan)
+
+            # Pairwise complete sums over the regions of each year, statistics in both orders
+            pairs: numpy.ndarray = valid.astype(float)
+            n: numpy.ndarray = numpy.einsum('rys,ryt->yst', pairs, pairs)
+            sum_x: numpy.ndarray = numpy.einsum('rys,ryt->yst', filled, pairs)
+            sum_xx: numpy.ndarray = numpy.einsum('rys,ryt->yst', filled ** 2, pairs)
+            sum_xy: numpy.ndarray = numpy.einsum('rys,ryt->yst', filled, filled)
+            self.correlation: numpy.ndarray = self._correlation(n, sum_x, sum_xx, sum_xy)
+            self.pooled_correlation: numpy.ndarray = self._correlation(n.sum(axis=0), sum_x.sum(axis=0),
+                                                                       sum_xx.sum(axis=0), sum_xy.sum(axis=0))
+
+        # Rank 1 is the highest value of the year, ties keep the map order and missing values have no rank
+        order: numpy.ndarray = numpy.argsort(numpy.where(valid, -values, numpy.inf), axis=0, kind='mergesort')
+        ranks: numpy.ndarray = numpy.empty(values.shape)
+        numpy.put_along_axis(ranks, order, numpy.arange(1, len(self.keys) + 1, dtype=float)[:, None, None],
+                             axis=0)
+        self.ranks: numpy.ndarray = numpy.where(valid, ranks, numpy.nan)
+
+    @staticmethod
+    def _correlation(n: numpy.ndarray, sum_x: numpy.ndarray, sum_xx: numpy.ndarray,
+                     sum_xy: numpy.ndarray) -> numpy.ndarray:
+        """
+        Pearson correlation from pairwise sums, the last two axes are the statistic pairs. Sums of the
+        second statistic are the transposed sums of the first.
+        """
+        sum_y: numpy.ndarray = numpy.swapaxes(sum_x, -1, -2)
+        sum_yy: numpy.ndarray = numpy.swapaxes(sum_xx, -1, -2)
+        cov: numpy.ndarray = sum_xy - sum_x * sum_y / n
+        var_x: numpy.ndarray = sum_xx - sum_x ** 2 / n
+        var_y: numpy.ndarray = sum_yy - sum_y ** 2 / n
+        denominator: numpy.ndarray = numpy.sqrt(var_x * var_y)
+
+        return numpy.where((n > 1) & (denominator > 0), cov / denominator, numpy.nan)
+
+    def correlation_frame(self, year: str = None) -> pandas.DataFrame:
+        """
+        Correlation between the statistics over the regions of the year, or over all regions and years
+        """
+        values: numpy.ndarray = self.pooled_correlation if year is None else \
+            self.correlation[self.years.index(year)]
+        return pandas.DataFrame(values, index=self.statistics, columns=self.statistics)
+
+    def year_frame(self, year: str) -> pandas.DataFrame:
+        """
+        Value, z-score, rank and change from the previous year of each statistic for the regions of the year
+        """
+        pos: int = self.years.index(year)
+        columns: Dict[str, Any] = {'region': self.keys}
+        for stat_pos, statistic in enumerate(self.statistics):
+            for measure, values in [('value', self.values), ('zscore', self.zscores), ('rank', self.ranks),
+                                    ('delta', self.deltas), ('growth', self.growth)]:
+                columns['{}_{}'.format(statistic, measure)] = values[:, pos, stat_pos]
+
+        return pandas.DataFrame(columns)
@@ -0,0 +1,93 @@
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, Dict, Tuple, Type
+
+
+class CircuitStateEnum(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a service which is failing
+    """
+    pass
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls to a failing service. The circuit opens after a number of consecutive failures and rejects
+    calls until the reset timeout has passed, then a single trial call decides if it closes again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self._failure_threshold: int = failure_threshold
+        self._reset_timeout: float = reset_timeout
+        self._lock: threading.Lock = threading.Lock()
+        self._state: CircuitStateEnum = CircuitStateEnum.CLOSED
+        self._failures: int = 0
+        self._opened: float = 0.0
+        self._trial: bool = False
+        self._rejected: int = 0
+
+    @property
+    def state(self) -> CircuitStateEnum:
+        with self._lock:
+            if self._state == CircuitStateEnum.OPEN and time.monotonic() - self._opened >= self._reset_timeout:
+                return CircuitStateEnum.HALF_OPEN
+            return self._state
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {'state': self.state.value, 'failures': self._failures, 'rejected': self._rejected}
+
+    def call(self, call: Callable[[], Any], failures: Tuple[Type[BaseException], ...] = (Exception,)) -> Any:
+        """
+        Run the call if the circuit allows it. Exceptions of the failure types count as failures.
+        """
+        with self._lock:
+            if self._state == CircuitStateEnum.OPEN:
+                if time.monotonic() - self._opened < self._reset_timeout or self._trial:
+                    self._rejected += 1
+                    raise CircuitOpenError('service unavailable, retry later')
+                # Let one call through to test the service
+                self._trial = True
+
+        try:
+            result: Any = call()
+        except failures:
+            with self._lock:
+                self._failures += 1
+                if self._state == CircuitStateEnum.OPEN or self._failures >= self._failure_threshold:
+                    self._state = CircuitStateEnum.OPEN
+                    self._opened = time.monotonic()
+            raise
+        finally:
+            # Other exceptions don't decide the trial, the next call is let through again
+            with self._lock:
+                self._trial = False
+
+        with self._lock:
+            self._failures = 0
+            self._state = CircuitStateEnum.CLOSED
+
+        return result
+
+    def call_with_retry(self, call: Callable[[], Any], failures: Tuple[Type[BaseException], ...] = (Exception,),
+                        attempts: int = 3, backoff: float = 0.5) -> Any:
+        """
+        Run the call through the circuit, failed attempts are retried with exponential backoff.
+        Calls rejected by an open circuit are not retried.
+        """
+        for attempt in range(attempts):
+            try:
+                return self.call(call, failures=failures)
+            except CircuitOpenError:
+                raise
+            except failures:
+                if attempt == attempts - 1:
+                    raise
+                time.sleep(backoff * 2 ** attempt)
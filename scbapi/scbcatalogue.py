@@ -0,0 +1,184 @@
+import bisect
+import json
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+
+from scbapi.scbstat import QueryInfo
+
+# Fetches JSON content of a path below the API root
+Fetch = Callable[[str], Any]
+SearchResult = Dict[str, str]
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower case words of the text
+    """
+    return TOKEN.findall(text.lower())
+
+
+class TableCatalogue(object):
+    """
+    Local copy of the PX-Web navigation tree with an inverted index over table titles and variable texts.
+    The index is kept in memory, so searches do not touch the database or the API.
+    """
+    _conn: sqlite3.Connection = None
+    _lock: threading.RLock = None
+
+    def __init__(self, database: str = ':memory:'):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS tables ('
+                'path TEXT PRIMARY KEY, '
+                'title TEXT NOT NULL, '
+                'updated TEXT, '
+                'variables TEXT NOT NULL)'
+            )
+            self._conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+
+        # Inverted index from term to table paths, and the sorted terms for prefix lookups. Terms are sorted
+        # again on the next lookup after a change, not for every table of a crawl.
+        self._docs: Dict[str, Tuple[str, str]] = {}
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._index: Dict[str, Set[str]] = {}
+        self._terms: List[str] = []
+        self._terms_dirty: bool = False
+
+        with self._lock:
+            for path, title, updated, variables in self._conn.execute('SELECT * FROM tables'):
+                self._add_doc(path, title, updated, json.loads(variables))
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    @property
+    def crawled_at(self) -> float:
+        """
+        Time of the last completed crawl, 0 if never crawled
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM state WHERE key = 'crawled_at'").fetchone()
+        return float(row[0]) if row is not None else 0.0
+
+    def walk(self, fetch: 'Fetch', path: str = '') -> Iterator[Dict[str, str]]:
+        """
+        Walk the navigation tree below the path and yield the tables with their path, title and update time
+        """
+        levels: List[str] = [path]
+        while levels:
+            level: str = levels.pop()
+            for itm in fetch(level):
+                if itm['type'] == 'l':
+                    levels.append(level + itm['id'] + '/')
+                elif itm['type'] == 't':
+                    yield {'path': level + itm['id'], 'title': itm['text'], 'updated': itm.get('updated')}
+
+    def crawl(self, fetch: 'Fetch', path: str = '') -> int:
+        """
+        Refresh the catalogue from the navigation tree. Metadata is only fetched for new and updated tables,
+        removed tables are dropped. Returns the number of changed tables.
+        """
+        with self._lock:
+            known: Dict[str, str] = dict(self._conn.execute('SELECT path, updated FROM tables'))
+
+        changed: int = 0
+        seen: Set[str] = set()
+        for table in self.walk(fetch, path):
+            seen.add(table['path'])
+            if table['path'] in known and known[table['path']] == table['updated']:
+                continue
+
+            info: QueryInfo = QueryInfo(**fetch(table['path']))
+            self.put(table['path'], table['title'], table['updated'], [var.text for var in info.variables])
+            changed += 1
+
+        for removed in set(known.keys()) - seen:
+            if removed.startswith(path):
+                self.remove(removed)
+                changed += 1
+
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) VALUES ('crawled_at', ?)",
+                               (str(time.time()),))
+
+        return changed
+
+    def put(self, path: str, title: str, updated: str, variables: List[str]):
+        """
+        Add or replace table in the catalogue and the index
+        """
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO tables (path, title, updated, variables) VALUES (?, ?, ?, ?)',
+                               (path, title, updated, json.dumps(variables, ensure_ascii=False)))
+            self._remove_doc(path)
+            self._add_doc(path, title, updated, variables)
+
+    def remove(self, path: str):
+        """
+        Remove table from the catalogue and the index
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM tables WHERE path = ?', (path,))
+            self._remove_doc(path)
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[str]:
+        """
+        Indexed terms starting with the prefix, for autocomplete
+        """
+        prefix = prefix.lower().strip()
+        with self._lock:
+            if self._terms_dirty:
+                self._terms = sorted(self._index.keys())
+                self._terms_dirty = False
+            terms: List[str] = self._terms
+        start: int = bisect.bisect_left(terms, prefix)
+        end: int = bisect.bisect_left(terms, prefix + '\uffff')
+        return terms[start:min(end, start + limit)]
+
+    def search(self, text: str, limit: int = 20) -> List['SearchResult']:
+        """
+        Tables matching all words of the text, the last word is matched as a prefix. Tables with
+        the words in the title are ranked first.
+        """
+        words: List[str] = tokenize(text)
+        if len(words) == 0:
+            return []
+
+        with self._lock:
+            paths: Set[str] = None
+            for i, word in enumerate(words):
+                terms: List[str] = [word] if i < len(words) - 1 else self.suggest(word, limit=len(self._index))
+                matches: Set[str] = set().union(*[self._index.get(term, set()) for term in terms])
+                paths = matches if paths is None else paths & matches
+
+            docs: List[Tuple[str, Tuple[str, str]]] = [(path, self._docs[path]) for path in paths]
+
+        def rank(doc: Tuple[str, Tuple[str, str]]) -> Tuple[int, str]:
+            title_words: List[str] = tokenize(doc[1][0])
+            hits: int = sum(1 for word in words if any(term.startswith(word) for term in title_words))
+            return -hits, doc[1][0]
+
+        return [{'path': path, 'title': title, 'updated': updated}
+                for path, (title, updated) in sorted(docs, key=rank)[:limit]]
+
+    def _add_doc(self, path: str, title: str, updated: str, variables: List[str]):
+        self._docs[path] = (title, updated)
+        self._doc_terms[path] = set(tokenize(' '.join([title] + variables)))
+        self._terms_dirty = True
+        for term in self._doc_terms[path]:
+            self._index.setdefault(term, set()).add(path)
+
+    def _remove_doc(self, path: str):
+        self._docs.pop(path, None)
+        self._terms_dirty = True
+        for term in self._doc_terms.pop(path, set()):
+            self._index[term].discard(path)
+            if len(self._index[term]) == 0:
+                del self._index[term]
@@ -5,20 +5,72 @@ import pathlib
 class Config:
 
     configParser = ConfigParser()
-    configFilePath = pathlib.Path.cwd() / 'scbapi/config.ini'
+    configFilePath = pathlib.Path(__file__).resolve().parent / 'config.ini'
+
+    # Relative paths in the configuration are resolved against the project folder, not the working directory
+    rootPath = pathlib.Path(__file__).resolve().parent.parent
 
     @classmethod
     def initialize(cls):
-        cls.configParser.read(cls.configFilePath)
+        cls.configParser.read(str(cls.configFilePath))
+
+    @classmethod
+    def path(cls, value):
+        if not value or value == ':memory:':
+            return value
+        return str(cls.rootPath / value)
 
     @classmethod
     def s3(cls, key):
         return cls.configParser.get('S3', key)
 
+    @classmethod
+    def storage(cls, key):
+        return cls.configParser.get('STORAGE', key)
+
     @classmethod
     def fixtures(cls, key):
         return cls.configParser.get('FIXTURES', key)
 
+    @classmethod
+    def registry(cls, key):
+        return cls.configParser.get('REGISTRY', key)
+
+    @classmethod
+    def tiles(cls, key):
+        return cls.configParser.get('TILES', key)
+
+    @classmethod
+    def export(cls, key):
+        return cls.configParser.get('EXPORT', key)
+
+    @classmethod
+    def planner(cls, key):
+        return cls.configParser.get('PLANNER', key)
+
+    @classmethod
+    def snapshot(cls, key):
+        return cls.configParser.get('SNAPSHOT', key)
+
+    @classmethod
+    def catalogue(cls, key):
+        return cls.configParser.get('CATALOGUE', key)
+
+    @classmethod
+    def jobs(cls, key):
+        return cls.configParser.get('JOBS', key)
+
+    @classmethod
+    def serving(cls, key):
+        return cls.configParser.get('SERVING', key)
+
+    @classmethod
+    def memory(cls, key):
+        return cls.configParser.get('MEMORY', key)
+
     @classmethod
     def api(cls, key):
-        return cls.configParser.get('API', key)
\ No newline at end of file
+        return cls.configParser.get('API', key)
+
+
+Config.initialize()
@@ -1,23 +1,47 @@
-import boto3
+import hashlib
 import json
 import pathlib
+import threading
+import time
 import pandas
-from botocore.handlers import disable_signing
-from typing import Any, Dict, Union
-
-from scbapi.scbmap import Region, MapHandler
-from scbapi.scbstat import SimpleQuery, QueryTypesEnum, CalcQuery
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from scbapi.scbmap import Region, MapHandler, VectorTiles
+from scbapi.scbstat import SimpleQuery, QueryTypesEnum, CalcQuery, QueryInfo, metadata_flight, \
+    data_flight, api_breaker, get_crawl_metadata
+from scbapi.scbflight import FlightStats
+from scbapi.scbplanner import QueryPlanner
+from scbapi.scbregistry import QueryRegistry, RegistryToken, definition_digest
+from scbapi.scbresult import QueryResult, RegionYearMatrix
+from scbapi.scbexport import ResultExporter
+from scbapi.scbsnapshot import SnapshotSource
+from scbapi.scbcatalogue import TableCatalogue
+from scbapi.scbjobs import Job, JobQueue
+from scbapi.scbhierarchy import RegionHierarchy
+from scbapi.scbstorage import LocalStore, S3Store, CachedStore
+from scbapi.scbmemory import deep_size
+from scbapi.scbanalytics import AnalyticsCube
 from scbapi.scbconfig import Config
 
 Query = Union[CalcQuery, SimpleQuery]
 Maps = Dict[str, MapHandler]
 Queries = Dict[str, Dict[str, Any]]
+Store = Union[LocalStore, CachedStore]
 QueryData = Dict[str, Any]
+MemoryReport = Dict[str, Any]
+
+# Categories of the memory ledger, entries are keyed by category and cache key
+MEMORY_MAPS: str = 'maps'
+MEMORY_QUERIES: str = 'queries'
+MEMORY_RESULTS: str = 'results'
+MEMORY_CUBES: str = 'cubes'
 
 QueryDataTemplate: 'QueryData' = {
     "VALUE_COLUMN": '',
-    "COLUMN_NAMES": [],
-    "DATAFRAME": {},
+    "FETCHED_AT": None,
+    "STALE": False,
 }
 
 
@@ -26,22 +50,96 @@ class DataController(object):
     _queries: 'Queries' = None
     _s3: object = None
     _path: pathlib.Path = None
-
-    def __init__(self, local_path: str = None):
+    _stores: Dict[str, 'Store'] = None
+    _stores_lock: threading.Lock = None
+    _registry: QueryRegistry = None
+    _map_dicts: Dict[str, dict] = None
+    _exporter: ResultExporter = None
+    _planner: QueryPlanner = None
+    _snapshot: SnapshotSource = None
+    _catalogue: TableCatalogue = None
+    _catalogue_refresh: threading.Thread = None
+    _jobs: JobQueue = None
+    _hierarchy: RegionHierarchy = None
+    _query_cache: 'OrderedDict[tuple, Query]' = None
+    _query_lock: threading.Lock = None
+    _result_cache: 'OrderedDict[tuple, QueryResult]' = None
+    _result_lock: threading.RLock = None
+    _cube_cache: 'OrderedDict[tuple, AnalyticsCube]' = None
+    _revalidator: ThreadPoolExecutor = None
+    _revalidations: Dict[tuple, Future] = None
+    _memory_lock: threading.RLock = None
+    _last_used: Dict[tuple, float] = None
+    _sizes: Dict[tuple, int] = None
+    _revisions: Dict[tuple, int] = None
+
+    # Number of validated query objects kept in memory
+    QUERY_CACHE_SIZE: int = 64
+
+    # Number of query results kept in memory
+    RESULT_CACHE_SIZE: int = 16
+
+    # Number of analytics cubes kept in memory
+    CUBE_CACHE_SIZE: int = 8
+
+    def __init__(self, local_path: str = None, registry_path: str = None, snapshot_path: str = None):
+        self._stores = {}
+        self._stores_lock = threading.Lock()
         if local_path is not None:
             self._path = pathlib.Path(local_path)
         else:
-            # Initialize S3 connection
+            # Initialize S3 connection, boto3 is only needed without local content
+            import boto3
+            from botocore.handlers import disable_signing
+
             self._s3 = boto3.resource('s3', region_name=Config.s3('REGION'))
             self._s3.meta.client.meta.events.register('choose-signer.s3.*', disable_signing)
 
         # Initialize maps and queries
         self._regions = {}
         self._queries = {}
-
-        # load content for maps and queries
-        self._regions = self._load_maps()
-        self._queries = self._load_queries()
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._result_cache = OrderedDict()
+        self._result_lock = threading.RLock()
+        self._cube_cache = OrderedDict()
+        self._revalidator = ThreadPoolExecutor(max_workers=int(Config.serving('WORKERS')))
+        self._revalidations = {}
+        self._memory_lock = threading.RLock()
+        self._last_used = {}
+        self._sizes = {}
+        self._revisions = {}
+        self._map_dicts = {}
+        self._planner = QueryPlanner(cell_limit=int(Config.planner('CELL_LIMIT')),
+                                     window=float(Config.planner('WINDOW')))
+        self._jobs = JobQueue(workers=int(Config.jobs('WORKERS')), owner_limit=int(Config.jobs('USER_LIMIT')),
+                              history=int(Config.jobs('HISTORY')))
+        self._exporter = ResultExporter(folder=Config.path(Config.export('FOLDER')),
+                                        chunk_rows=int(Config.export('CHUNK_ROWS')),
+                                        max_files=int(Config.export('MAX_FILES')))
+
+        # load content for maps and queries in parallel, queries of a snapshot are served without API access
+        with ThreadPoolExecutor(max_workers=int(Config.storage('WORKERS'))) as executor:
+            maps: Dict[str, Future] = self._submit_maps(executor)
+            if snapshot_path:
+                self._snapshot = SnapshotSource(snapshot_path)
+                self._queries = self._snapshot.definitions
+            else:
+                self._queries = self._load_queries(executor)
+            self._regions = {key: future.result() for key, future in maps.items()}
+        for key in self._regions.keys():
+            self._touch((MEMORY_MAPS, key))
+
+        # Pre-generate vector tiles of the maps
+        if self.tiles_enabled:
+            for key in self._regions.keys():
+                self.get_tiles(map_key=key)
+
+        # Persist queries on server side, default queries are always available
+        if registry_path is None:
+            registry_path = Config.path(Config.registry('DATABASE'))
+        self._registry = QueryRegistry(registry_path)
+        self._registry.seed(self._queries)
 
     @staticmethod
     def add_query(query_key: str, query: Query, query_dict: 'Queries') -> 'Queries':
@@ -73,77 +171,147 @@ class DataController(object):
 
         return query_dict
 
-    def get_query(self, query_key: str, query_dict: 'Queries', map_key: str = None) -> 'Query':
+    def save_query(self, query_key: str, query: Query, since: int = 0) -> 'RegistryToken':
         """
-        Returns selected query object from query dictionary
+        Saves query to the registry and returns the changes after the version known by the client
+        """
+        query_itm: dict = DataController.add_query(query_key=query_key, query=query, query_dict={})[query_key]
+        self._registry.put(query_key=query_key, query_itm=query_itm)
+
+        return self._registry.token(since=since)
+
+    def get_query(self, query_key: str, query_dict: 'Queries' = None, map_key: str = None) -> 'Query':
+        """
+        Returns selected query object from query dictionary, or from the registry if no dictionary provided
         """
 
         # raise error if key not provided
         if query_key is None:
             raise ValueError('invalid query key')
 
+        if query_dict is None:
+            query_dict = self._registry
+
         # Get map data for regions
         maphandler: MapHandler = self._get_map(map_key=map_key)
         region_keys = maphandler.get_keys()
 
-        # Load selected query from collection
-        query_itm: dict = query_dict[query_key]
-        if query_itm["type"] == QueryTypesEnum.SIMPLE.value:
-            query: 'Query' = SimpleQuery(**query_itm["query"])
-        elif query_itm["type"] == QueryTypesEnum.CALCULATED.value:
-            query: 'Query' = CalcQuery(**query_itm["query"])
+        # Reuse validated query if the stored definition did not change
+        cache_key: tuple = (query_key, self.resolve_map_key(map_key=map_key),
+                            self._definition_digest(query_key, query_dict))
+        with self._query_lock:
+            query: 'Query' = self._query_cache.get(cache_key)
+            if query is not None:
+                self._query_cache.move_to_end(cache_key)
+
+        if query is None:
+            # Load selected query from collection, stored metadata was validated when the query was saved
+            query_itm: dict = query_dict[query_key]
+            values: dict = dict(query_itm["query"])
+            if query_dict is self._registry and values.get("info") is not None:
+                values["info"] = self._registry.get_info(query_key)
+            elif values.get("info") is not None:
+                values["info"] = QueryInfo.trusted(values["info"])
+
+            if query_itm["type"] == QueryTypesEnum.SIMPLE.value:
+                query = SimpleQuery.trusted(**values)
+            elif query_itm["type"] == QueryTypesEnum.CALCULATED.value:
+                query = CalcQuery(**values)
+
+            query.region_keys = region_keys
+            size: int = deep_size(query)
+
+            # Ledger is updated outside of the cache lock, the budget check takes the locks the other way round
+            with self._query_lock:
+                query = self._query_cache.setdefault(cache_key, query)
+                self._query_cache.move_to_end(cache_key)
+
+                # Drop least recently used queries
+                evicted: List[tuple] = []
+                while len(self._query_cache) > self.QUERY_CACHE_SIZE:
+                    evicted.append(self._query_cache.popitem(last=False)[0])
+
+            self._touch((MEMORY_QUERIES, cache_key), size=size)
+            for key in evicted:
+                self._forget((MEMORY_QUERIES, key))
+        else:
+            self._touch((MEMORY_QUERIES, cache_key))
+
+        # Callers get their own copy, so they can't change the cached instance
+        return query.copy(update={'region_keys': region_keys})
+
+    @staticmethod
+    def hash_definition(query_itm: dict) -> str:
+        """
+        Content hash of a stored query definition
+        """
+        return definition_digest(query_itm)
+
+    def _definition_digest(self, query_key: str, query_dict: 'Queries') -> str:
+        """
+        Content hash of the query definition, the registry keeps it next to the definition
+        """
+        if query_dict is self._registry:
+            return self._registry.digest(query_key)
 
-        query.region_keys = region_keys
-        return query
+        return self.hash_definition(query_dict[query_key])
 
-    def _load_maps(self) -> 'Maps':
+    def _object_store(self, bucket: str = None) -> 'Store':
         """
-        Loads map shape files from S3 store or local path and initialize dictionary for map objects
+        Store of the bucket, the local folder if provided. S3 objects are cached on local disk.
         """
+        if bucket is None:
+            bucket = Config.s3('BUCKET_NAME')
 
-        regions: 'Maps' = {}
+        with self._stores_lock:
+            if bucket not in self._stores:
+                if self._path is not None:
+                    store: 'Store' = LocalStore(str(self._path))
+                else:
+                    store = CachedStore(S3Store(bucket, s3=self._s3),
+                                        folder=Config.path(Config.storage('CACHE_FOLDER')))
+                self._stores[bucket] = store
 
-        if self._path is not None:
-            reg_path: pathlib.Path = self._path / Config.s3('BUCKET_FOLDER_REGION')
-            file_content = reg_path.read_text(encoding='utf-8-sig')
-        elif self._s3 is not None:
-            content_object = self._s3.Object(Config.s3('BUCKET_NAME'), Config.s3('BUCKET_FOLDER_REGION'))
-            file_content = content_object.get()['Body'].read().decode('utf-8')
+            return self._stores[bucket]
 
+    def _submit_maps(self, executor: ThreadPoolExecutor) -> Dict[str, Future]:
+        """
+        Loads map shape files from S3 store or local path and initialize map objects. Map archives are
+        downloaded and read in parallel, the futures resolve to the map objects.
+        """
+
+        file_content: str = self._object_store().read_text(Config.s3('BUCKET_FOLDER_REGION'))
         map_dict = json.loads(file_content)
-        for key, value in map_dict.items():
+
+        def load_map(value: dict) -> MapHandler:
             region = Region(**value)
-            maphandler = MapHandler(region)
-            regions[key]: MapHandler = maphandler
+            path: str = None
+            if region.is_s3:
+                path = str(self._object_store(region.s3_bucket).path(region.s3_key))
+            return MapHandler(region, path=path)
 
-        return regions
+        return {key: executor.submit(load_map, value) for key, value in map_dict.items()}
 
-    def _load_queries(self) -> 'Queries':
+    def _load_queries(self, executor: ThreadPoolExecutor) -> 'Queries':
         """
-        Loads query definitions from JSON and initialize dictionary for queries
+        Loads query definitions from JSON and initialize dictionary for queries, queries are validated in parallel.
+        The calling thread waits for the pool, so tasks of the pool must not call this.
         """
 
         queries: 'Queries' = {}
-        query: 'Query'
-
-        # Otherwise load content from file
-        if self._path is not None:
-            reg_path: pathlib.Path = self._path / Config.s3('BUCKET_FOLDER_QUERY')
-            file_content = reg_path.read_text(encoding='utf-8-sig')
-        elif self._s3 is not None:
-            content_object = self._s3.Object(Config.s3('BUCKET_NAME'), Config.s3('BUCKET_FOLDER_QUERY'))
-            file_content = content_object.get()['Body'].read().decode('utf-8')
 
+        file_content: str = self._object_store().read_text(Config.s3('BUCKET_FOLDER_QUERY'))
         qry_dict: 'Queries' = json.loads(file_content)
 
+        def load_query(value: dict) -> 'Query':
+            if value["type"] == QueryTypesEnum.SIMPLE.value:
+                return SimpleQuery(**value["query"])
+            elif value["type"] == QueryTypesEnum.CALCULATED.value:
+                return CalcQuery(**value["query"])
+
         # Initialize query objects and add them to output dictionary
         if qry_dict is not None and len(qry_dict) > 0:
-            for key, value in qry_dict.items():
-                if value["type"] == QueryTypesEnum.SIMPLE.value:
-                    query = SimpleQuery(**value["query"])
-                elif value["type"] == QueryTypesEnum.CALCULATED.value:
-                    query = CalcQuery(**value["query"])
-
+            for key, query in zip(qry_dict.keys(), executor.map(load_query, qry_dict.values())):
                 # Add query to ouput
                 queries: 'Queries' = DataController.add_query(query_key=key, query=query, query_dict=queries)
 
@@ -157,50 +325,626 @@ class DataController(object):
     def queries(self) -> 'Queries':
         return self._queries
 
-    def _get_map(self, map_key: str = None) -> MapHandler:
+    @property
+    def registry(self) -> QueryRegistry:
+        return self._registry
+
+    @property
+    def catalogue(self) -> TableCatalogue:
         """
-        Load selected map object
+        Table catalogue of the API, it is loaded from the local database on first access
+        """
+        if self._catalogue is None:
+            self._catalogue = TableCatalogue(Config.path(Config.catalogue('DATABASE')))
+        return self._catalogue
+
+    def refresh_catalogue(self, force: bool = False) -> bool:
+        """
+        Crawl the API navigation tree in the background if the catalogue is older than the refresh interval.
+        Returns True if a refresh was started.
+        """
+        max_age: float = float(Config.catalogue('REFRESH_HOURS')) * 3600
+        if not force and time.time() - self.catalogue.crawled_at < max_age:
+            return False
+        if self._catalogue_refresh is not None and self._catalogue_refresh.is_alive():
+            return False
+
+        self._catalogue_refresh = threading.Thread(target=self.catalogue.crawl, args=(self.fetch_catalogue,),
+                                                   daemon=True)
+        self._catalogue_refresh.start()
+        return True
+
+    @staticmethod
+    def fetch_catalogue(path: str) -> Any:
+        """
+        Get JSON content of a path below the API root for the catalogue crawl. The crawl is rate limited
+        and has its own circuit breaker, so it does not open the circuit of dashboard calls.
+        """
+        response = get_crawl_metadata(Config.api('URL') + path)
+        response.raise_for_status()
+        return json.loads(response.content.decode('utf-8-sig'))
+
+    def request_stats(self) -> Dict[str, 'FlightStats']:
+        """
+        API calls made and calls served by an identical call in flight, for metadata and data requests.
+        Planned data calls also count requests merged into a call for a wider selection.
+        """
+        data_stats: 'FlightStats' = dict(data_flight.stats)
+        data_stats['planned'] = self._planner.api_calls
+        return {'metadata': metadata_flight.stats, 'data': data_stats, 'breaker': api_breaker.stats}
+
+    @property
+    def snapshot(self) -> Optional[SnapshotSource]:
+        return self._snapshot
+
+    @property
+    def tiles_enabled(self) -> bool:
+        return Config.tiles('ENABLED').lower() == 'true'
+
+    @property
+    def map_keys(self) -> List[str]:
+        return list(self._regions.keys())
+
+    @property
+    def hierarchy(self) -> RegionHierarchy:
+        """
+        Membership index between the region layers of the maps, built on first access
+        """
+        if self._hierarchy is None:
+            total_code: str = Config.api('TOTAL_CODES').split(',')[0].strip()
+            layers: Dict[str, List[str]] = {key: maphandler.get_keys() for key, maphandler in self._regions.items()}
+            self._hierarchy = RegionHierarchy(layers, total_code=total_code)
+        return self._hierarchy
+
+    def _rollup_result(self, cache_key: tuple, query_dict: 'Queries') -> Optional[QueryResult]:
+        """
+        Roll up cached result of a finer map to the regions of the map in the cache key. Only queries marked
+        as additive are summed, ratios and averages are fetched for the coarser map. Snapshots hold results
+        of the default map, they are loaded for the rollup.
+        """
+        query_key, map_key, digest, aggregate = cache_key
+        if map_key not in self.hierarchy.layers or (aggregate is not None and 'region' in aggregate):
+            return None
+
+        query_itm: dict = query_dict[query_key]
+        if query_itm["type"] != QueryTypesEnum.SIMPLE.value or not query_itm["query"].get("additive", False):
+            return None
+
+        for fine in self.hierarchy.finer(map_key):
+            result: QueryResult = self._result_cache.get((query_key, fine, digest, aggregate))
+            if result is None and fine == self.resolve_map_key() and self._snapshot is not None and \
+                    self._snapshot.matches(query_key, digest):
+                result = self.get_result(query_key=query_key, map_key=fine, query_dict=query_dict,
+                                         aggregate=list(aggregate) if aggregate is not None else None)
+            if result is not None and not self._is_expired(result) and 'region' in result.df:
+                return result.rollup(self.hierarchy, fine=fine, coarse=map_key)
+
+        return None
+
+    def resolve_map_key(self, map_key: str = None) -> str:
+        """
+        Returns the key of the selected map, or the default map if no key provided
         """
 
         # Load default if no map parameter provided
         if map_key is None and len(self._regions) > 0:
             # Just get the first item from the list as default
-            key = list(self._regions.keys())[0]
-        else:
-            key = map_key
+            return list(self._regions.keys())[0]
+
+        return map_key
+
+    def _get_map(self, map_key: str = None) -> MapHandler:
+        """
+        Load selected map object
+        """
+        key: str = self.resolve_map_key(map_key=map_key)
 
         if key in self._regions.keys():
+            self._touch((MEMORY_MAPS, key))
             return self._regions[key]
 
+    def get_tiles(self, map_key: str = None) -> VectorTiles:
+        """
+        Get vector tiles of the selected map, they are generated on first access
+        """
+        maphandler: MapHandler = self._get_map(map_key=map_key)
+
+        if maphandler is not None:
+            folder: str = Config.path(Config.tiles('FOLDER'))
+            if folder:
+                folder = str(pathlib.Path(folder) / self.resolve_map_key(map_key=map_key))
+
+            tiles_generated: bool = maphandler.has_tiles
+            tiles: VectorTiles = maphandler.get_tiles(min_zoom=int(Config.tiles('MIN_ZOOM')),
+                                                      max_zoom=int(Config.tiles('MAX_ZOOM')), folder=folder)
+            if not tiles_generated:
+                self._forget_size((MEMORY_MAPS, self.resolve_map_key(map_key=map_key)))
+            return tiles
+
+    def get_tile(self, z: int, x: int, y: int, map_key: str = None, keys: List[str] = None) -> Optional[bytes]:
+        """
+        Get vector tile of the selected map with the selected regions
+        """
+        tiles: VectorTiles = self.get_tiles(map_key=map_key)
+
+        if tiles is not None:
+            return tiles.get_tile(z, x, y, keys=keys)
+
+    def selected_regions(self, selection: Dict[str, Any], map_key: str = None) -> Optional[List[str]]:
+        """
+        Keys of the regions in a map click or selection event. Points carry their region, box and lasso
+        selections are looked up in the spatial index of the map. None if nothing is selected.
+        """
+        if not selection:
+            return None
+
+        maphandler: MapHandler = self._get_map(map_key=map_key)
+        if 'range' in selection and 'mapbox' in selection['range']:
+            (west, north), (east, south) = selection['range']['mapbox']
+            return maphandler.regions_in(min(west, east), min(north, south), max(west, east), max(north, south))
+        if 'lassoPoints' in selection and 'mapbox' in selection['lassoPoints']:
+            return maphandler.regions_within([tuple(point) for point in selection['lassoPoints']['mapbox']])
+
+        regions: List[str] = []
+        for point in selection.get('points', []):
+            key: str = point.get('location')
+            if key is None and 'lon' in point and 'lat' in point:
+                key = maphandler.region_at(point['lon'], point['lat'])
+            if key is not None and str(key) not in regions:
+                regions.append(str(key))
+
+        return regions if len(regions) > 0 else None
+
     def map_dict(self, map_key: str = None) -> dict:
         """
         Get map data in dictionary format
         """
-        maphandler: MapHandler = self._get_map(map_key=map_key)
+        key: str = self.resolve_map_key(map_key=map_key)
+        maphandler: MapHandler = self._get_map(map_key=key)
 
         if maphandler is not None:
-            df_map = maphandler.get_dataframe()
-            map_dict = json.loads(df_map.to_json())
+            # GeoJSON is created once per map
+            map_dict: dict = self._map_dicts.get(key)
+            if map_dict is None:
+                df_map = maphandler.get_dataframe()
+                map_dict = json.loads(df_map.to_json())
+                self._map_dicts[key] = map_dict
+                self._forget_size((MEMORY_MAPS, key))
             return map_dict
 
-    def data_dict(self, query_key: str, map_key: str = None, query_dict: 'Queries' = None) -> dict:
+    def get_result(self, query_key: str, map_key: str = None, query_dict: 'Queries' = None,
+                   aggregate: List[str] = None, budget: float = None) -> QueryResult:
         """
-        Get query result in JSON format
+        Get query result, results are cached until the query definition changes.
+        Variables in aggregate are summed by the API where the metadata allows it. If the API can't sum
+        any of them, the result of the query without aggregate is returned and the caller sums it.
         """
+        return self.get_results(query_keys=[query_key], map_key=map_key, query_dict=query_dict,
+                                aggregate=aggregate, budget=budget)[0]
 
-        data_dict: 'QueryData' = QueryDataTemplate
+    def get_results(self, query_keys: List[str], map_key: str = None, query_dict: 'Queries' = None,
+                    aggregate: List[str] = None, budget: float = None) -> List[QueryResult]:
+        """
+        Get results of several queries. Queries missing from the cache are planned together,
+        so queries on the same table share API calls. Expired results are fetched again, with a latency
+        budget in seconds the last known result is served if the new one is not ready in time, and it is
+        replaced by a background revalidation. Last known results are also served while the API fails.
+        """
 
-        query: 'Query' = self.get_query(query_key=query_key, map_key=map_key,
-                                        query_dict=query_dict)
+        if query_dict is None:
+            query_dict = self._registry
+
+        results: List[Optional[QueryResult]] = []
+        missing: List[Tuple[int, tuple, 'Query', Optional[QueryResult]]] = []
+        for i, query_key in enumerate(query_keys):
+            digest: str = self._definition_digest(query_key, query_dict)
+            cache_key: tuple = (query_key, self.resolve_map_key(map_key=map_key), digest,
+                                tuple(aggregate) if aggregate is not None else None)
+            with self._result_lock:
+                result: QueryResult = self._result_cache.get(cache_key)
+                if result is not None:
+                    self._result_cache.move_to_end(cache_key)
+                    self._touch((MEMORY_RESULTS, cache_key))
+
+            stale: QueryResult = None
+            if result is not None and self._is_expired(result):
+                stale, result = result, None
+
+            if result is None:
+                # Coarser maps are summed from the result of a finer map without a new fetch
+                result = self._rollup_result(cache_key, query_dict)
+                if result is not None:
+                    self._store_result(cache_key, result)
+
+            if result is None and self._snapshot is not None and cache_key[1] == self.resolve_map_key() and \
+                    self._snapshot.matches(query_key, digest):
+                # Aggregates are summed locally from the snapshot data
+                fingerprint: str = hashlib.sha1(json.dumps(cache_key).encode('utf-8')).hexdigest()
+                result = QueryResult(self._snapshot.get_dataframe(query_key),
+                                     value_col=self._snapshot.value_col(query_key), fingerprint=fingerprint)
+                self._store_result(cache_key, result)
+            elif result is None:
+                try:
+                    query: 'Query' = self.get_query(query_key=query_key, map_key=map_key,
+                                                    query_dict=query_dict)
+                except Exception:
+                    # Query validation may need the API, the last known result is served while it fails
+                    if stale is None:
+                        raise
+                    result = stale
+                else:
+                    if aggregate is not None and isinstance(query, SimpleQuery):
+                        aggregated: SimpleQuery = query.copy(update={'aggregate': aggregate})
+                        if aggregated.request_body == query.request_body:
+                            # Same request as the plain query, its result is reused instead of fetched again
+                            result = self.get_result(query_key=query_key, map_key=map_key, query_dict=query_dict,
+                                                     budget=budget)
+                        query = aggregated
+                    if result is None:
+                        missing.append((i, cache_key, query, stale))
+
+            results.append(result)
+
+        # Expired results are revalidated in the background, callers wait for the budget at most
+        if budget is not None:
+            revalidations: List[Tuple[int, Future, QueryResult]] = [
+                (i, self._revalidate(cache_key, query), stale) for (i, cache_key, query, stale) in missing
+                if stale is not None]
+            missing = [itm for itm in missing if itm[3] is None]
+
+            done, _ = wait([future for (_, future, _) in revalidations], timeout=budget)
+            for i, future, stale in revalidations:
+                results[i] = future.result() if future in done and future.exception() is None else stale
+
+        if len(missing) > 0:
+            try:
+                fetched: List[QueryResult] = self._fetch_results([(cache_key, query)
+                                                                  for (_, cache_key, query, _) in missing])
+            except Exception:
+                if any(stale is None for (_, _, _, stale) in missing):
+                    raise
+                fetched = [stale for (_, _, _, stale) in missing]
+
+            for (i, _, _, _), result in zip(missing, fetched):
+                results[i] = result
+
+        return results
+
+    def _fetch_results(self, items: List[Tuple[tuple, 'Query']]) -> List[QueryResult]:
+        """
+        Fetch results of the queries and store them in the cache
+        """
 
-        df_data: pandas.DataFrame = query.get_dataframe()
+        # Queries on the same table share API calls, a single query still waits for concurrent callers
+        queries: List[SimpleQuery] = [query for (_, query) in items if isinstance(query, SimpleQuery)]
+        if len(queries) == 1:
+            frames: List[pandas.DataFrame] = [self._planner.execute(queries[0])]
+        else:
+            frames = self._planner.execute_many(queries)
+        planned: Dict[int, pandas.DataFrame] = {id(query): df for query, df in zip(queries, frames)}
 
-        # Assign values to output structure
-        data_dict['VALUE_COLUMN'] = query.value_col
-        data_dict['COLUMN_NAMES'] = list(df_data.columns)
-        data_dict['DATAFRAME'] = df_data.to_dict()
+        results: List[QueryResult] = []
+        for cache_key, query in items:
+            df_data: pandas.DataFrame = planned[id(query)] if id(query) in planned else query.get_dataframe()
+            fingerprint: str = hashlib.sha1(json.dumps(cache_key).encode('utf-8')).hexdigest()
+            result: QueryResult = QueryResult(df_data, value_col=query.value_col, fingerprint=fingerprint,
+                                              fetched_at=time.time())
+
+            self._store_result(cache_key, result)
+            results.append(result)
+
+        return results
+
+    def _store_result(self, cache_key: tuple, result: QueryResult):
+        revision: int = result.revision
+        size: int = result.memory_usage()
+        with self._result_lock:
+            self._result_cache[cache_key] = result
+            self._result_cache.move_to_end(cache_key)
+            self._touch((MEMORY_RESULTS, cache_key), size=size, revision=revision)
+
+            # Drop least recently used results
+            while len(self._result_cache) > self.RESULT_CACHE_SIZE:
+                self._forget((MEMORY_RESULTS, self._result_cache.popitem(last=False)[0]))
+
+        self._enforce_memory_budget(keep=(MEMORY_RESULTS, cache_key))
+
+    def _revalidate(self, cache_key: tuple, query: 'Query') -> Future:
+        """
+        Fetch result in the background, callers revalidating the same result share the fetch
+        """
+        with self._result_lock:
+            future: Future = self._revalidations.get(cache_key)
+            if future is None:
+                future = self._revalidator.submit(lambda: self._fetch_results([(cache_key, query)])[0])
+                self._revalidations[cache_key] = future
+                future.add_done_callback(lambda itm: self._end_revalidation(cache_key, itm))
+
+        return future
+
+    def _end_revalidation(self, cache_key: tuple, future: Future):
+        with self._result_lock:
+            if self._revalidations.get(cache_key) is future:
+                del self._revalidations[cache_key]
+
+    def _is_expired(self, result: QueryResult) -> bool:
+        return result.fetched_at is not None and time.time() - result.fetched_at > float(Config.serving('MAX_AGE'))
+
+    def result_status(self, query_key: str, map_key: str = None, query_dict: 'Queries' = None) -> Dict[str, Any]:
+        """
+        Fetch time of the cached result, and if it is expired or being revalidated
+        """
+        if query_dict is None:
+            query_dict = self._registry
+
+        cache_key: tuple = (query_key, self.resolve_map_key(map_key=map_key),
+                            self._definition_digest(query_key, query_dict), None)
+        with self._result_lock:
+            result: QueryResult = self._result_cache.get(cache_key)
+            revalidating: bool = cache_key in self._revalidations
+
+        return {'fetched_at': result.fetched_at if result is not None else None,
+                'stale': result is not None and self._is_expired(result), 'revalidating': revalidating}
+
+    @property
+    def memory_budget(self) -> int:
+        return int(float(Config.memory('BUDGET_MB')) * 1024 * 1024)
+
+    def _touch(self, entry: tuple, size: int = None, revision: int = None):
+        """
+        Mark ledger entry as used, the size is measured when the entry is stored. Results record the revision
+        of their derived data with the size.
+        """
+        with self._memory_lock:
+            self._last_used[entry] = time.time()
+            if size is not None:
+                self._sizes[entry] = size
+                self._revisions[entry] = revision
+
+    def _forget(self, entry: tuple):
+        with self._memory_lock:
+            self._last_used.pop(entry, None)
+            self._sizes.pop(entry, None)
+            self._revisions.pop(entry, None)
+
+    def _forget_size(self, entry: tuple):
+        """
+        Entry changed size, it is measured again on next use of the ledger
+        """
+        with self._memory_lock:
+            self._sizes.pop(entry, None)
+
+    def _entry_size(self, entry: tuple, measure: bool = False) -> int:
+        """
+        Bytes of the ledger entry, the recorded size unless it is missing or a measurement is requested.
+        Results are measured again when derived matrices, views or indexes were added since the last
+        measurement, maps when tiles or GeoJSON were created.
+        """
+        category, key = entry
+        result: QueryResult = None
+        if category == MEMORY_RESULTS:
+            with self._result_lock:
+                result = self._result_cache.get(key)
+
+        with self._memory_lock:
+            size: int = self._sizes.get(entry)
+            if result is not None and self._revisions.get(entry) != result.revision:
+                size = None
+        if size is not None and not measure:
+            return size
+
+        revision: int = None
+        if category == MEMORY_MAPS:
+            size = self._regions[key].memory_usage() + deep_size(self._map_dicts.get(key))
+        elif category == MEMORY_QUERIES:
+            with self._query_lock:
+                query: 'Query' = self._query_cache.get(key)
+            size = deep_size(query) if query is not None else 0
+        elif category == MEMORY_CUBES:
+            with self._result_lock:
+                cube: AnalyticsCube = self._cube_cache.get(key)
+            size = deep_size(cube) if cube is not None else 0
+        else:
+            revision = result.revision if result is not None else None
+            size = result.memory_usage() if result is not None else 0
+
+        with self._memory_lock:
+            self._sizes[entry] = size
+            self._revisions[entry] = revision
+        return size
+
+    def _memory_entries(self) -> List[tuple]:
+        """
+        Resident maps, cached queries, results and cubes, least recently used first
+        """
+        with self._result_lock:
+            entries: List[tuple] = [(MEMORY_RESULTS, key) for key in self._result_cache.keys()]
+            entries += [(MEMORY_CUBES, key) for key in self._cube_cache.keys()]
+        with self._query_lock:
+            entries += [(MEMORY_QUERIES, key) for key in self._query_cache.keys()]
+        entries += [(MEMORY_MAPS, key) for key in self._regions.keys()]
 
-        print(query.info.json(skip_defaults=True, ensure_ascii=False))
-        print(query.json(skip_defaults=True, ensure_ascii=False))
+        with self._memory_lock:
+            return sorted(entries, key=lambda entry: self._last_used.get(entry, 0.0))
+
+    def memory_report(self, measure: bool = True) -> 'MemoryReport':
+        """
+        Deep size of resident maps, query definitions, cached queries, results and cubes. Entries are listed least
+        recently used first with their size in bytes. Sizes are measured again unless measure is False.
+        """
+        entries: List[Dict[str, Any]] = []
+        totals: Dict[str, int] = {MEMORY_MAPS: 0, MEMORY_QUERIES: deep_size(self._queries), MEMORY_RESULTS: 0,
+                                  MEMORY_CUBES: 0}
+        for entry in self._memory_entries():
+            category, key = entry
+            size: int = self._entry_size(entry, measure=measure)
+            totals[category] += size
+            itm: Dict[str, Any] = {'category': category, 'key': list(key) if isinstance(key, tuple) else key,
+                                   'bytes': size, 'last_used': self._last_used.get(entry)}
+            if category == MEMORY_MAPS:
+                itm['downgraded'] = self._regions[key].downgraded
+            entries.append(itm)
+
+        return {'budget': self.memory_budget, 'total': sum(totals.values()), 'totals': totals, 'entries': entries}
+
+    def _enforce_memory_budget(self, keep: tuple = None) -> int:
+        """
+        Evict least recently used queries, results and cubes and downgrade maps to simplified geometry until the
+        ledger fits the memory budget. The entry to keep was just stored for a caller. Returns bytes freed.
+        """
+        # Locks are taken in the order results, ledger, query cache
+        with self._result_lock, self._memory_lock:
+            entries: List[tuple] = self._memory_entries()
+            sizes: Dict[tuple, int] = {entry: self._entry_size(entry) for entry in entries}
+            total: int = sum(sizes.values())
+            freed: int = 0
+
+            for entry in entries:
+                if total - freed <= self.memory_budget:
+                    break
+                if entry == keep:
+                    continue
+
+                category, key = entry
+                if category == MEMORY_MAPS:
+                    # Maps are always needed, full resolution geometry and the GeoJSON are dropped
+                    maphandler: MapHandler = self._regions[key]
+                    if maphandler.downgraded:
+                        continue
+                    maphandler.downgrade(tolerance=float(Config.memory('SIMPLIFY_TOLERANCE')))
+                    self._map_dicts.pop(key, None)
+                    freed += sizes[entry] - self._entry_size(entry, measure=True)
+                elif category == MEMORY_QUERIES:
+                    with self._query_lock:
+                        self._query_cache.pop(key, None)
+                    self._forget(entry)
+                    freed += sizes[entry]
+                elif category == MEMORY_CUBES:
+                    self._cube_cache.pop(key, None)
+                    self._forget(entry)
+                    freed += sizes[entry]
+                else:
+                    self._result_cache.pop(key, None)
+                    self._forget(entry)
+                    freed += sizes[entry]
+
+        return freed
+
+    def time_series(self, query_key: str, map_key: str = None, regions: List[str] = None,
+                    budget: float = None) -> pandas.DataFrame:
+        """
+        Get yearly totals of all regions. Regions are aggregated by the API, the local sum only
+        covers queries where it is not supported, these sum the result shown on the map. Totals of selected
+        regions are summed from the rows of these regions in the result.
+        """
+        if regions is not None:
+            return self.get_result(query_key=query_key, map_key=map_key, budget=budget).region_series(regions)
+
+        result: QueryResult = self.get_result(query_key=query_key, map_key=map_key, aggregate=['region'],
+                                              budget=budget)
+
+        return result.df.groupby(by='year', as_index=False)[result.value_col].sum()
+
+    def region_year_matrix(self, query_key: str, map_key: str = None, budget: float = None) -> RegionYearMatrix:
+        """
+        Get query result as region x year matrix aligned to the regions of the map
+        """
+        result: QueryResult = self.get_result(query_key=query_key, map_key=map_key, budget=budget)
+        maphandler: MapHandler = self._get_map(map_key=map_key)
+
+        return result.get_matrix(keys=maphandler.get_keys())
+
+    def analytics(self, query_keys: List[str], map_key: str = None, budget: float = None) -> AnalyticsCube:
+        """
+        Region x year x statistic cube of the query results aligned to the regions of the map. Cubes are
+        built once for each combination of results, a refetched result builds a new cube.
+        """
+        results: List[QueryResult] = self.get_results(query_keys=query_keys, map_key=map_key, budget=budget)
+        keys: List[str] = self._get_map(map_key=map_key).get_keys()
+
+        cache_key: tuple = (self.resolve_map_key(map_key=map_key), tuple(query_keys),
+                            tuple((result.fingerprint, result.fetched_at) for result in results))
+        with self._result_lock:
+            cube: AnalyticsCube = self._cube_cache.get(cache_key)
+            if cube is not None:
+                self._cube_cache.move_to_end(cache_key)
+                self._touch((MEMORY_CUBES, cache_key))
+                return cube
+
+        cube = AnalyticsCube([result.get_matrix(keys=keys) for result in results], statistics=query_keys)
+        size: int = deep_size(cube)
+        with self._result_lock:
+            self._cube_cache[cache_key] = cube
+            self._touch((MEMORY_CUBES, cache_key), size=size)
+
+            # Drop least recently used cubes
+            while len(self._cube_cache) > self.CUBE_CACHE_SIZE:
+                self._forget((MEMORY_CUBES, self._cube_cache.popitem(last=False)[0]))
+
+        self._enforce_memory_budget(keep=(MEMORY_CUBES, cache_key))
+        return cube
+
+    def export_result(self, query_key: str, file_format: str, map_key: str = None) -> pathlib.Path:
+        """
+        Export query result to a file, the file is written once for each content of the result
+        """
+        result: QueryResult = self.get_result(query_key=query_key, map_key=map_key)
+        return self._exporter.export_file(result.df, name=result.digest, file_format=file_format)
+
+    @property
+    def jobs(self) -> JobQueue:
+        return self._jobs
+
+    def submit_result(self, owner: str, query_key: str, map_key: str = None) -> Job:
+        """
+        Load query result in the background. Other jobs of the owner are cancelled, an active job
+        for the same query is reused. The new job waits for cancelled calls which still hold a worker.
+        """
+        self._jobs.cancel_owner(owner, keep=query_key)
+        job: Job = self._jobs.find(owner, query_key)
+        if job is None:
+            job = self._jobs.submit(owner, query_key,
+                                    lambda itm: self._load_result(itm, query_key=query_key, map_key=map_key))
+
+        return job
+
+    def _load_result(self, job: Job, query_key: str, map_key: str = None):
+        """
+        Fetch query result and prepare the map and time series, so the callbacks only read from the caches.
+        Expired results are served as they are if the new data is not ready within the budget. The job keeps
+        no reference to the result, so it is freed when it leaves the cache.
+        """
+        budget: float = float(Config.serving('BUDGET_DATA'))
+
+        job.update(0.1, 'Fetching data')
+        self.get_result(query_key=query_key, map_key=map_key, budget=budget)
+
+        job.update(0.7, 'Preparing map')
+        self.region_year_matrix(query_key=query_key, map_key=map_key, budget=budget)
+
+        job.update(0.8, 'Fetching totals')
+        self.time_series(query_key=query_key, map_key=map_key, budget=budget)
+
+        job.update(0.95, 'Done')
+
+    @property
+    def exporter(self) -> ResultExporter:
+        return self._exporter
+
+    def data_dict(self, query_key: str, map_key: str = None, query_dict: 'Queries' = None,
+                  budget: float = None) -> dict:
+        """
+        Get value column and fetch state of the query result, the data stays on server side
+        """
+
+        data_dict: 'QueryData' = dict(QueryDataTemplate)
+
+        result: QueryResult = self.get_result(query_key=query_key, map_key=map_key, query_dict=query_dict,
+                                              budget=budget)
+
+        # Assign values to output structure
+        data_dict['VALUE_COLUMN'] = result.value_col
+        data_dict['FETCHED_AT'] = result.fetched_at
+        data_dict['STALE'] = self._is_expired(result)
 
         return data_dict
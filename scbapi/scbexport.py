@@ -0,0 +1,123 @@
+import os
+import pathlib
+import tempfile
+import threading
+from enum import Enum
+from typing import Dict, Iterator, List
+
+import pandas
+
+
+class ExportFormatEnum(Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+
+
+class ResultExporter(object):
+    """
+    Writes query results to CSV or Parquet in chunks of rows, so memory use does not depend on the result size.
+    With a file limit the least recently used export files are removed from the export folder.
+    """
+
+    def __init__(self, folder: str = None, chunk_rows: int = 50000, max_files: int = None):
+        if folder:
+            self._folder: pathlib.Path = pathlib.Path(folder)
+        else:
+            self._folder = pathlib.Path(tempfile.gettempdir()) / 'scbdash-exports'
+        self._chunk_rows: int = chunk_rows
+        self._max_files: int = max_files
+        self._lock: threading.Lock = threading.Lock()
+        self._file_locks: Dict[str, threading.Lock] = {}
+
+    def iter_csv(self, df: pandas.DataFrame) -> Iterator[bytes]:
+        """
+        Encode data frame as CSV, chunk by chunk
+        """
+        yield df.iloc[0:0].to_csv(index=False).encode('utf-8')
+        for start in range(0, len(df), self._chunk_rows):
+            yield df.iloc[start:start + self._chunk_rows].to_csv(index=False, header=False).encode('utf-8')
+
+    def write_parquet(self, df: pandas.DataFrame, path: pathlib.Path):
+        """
+        Write data frame to Parquet, one row group for each chunk
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        schema = pyarrow.Schema.from_pandas(df, preserve_index=False)
+        with pyarrow.parquet.ParquetWriter(str(path), schema) as writer:
+            for start in range(0, max(len(df), 1), self._chunk_rows):
+                table = pyarrow.Table.from_pandas(df.iloc[start:start + self._chunk_rows], schema=schema,
+                                                  preserve_index=False)
+                writer.write_table(table)
+
+    def export_file(self, df: pandas.DataFrame, name: str, file_format: str) -> pathlib.Path:
+        """
+        Export data frame to a file in the export folder, an existing export of the same result is reused.
+        The name should identify the content, e.g. the digest of the result.
+        """
+        if file_format not in [fmt.value for fmt in ExportFormatEnum]:
+            raise ValueError('unsupported export format')
+
+        path: pathlib.Path = self._folder / '{name}.{ext}'.format(name=name, ext=file_format)
+
+        # Exports of other files are written at the same time, the same file is written once
+        with self._lock:
+            file_lock: threading.Lock = self._file_locks.setdefault(path.name, threading.Lock())
+
+        with file_lock:
+            if path.exists():
+                # Reused exports are the most recently used ones for the cleanup
+                os.utime(str(path))
+                return path
+
+            self._folder.mkdir(parents=True, exist_ok=True)
+
+            # Write to a temporary file first, so readers never see a partial export
+            handle, tmp_name = tempfile.mkstemp(dir=str(self._folder), prefix=path.name, suffix='.tmp')
+            tmp_path: pathlib.Path = pathlib.Path(tmp_name)
+            try:
+                if file_format == ExportFormatEnum.CSV.value:
+                    with os.fdopen(handle, 'wb') as file:
+                        for chunk in self.iter_csv(df):
+                            file.write(chunk)
+                else:
+                    os.close(handle)
+                    self.write_parquet(df, tmp_path)
+
+                os.replace(str(tmp_path), str(path))
+            except Exception:
+                tmp_path.unlink()
+                raise
+
+        self.cleanup(keep=path)
+        return path
+
+    def cleanup(self, keep: pathlib.Path = None) -> int:
+        """
+        Remove the least recently used export files above the file limit. Returns the number of removed files.
+        """
+        if self._max_files is None:
+            return 0
+
+        with self._lock:
+            files: List[pathlib.Path] = [itm for fmt in ExportFormatEnum
+                                         for itm in self._folder.glob('*.{}'.format(fmt.value)) if itm != keep]
+            mtimes: Dict[pathlib.Path, float] = {}
+            for itm in files:
+                try:
+                    mtimes[itm] = itm.stat().st_mtime
+                except FileNotFoundError:
+                    pass
+
+            # The kept file is the newest one
+            removed: int = 0
+            for itm in sorted(mtimes, key=mtimes.get)[:max(0, len(mtimes) + (keep is not None) - self._max_files)]:
+                try:
+                    itm.unlink()
+                except FileNotFoundError:
+                    pass
+                self._file_locks.pop(itm.name, None)
+                removed += 1
+
+        return removed
@@ -0,0 +1,66 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+FlightStats = Dict[str, int]
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical calls which are in flight at the same time. The first caller for a key runs the call,
+    callers arriving before it completes wait on its future and get the shared result. Completed calls
+    are not cached.
+    """
+
+    def __init__(self, name: str = ''):
+        self.name: str = name
+        self._lock: threading.Lock = threading.Lock()
+        self._flights: Dict[Hashable, Future] = {}
+        self._executed: int = 0
+        self._coalesced: int = 0
+
+    def do(self, key: Hashable, call: Callable[[], Any]) -> Any:
+        """
+        Run the call, or wait for the running call with the same key
+        """
+        with self._lock:
+            future: Future = self._flights.get(key)
+            leader: bool = future is None
+            if leader:
+                future = self._flights[key] = Future()
+                self._executed += 1
+            else:
+                self._coalesced += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result: Any = call()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    @property
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    @property
+    def stats(self) -> 'FlightStats':
+        """
+        Number of calls run, calls served by a running call, and calls in flight
+        """
+        with self._lock:
+            return {'executed': self._executed, 'coalesced': self._coalesced, 'in_flight': len(self._flights)}
+
+    def reset_stats(self):
+        with self._lock:
+            self._executed = 0
+            self._coalesced = 0
@@ -0,0 +1,91 @@
+from typing import Dict, List, Tuple
+
+import numpy
+import pandas
+
+# Layer with the single national total, it contains all other layers
+NATIONAL_LAYER: str = 'NATIONAL'
+
+
+class RegionHierarchy(object):
+    """
+    Membership index between region layers with nested codes, e.g. municipality 0114 is in county 01.
+    Layers with shorter codes are coarser, a layer rolls up into a coarser one if every code starts with a
+    code of the coarser layer. All layers roll up into the national total.
+    """
+
+    def __init__(self, layers: Dict[str, List[str]], total_code: str = '00'):
+        self._keys: Dict[str, numpy.ndarray] = {name: numpy.array([str(key) for key in keys], dtype=object)
+                                                for name, keys in layers.items()}
+        self._keys[NATIONAL_LAYER] = numpy.array([total_code], dtype=object)
+        self._index: Dict[str, pandas.Index] = {name: pandas.Index(keys) for name, keys in self._keys.items()}
+
+        # Code length of the layer, the national total is the coarsest layer
+        self._levels: Dict[str, int] = {name: max([len(key) for key in keys] or [0])
+                                        for name, keys in self._keys.items()}
+        self._levels[NATIONAL_LAYER] = 0
+
+        # Position of the parent region in the coarser layer, for each region of the finer layer
+        self._parents: Dict[Tuple[str, str], numpy.ndarray] = {}
+        for fine in layers.keys():
+            self._parents[(fine, NATIONAL_LAYER)] = numpy.zeros(len(self._keys[fine]), dtype=int)
+            for coarse in layers.keys():
+                if self._levels[coarse] < self._levels[fine]:
+                    parents: numpy.ndarray = self._match(fine, coarse)
+                    if len(parents) > 0 and (parents >= 0).all():
+                        self._parents[(fine, coarse)] = parents
+
+    @property
+    def layers(self) -> List[str]:
+        return list(self._keys.keys())
+
+    def keys(self, layer: str) -> List[str]:
+        return self._keys[layer].tolist()
+
+    def is_nested(self, fine: str, coarse: str) -> bool:
+        return (fine, coarse) in self._parents
+
+    def finer(self, layer: str) -> List[str]:
+        """
+        Layers rolling up into the layer, closest first
+        """
+        return sorted([fine for (fine, coarse) in self._parents.keys() if coarse == layer],
+                      key=lambda name: self._levels[name])
+
+    def parents(self, fine: str, coarse: str) -> numpy.ndarray:
+        """
+        Position of the parent in the coarser layer for each region of the finer layer
+        """
+        return self._parents[(fine, coarse)]
+
+    def rollup(self, df: pandas.DataFrame, fine: str, coarse: str, region_col: str = 'region') -> pandas.DataFrame:
+        """
+        Sum numeric columns of the finer layer result by region of the coarser layer and the other key columns.
+        Rows of unknown regions are dropped, groups without values stay NaN. Only additive values,
+        e.g. counts, give meaningful sums, callers must not roll up ratios or averages.
+        """
+        positions: numpy.ndarray = self._index[fine].get_indexer(df[region_col].astype(str).values)
+        mask: numpy.ndarray = positions >= 0
+        df_fine: pandas.DataFrame = df.loc[mask]
+        regions: numpy.ndarray = self._keys[coarse][self._parents[(fine, coarse)][positions[mask]]]
+
+        value_cols: List[str] = [col for col in df.columns if col != region_col and df[col].dtype.kind in 'fiu']
+        key_cols: List[str] = [col for col in df.columns if col != region_col and col not in value_cols]
+
+        grouped: pandas.DataFrame = df_fine[value_cols].groupby([regions] + [df_fine[col].values for col in key_cols],
+                                                                sort=True).sum(min_count=1)
+        grouped.index.names = [region_col] + key_cols
+
+        return grouped.reset_index()[list(df.columns)]
+
+    def _match(self, fine: str, coarse: str) -> numpy.ndarray:
+        """
+        Parent positions by code prefix, -1 if a region has no parent
+        """
+        parents: numpy.ndarray = numpy.full(len(self._keys[fine]), -1, dtype=int)
+        for length in sorted({len(key) for key in self._keys[coarse]}, reverse=True):
+            prefixes: List[str] = [key[:length] for key in self._keys[fine]]
+            found: numpy.ndarray = self._index[coarse].get_indexer(prefixes)
+            parents = numpy.where(parents >= 0, parents, found)
+
+        return parents
@@ -0,0 +1,227 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from typing import Any, Callable, Dict, List
+
+JobStatus = Dict[str, Any]
+
+
+class JobStateEnum(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a job when it has been cancelled
+    """
+    pass
+
+
+class JobLimitError(Exception):
+    """
+    Raised when an owner has too many active jobs
+    """
+    pass
+
+
+class Job(object):
+    """
+    Background call with progress reporting. The call receives the job and reports progress with
+    update(), which raises JobCancelled once the job is cancelled.
+    """
+
+    def __init__(self, owner: str, key: str, call: Callable[['Job'], Any]):
+        self.id: str = uuid.uuid4().hex
+        self.owner: str = owner
+        self.key: str = key
+        self.state: JobStateEnum = JobStateEnum.QUEUED
+        self.progress: float = 0.0
+        self.message: str = ''
+        self.result: Any = None
+        self.error: str = None
+        self.created: float = time.time()
+        self.finished: float = None
+        self._call: Callable[['Job'], Any] = call
+        self._cancelled: threading.Event = threading.Event()
+        self._future: Future = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in (JobStateEnum.QUEUED, JobStateEnum.RUNNING) and not self._cancelled.is_set()
+
+    @property
+    def pending(self) -> bool:
+        """
+        Queued or running, cancelled calls keep their worker until the next progress update
+        """
+        return self.state in (JobStateEnum.QUEUED, JobStateEnum.RUNNING)
+
+    @property
+    def started(self) -> bool:
+        """
+        Handed to the thread pool, jobs waiting for a worker of their owner are not started
+        """
+        return self._future is not None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def update(self, progress: float, message: str = ''):
+        """
+        Report progress between 0 and 1, stops the job if it was cancelled
+        """
+        if self._cancelled.is_set():
+            raise JobCancelled()
+        self.progress = progress
+        self.message = message
+
+    def cancel(self):
+        """
+        Cancel the job, a running call stops at its next progress update
+        """
+        self._cancelled.set()
+        if self._future is None or self._future.cancel():
+            self._finish(JobStateEnum.CANCELLED)
+
+    def status(self) -> 'JobStatus':
+        return {'id': self.id, 'key': self.key, 'state': self.state.value, 'progress': self.progress,
+                'message': self.message, 'error': self.error}
+
+    def run(self):
+        if self._cancelled.is_set():
+            self._finish(JobStateEnum.CANCELLED)
+            return
+
+        self.state = JobStateEnum.RUNNING
+        try:
+            self.result = self._call(self)
+        except JobCancelled:
+            self._finish(JobStateEnum.CANCELLED)
+        except Exception as e:
+            self.error = str(e)
+            self._finish(JobStateEnum.FAILED)
+        else:
+            self.progress = 1.0
+            self._finish(JobStateEnum.CANCELLED if self._cancelled.is_set() else JobStateEnum.DONE)
+
+    def _finish(self, state: JobStateEnum):
+        self.finished = time.time()
+        self.state = state
+
+
+class JobQueue(object):
+    """
+    Runs jobs on a local thread pool. Each owner, e.g. a browser session, can have a limited number of active
+    jobs, and as many started jobs. Cancelled jobs keep their worker until their call stops, new jobs of the
+    owner wait behind them instead of being rejected. Finished jobs are kept until they are pushed out of
+    the history.
+    """
+
+    def __init__(self, workers: int = 4, owner_limit: int = 2, history: int = 256):
+        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=workers)
+        self._owner_limit: int = owner_limit
+        self._history: int = history
+        self._jobs: 'OrderedDict[str, Job]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def submit(self, owner: str, key: str, call: Callable[['Job'], Any]) -> Job:
+        """
+        Queue call for the owner, raises JobLimitError if the owner has too many active jobs
+        """
+        job: Job = Job(owner=owner, key=key, call=call)
+        with self._lock:
+            if len(self._active(owner)) >= self._owner_limit:
+                raise JobLimitError('too many active jobs, wait for a job to finish')
+
+            self._jobs[job.id] = job
+            started: List[Future] = self._start_waiting(owner)
+
+            # Drop oldest finished jobs
+            finished: List[str] = [job_id for job_id, itm in self._jobs.items() if not itm.pending]
+            for job_id in finished[:max(0, len(self._jobs) - self._history)]:
+                del self._jobs[job_id]
+
+        self._watch(owner, started)
+        return job
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel job, returns False if the job is unknown or not active
+        """
+        job: Job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+
+        job.cancel()
+        return True
+
+    def cancel_owner(self, owner: str, keep: str = None) -> int:
+        """
+        Cancel all active jobs of the owner except the job for the key to keep. Returns number of cancelled jobs.
+        """
+        with self._lock:
+            jobs: List[Job] = [job for job in self._active(owner) if keep is None or job.key != keep]
+        for job in jobs:
+            job.cancel()
+
+        return len(jobs)
+
+    def find(self, owner: str, key: str) -> Job:
+        """
+        Active job of the owner for the key
+        """
+        with self._lock:
+            return next((job for job in self._active(owner) if job.key == key), None)
+
+    def shutdown(self):
+        with self._lock:
+            jobs: List[Job] = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _active(self, owner: str) -> List[Job]:
+        return [job for job in self._jobs.values() if job.owner == owner and job.active]
+
+    def _start_waiting(self, owner: str) -> List[Future]:
+        """
+        Start waiting jobs of the owner while it has fewer started jobs than the limit, the caller holds the lock
+        and watches the returned futures once it is released
+        """
+        jobs: List[Job] = [job for job in self._jobs.values() if job.owner == owner and job.pending]
+        count: int = sum(1 for job in jobs if job.started)
+        started: List[Future] = []
+        for job in jobs:
+            if count >= self._owner_limit:
+                break
+            if not job.started:
+                job._future = self._executor.submit(job.run)
+                started.append(job._future)
+                count += 1
+
+        return started
+
+    def _watch(self, owner: str, futures: List[Future]):
+        """
+        Start the next waiting job of the owner when a started job frees its worker
+        """
+        for future in futures:
+            # Called right away if the job is already done, so the lock must not be held
+            future.add_done_callback(lambda itm: self._finished(owner))
+
+    def _finished(self, owner: str):
+        with self._lock:
+            started: List[Future] = self._start_waiting(owner)
+        self._watch(owner, started)
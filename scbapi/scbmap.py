@@ -1,10 +1,22 @@
-import geopandas
-import fiona
-from fiona.session import AWSSession
-from typing import List
+import math
+import pathlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple, TYPE_CHECKING
 from enum import Enum
 from pydantic import BaseModel
 
+from scbapi.scbmemory import deep_size
+
+if TYPE_CHECKING:
+    import geopandas
+    from shapely.strtree import STRtree
+
+# Half circumference of the earth in web mercator projection
+MERCATOR_ORIGIN: float = 20037508.342789244
+
+TileIndex = Tuple[int, int, int]
+
 # TODO Remove this
 class RegionEnum(Enum):
     MUNICIPALITIES = "MUNICIPALITIES"
@@ -39,32 +51,220 @@ class Region(BaseModel):
             return '/'.join(['zip+s3:/', self.s3_bucket, self.s3_key])
 
 
+class VectorTiles(object):
+    """
+    Mapbox vector tiles of region geometries. Tiles in the configured zoom range are generated up front and
+    kept in memory or in a local folder, other zoom levels are generated on request.
+    """
+    LAYER_NAME: str = 'regions'
+    EXTENT: int = 4096
+
+    # Number of filtered and on request tiles kept in memory
+    CACHE_SIZE: int = 2048
+
+    def __init__(self, gdf: 'geopandas.GeoDataFrame', key_col: str, min_zoom: int, max_zoom: int,
+                 folder: str = None):
+        from shapely.strtree import STRtree
+
+        gdf_mercator: 'geopandas.GeoDataFrame' = gdf.to_crs({'init': 'epsg:3857'})
+        self._keys: List[str] = gdf[key_col].astype(str).tolist()
+        self._geometries: List = gdf_mercator.geometry.tolist()
+        self._positions: Dict[int, int] = {id(geom): pos for pos, geom in enumerate(self._geometries)}
+        self._tree: 'STRtree' = STRtree(self._geometries)
+        self._bounds: Tuple[float, float, float, float] = tuple(gdf_mercator.total_bounds)
+        self.min_zoom: int = min_zoom
+        self.max_zoom: int = max_zoom
+        self._folder: pathlib.Path = pathlib.Path(folder) if folder else None
+        self._tiles: Dict['TileIndex', bytes] = {}
+        self._cache: 'OrderedDict[tuple, bytes]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+        """
+        Web mercator bounds of the tile
+        """
+        size: float = 2 * MERCATOR_ORIGIN / 2 ** z
+        minx: float = -MERCATOR_ORIGIN + x * size
+        maxy: float = MERCATOR_ORIGIN - y * size
+        return minx, maxy - size, minx + size, maxy
+
+    def memory_usage(self) -> int:
+        """
+        Bytes used by the projected geometries, the index and tiles kept in memory
+        """
+        with self._lock:
+            tiles: List[bytes] = list(self._tiles.values()) + list(self._cache.values())
+
+        return deep_size(self._geometries) + deep_size(self._positions) + deep_size(self._keys) + \
+            sum(len(tile) for tile in tiles)
+
+    def tile_range(self, z: int) -> Iterator['TileIndex']:
+        """
+        Tiles covering the regions on the selected zoom level
+        """
+        size: float = 2 * MERCATOR_ORIGIN / 2 ** z
+        last: int = 2 ** z - 1
+        minx, miny, maxx, maxy = self._bounds
+        for x in range(max(0, math.floor((minx + MERCATOR_ORIGIN) / size)),
+                       min(last, math.floor((maxx + MERCATOR_ORIGIN) / size)) + 1):
+            for y in range(max(0, math.floor((MERCATOR_ORIGIN - maxy) / size)),
+                           min(last, math.floor((MERCATOR_ORIGIN - miny) / size)) + 1):
+                yield z, x, y
+
+    def generate(self):
+        """
+        Generate tiles for the configured zoom levels
+        """
+        for z in range(self.min_zoom, self.max_zoom + 1):
+            for index in self.tile_range(z):
+                tile: bytes = self._encode(*index)
+                if self._folder is not None:
+                    path: pathlib.Path = self._folder.joinpath(*[str(i) for i in index]).with_suffix('.pbf')
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    path.write_bytes(tile)
+                else:
+                    self._tiles[index] = tile
+
+    def get_tile(self, z: int, x: int, y: int, keys: List[str] = None) -> Optional[bytes]:
+        """
+        Get tile, optionally with the selected regions only. Returns None for empty tiles.
+        """
+        cache_key: tuple = (z, x, y, tuple(sorted(keys)) if keys is not None else None)
+        with self._lock:
+            tile: bytes = self._cache.get(cache_key)
+            if tile is not None:
+                self._cache.move_to_end(cache_key)
+
+        if tile is None:
+            tile = self._load(z, x, y)
+            if keys is not None and tile:
+                tile = self._filter(tile, set(keys))
+
+            with self._lock:
+                self._cache[cache_key] = tile
+                while len(self._cache) > self.CACHE_SIZE:
+                    self._cache.popitem(last=False)
+
+        return tile if tile else None
+
+    def _load(self, z: int, x: int, y: int) -> bytes:
+        """
+        Read pre-generated tile or generate it outside of the configured zoom range
+        """
+        if self.min_zoom <= z <= self.max_zoom:
+            if self._folder is not None:
+                path: pathlib.Path = self._folder.joinpath(str(z), str(x), str(y)).with_suffix('.pbf')
+                if path.exists():
+                    return path.read_bytes()
+            elif (z, x, y) in self._tiles:
+                return self._tiles[(z, x, y)]
+
+        return self._encode(z, x, y)
+
+    def _encode(self, z: int, x: int, y: int) -> bytes:
+        """
+        Clip and simplify geometries intersecting the tile and encode them
+        """
+        import mapbox_vector_tile
+        from shapely.geometry import box
+
+        bounds: Tuple[float, float, float, float] = self.tile_bounds(z, x, y)
+        tolerance: float = (bounds[2] - bounds[0]) / self.EXTENT
+
+        # Clip with a small buffer to avoid seams on tile borders
+        clip_box = box(*bounds).buffer(tolerance * 8, join_style=2)
+
+        features: List[dict] = []
+        for geom in self._tree.query(clip_box):
+            clipped = geom.simplify(tolerance, preserve_topology=True).intersection(clip_box)
+            if not clipped.is_empty:
+                key: str = self._keys[self._positions[id(geom)]]
+                features.append({'geometry': clipped, 'properties': {'key': key}})
+
+        if len(features) == 0:
+            return b''
+
+        return mapbox_vector_tile.encode({'name': self.LAYER_NAME, 'features': features},
+                                         quantize_bounds=bounds, extents=self.EXTENT)
+
+    def _filter(self, tile: bytes, keys: set) -> bytes:
+        """
+        Re-encode tile with the features of the selected regions
+        """
+        import mapbox_vector_tile
+
+        layer: dict = mapbox_vector_tile.decode(tile).get(self.LAYER_NAME, {'features': []})
+        features: List[dict] = [{'geometry': feature['geometry'], 'properties': feature['properties']}
+                                for feature in layer['features'] if feature['properties'].get('key') in keys]
+
+        if len(features) == 0:
+            return b''
+
+        return mapbox_vector_tile.encode({'name': self.LAYER_NAME, 'features': features}, extents=self.EXTENT)
+
+
 class MapHandler(object):
     region: Region
-    gdf: geopandas.geodataframe
+    gdf: 'geopandas.GeoDataFrame'
+    _tiles: VectorTiles = None
+    _spatial_index: Tuple['STRtree', Dict[int, int], List[str]] = None
+    _key_positions: Dict[str, int] = None
+    downgraded: bool = False
 
-    def __init__(self, region: Region):
+    def __init__(self, region: Region, path: str = None):
         self.region: Region = region
-        self.__load_map()
+        self.__load_map(path)
 
-    def __load_map(self):
+    def __load_map(self, path: str = None):
         """
-        Download/open Sweden regional shape files and prepare geo dataframe
+        Download/open Sweden regional shape files and prepare geo dataframe, a local copy of the archive is
+        read if provided
         """
+        import fiona
+        import geopandas
+        from fiona.session import AWSSession
 
-        if self.region.is_s3:
+        if path is not None:
+            gdf: 'geopandas.GeoDataFrame' = geopandas.read_file('zip://' + path)
+        elif self.region.is_s3:
             with fiona.Env(session=AWSSession(aws_unsigned=True)):
-                gdf: geopandas.geodataframe = geopandas.read_file(self.region.zip_url)
+                gdf: 'geopandas.GeoDataFrame' = geopandas.read_file(self.region.zip_url)
         else:
-            gdf: geopandas.geodataframe = geopandas.read_file(self.region.zip_url)
+            gdf: 'geopandas.GeoDataFrame' = geopandas.read_file(self.region.zip_url)
 
         gdf = gdf.to_crs({'init': 'epsg:4326'})
         self.gdf = gdf
 
-    def get_dataframe(self, indexed: bool = True) -> geopandas.geodataframe:
-        gdf: geopandas.GeoDataFrame = self.gdf
+    def memory_usage(self) -> int:
+        """
+        Bytes used by the geo dataframe, the spatial index and vector tiles
+        """
+        size: int = deep_size(self.gdf) + deep_size(self._key_positions)
+        if self._spatial_index is not None:
+            # Tree only references the geometries of the geo dataframe
+            size += deep_size(self._spatial_index[1:])
+        if self._tiles is not None:
+            size += self._tiles.memory_usage()
+
+        return size
+
+    def downgrade(self, tolerance: float):
+        """
+        Replace geometries with simplified ones to free memory, the spatial index and tiles are rebuilt on request.
+        Tolerance is in degrees.
+        """
+        gdf: 'geopandas.GeoDataFrame' = self.gdf.copy()
+        gdf[gdf.geometry.name] = gdf.geometry.simplify(tolerance, preserve_topology=True)
+        self.gdf = gdf
+        self._spatial_index = None
+        self._tiles = None
+        self.downgraded = True
+
+    def get_dataframe(self, indexed: bool = True) -> 'geopandas.GeoDataFrame':
+        gdf: 'geopandas.GeoDataFrame' = self.gdf
         if indexed:
-            gdf: geopandas.GeoDataFrame = self.gdf.set_index(self.region.key_col)
+            gdf: 'geopandas.GeoDataFrame' = self.gdf.set_index(self.region.key_col)
 
         return gdf
 
@@ -79,3 +279,72 @@ class MapHandler(object):
         Get name values from geo dataframe as list
         """
         return self.gdf[self.region.name_col].tolist()
+
+    def get_position(self, key: str) -> Optional[int]:
+        """
+        Row position of the region in the geo dataframe, None for unknown keys
+        """
+        if self._key_positions is None:
+            self._key_positions = {str(key): pos for pos, key in enumerate(self.gdf[self.region.key_col])}
+
+        return self._key_positions.get(str(key))
+
+    def region_at(self, lon: float, lat: float) -> Optional[str]:
+        """
+        Key of the region containing the point, None outside of all regions
+        """
+        from shapely.geometry import Point
+
+        point = Point(lon, lat)
+        keys: List[str] = self._query(point, lambda geom: geom.covers(point))
+        return keys[0] if len(keys) > 0 else None
+
+    def regions_in(self, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> List[str]:
+        """
+        Keys of the regions intersecting the bounding box, in map order
+        """
+        from shapely.geometry import box
+
+        bbox = box(min_lon, min_lat, max_lon, max_lat)
+        return self._query(bbox, lambda geom: geom.intersects(bbox))
+
+    def regions_within(self, coordinates: List[Tuple[float, float]]) -> List[str]:
+        """
+        Keys of the regions intersecting the polygon of lon, lat coordinates, e.g. a lasso selection
+        """
+        from shapely.geometry import Polygon
+
+        polygon = Polygon(coordinates)
+        return self._query(polygon, lambda geom: geom.intersects(polygon))
+
+    def _query(self, shape, predicate) -> List[str]:
+        """
+        Keys of the regions whose bounding box intersects the shape and matching the exact predicate
+        """
+        from shapely.strtree import STRtree
+
+        # Tree, positions of the tree geometries and keys are built together, so threads never mix them
+        if self._spatial_index is None:
+            geometries: List = self.gdf.geometry.tolist()
+            self._spatial_index = (STRtree(geometries), {id(geom): pos for pos, geom in enumerate(geometries)},
+                                   [str(key) for key in self.gdf[self.region.key_col]])
+
+        tree, tree_positions, keys = self._spatial_index
+        positions: List[int] = sorted(tree_positions[id(geom)] for geom in tree.query(shape) if predicate(geom))
+        return [keys[pos] for pos in positions]
+
+    @property
+    def has_tiles(self) -> bool:
+        return self._tiles is not None
+
+    def get_tiles(self, min_zoom: int, max_zoom: int, folder: str = None) -> VectorTiles:
+        """
+        Get vector tiles of the regions, tiles are generated on first call
+        """
+        if self._tiles is None:
+            tiles: VectorTiles = VectorTiles(self.gdf, key_col=self.region.key_col, min_zoom=min_zoom,
+                                             max_zoom=max_zoom, folder=folder)
+            tiles.generate()
+            self._tiles = tiles
+
+        return self._tiles
@@ -0,0 +1,56 @@
+import sys
+from typing import Any, Set
+
+# Approximate size of a shapely geometry object without its coordinates
+GEOMETRY_OVERHEAD: int = 64
+
+
+def geometry_size(geom: Any) -> int:
+    """
+    Approximate size of a geometry, coordinates are stored as doubles by GEOS
+    """
+    if geom is None:
+        return 0
+    return GEOMETRY_OVERHEAD + len(geom.wkb)
+
+
+def deep_size(obj: Any, seen: Set[int] = None) -> int:
+    """
+    Size of the object and everything it references. Objects referenced more than once are counted once.
+    Data frames and arrays are measured by their buffers, geometries by their coordinates.
+    """
+    if seen is None:
+        seen = set()
+    if obj is None or id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    module: str = type(obj).__module__ or ''
+    if module.startswith('pandas') or module.startswith('geopandas'):
+        if hasattr(obj, 'columns'):
+            # Frame usage with index=True fails with newer numpy, the index is measured on its own
+            size: int = int(obj.memory_usage(index=False, deep=True).sum()) + int(obj.index.memory_usage(deep=True))
+            if hasattr(obj, 'geometry'):
+                # Object column of a geo data frame only holds the references to the geometries
+                size += sum(geometry_size(geom) for geom in obj.geometry)
+            return size
+        if hasattr(obj, 'memory_usage'):
+            return int(obj.memory_usage(deep=True))
+    if module.startswith('numpy') and hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    if module.startswith('shapely'):
+        return geometry_size(obj)
+
+    size: int = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(itm, seen) for itm in obj)
+    elif not isinstance(obj, (str, bytes, int, float, bool)):
+        attributes = getattr(obj, '__dict__', None)
+        if attributes is not None:
+            size += deep_size(attributes, seen)
+        for name in getattr(type(obj), '__slots__', ()):
+            size += deep_size(getattr(obj, name, None), seen)
+
+    return size
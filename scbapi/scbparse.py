@@ -0,0 +1,365 @@
+import codecs
+import json
+import re
+from functools import reduce
+from typing import Any, Dict, IO, Iterable, Iterator, List, Tuple
+
+import numpy
+import pandas
+
+# Size of the byte chunks read from the response body
+CHUNK_SIZE: int = 1 << 16
+
+# End of an array of objects
+ARRAY_END = re.compile(r'}\s*]')
+
+Columns = List[Dict[str, str]]
+ParseResult = Tuple['Columns', pandas.DataFrame]
+
+
+class TextStream(object):
+    """
+    Incrementally decoded text buffer over an iterator of byte chunks. Consumed text is dropped
+    whenever a new chunk is read, so only the unparsed tail is kept in memory.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], encoding: str = 'utf-8-sig'):
+        self._chunks: Iterator[bytes] = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self.buffer: str = ''
+        self.pos: int = 0
+        self.eof: bool = False
+
+    def fill(self) -> bool:
+        """
+        Read the next chunk into the buffer. Returns False if the stream is exhausted
+        """
+        if self.eof:
+            return False
+
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+
+        chunk: bytes = next(self._chunks, None)
+        if chunk is None:
+            self.buffer += self._decoder.decode(b'', final=True)
+            self.eof = True
+        else:
+            self.buffer += self._decoder.decode(chunk)
+
+        return True
+
+    def peek(self) -> str:
+        """
+        Next non whitespace character, empty string at the end of the stream
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self.fill():
+                return ''
+
+    def expect(self, char: str):
+        """
+        Consume the expected character
+        """
+        if self.peek() != char:
+            raise ValueError('invalid response, expected {}'.format(char))
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        """
+        Decode a complete JSON value at the current position
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.pos)
+                # A value ending at the buffer boundary might continue in the next chunk (e.g. numbers)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+
+            self.fill()
+
+    def iter_members(self) -> Iterator[str]:
+        """
+        Iterate over member names of the JSON object at the current position. The caller must consume
+        the value of each member before asking for the next one.
+        """
+        self.expect('{')
+        while True:
+            char: str = self.peek()
+            if char == '}':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+
+            name: str = self.decode_value()
+            self.expect(':')
+            yield name
+
+    def iter_object_batches(self) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Iterate over batches of the JSON array of flat objects at the current position. Batches are cut
+        after the last closing brace of the array in the buffer and decoded at once.
+        """
+        self.expect('[')
+        while True:
+            char: str = self.peek()
+            if char == ']':
+                self.pos += 1
+                return
+            if char == ',':
+                self.pos += 1
+                continue
+
+            array_end = ARRAY_END.search(self.buffer, self.pos)
+            end: int = array_end.start() if array_end is not None else self.buffer.rfind('}', self.pos)
+            if end == -1:
+                if not self.fill():
+                    raise ValueError('invalid response, unterminated array')
+                continue
+
+            segment: str = self.buffer[self.pos:end + 1]
+            try:
+                batch: List[Dict[str, Any]] = json.loads('[' + segment + ']')
+                self.pos = end + 1
+            except json.JSONDecodeError:
+                # Closing brace inside a string or a split object, fall back to a single element
+                batch = [self.decode_value()]
+
+            yield batch
+
+    def iter_scalar_batches(self) -> Iterator[List[Any]]:
+        """
+        Iterate over batches of the JSON array of numbers, strings without commas or nulls at the current position
+        """
+        self.expect('[')
+        while True:
+            if self.peek() == '':
+                raise ValueError('invalid response, unterminated array')
+
+            close: int = self.buffer.find(']', self.pos)
+            if close != -1:
+                batch: List[Any] = json.loads('[' + self.buffer[self.pos:close] + ']')
+                self.pos = close + 1
+                yield batch
+                return
+
+            cut: int = self.buffer.rfind(',', self.pos)
+            if cut == -1:
+                if not self.fill():
+                    raise ValueError('invalid response, unterminated array')
+                continue
+
+            batch = json.loads('[' + self.buffer[self.pos:cut] + ']')
+            self.pos = cut + 1
+            yield batch
+
+
+class ArrayWriter(object):
+    """
+    Preallocated two dimensional array filled by blocks of rows, grows only if the size hint was too small
+    """
+
+    def __init__(self, rows: int, dtype: Any):
+        self._rows: int = max(rows, 1)
+        self._dtype = dtype
+        self._array: numpy.ndarray = None
+        self.size: int = 0
+
+    def write(self, block: numpy.ndarray):
+        """
+        Copy block of rows to the end of the array
+        """
+        if block.ndim == 1:
+            block = block.reshape(-1, 1)
+
+        if self._array is None:
+            self._array = numpy.empty((self._rows, block.shape[1]), dtype=self._dtype)
+
+        end: int = self.size + block.shape[0]
+        if end > self._array.shape[0]:
+            grown = numpy.empty((max(end, 2 * self._array.shape[0]), self._array.shape[1]), dtype=self._dtype)
+            grown[:self.size] = self._array[:self.size]
+            self._array = grown
+
+        self._array[self.size:end] = block
+        self.size = end
+
+    @property
+    def values(self) -> numpy.ndarray:
+        if self._array is None:
+            return numpy.empty((0, 0), dtype=self._dtype)
+        return self._array[:self.size]
+
+
+def _to_float(values: numpy.ndarray) -> numpy.ndarray:
+    """
+    Convert API values to floats, missing value markers become NaN
+    """
+    flat: pandas.Series = pandas.to_numeric(pandas.Series(values.ravel()), errors='coerce')
+    return flat.values.astype(float).reshape(values.shape)
+
+
+def _build_frame(columns: 'Columns', keys: numpy.ndarray, values: numpy.ndarray) -> pandas.DataFrame:
+    """
+    Create data frame from key and value arrays in the order of the result columns
+    """
+    key_ind: int = 0
+    val_ind: int = 0
+    df_dict: Dict[str, numpy.ndarray] = {}
+
+    for col in columns:
+        if col['type'] != 'c':
+            df_dict[col['text']] = keys[:, key_ind] if keys.size > 0 else numpy.empty(0, dtype=object)
+            key_ind += 1
+        else:
+            df_dict[col['text']] = values[:, val_ind] if values.size > 0 else numpy.empty(0, dtype=float)
+            val_ind += 1
+
+    return pandas.DataFrame(df_dict, columns=[col['text'] for col in columns])
+
+
+def parse_json(chunks: Iterable[bytes], rows: int) -> 'ParseResult':
+    """
+    Parse PX-Web JSON response while streaming, rows of the data array are written into preallocated arrays
+    """
+    stream: TextStream = TextStream(chunks)
+    columns: 'Columns' = []
+    keys: ArrayWriter = ArrayWriter(rows, dtype=object)
+    values: ArrayWriter = ArrayWriter(rows, dtype=float)
+
+    for name in stream.iter_members():
+        if name == 'data':
+            for batch in stream.iter_object_batches():
+                keys.write(numpy.array([itm['key'] for itm in batch], dtype=object))
+                values.write(_to_float(numpy.array([itm['values'] for itm in batch], dtype=object)))
+        elif name == 'columns':
+            columns = stream.decode_value()
+        else:
+            stream.decode_value()
+
+    return columns, _build_frame(columns, keys.values, values.values)
+
+
+def parse_json_stat2(chunks: Iterable[bytes], rows: int) -> 'ParseResult':
+    """
+    Parse json-stat2 response while streaming. The flat value array is written into a preallocated array,
+    key columns are generated from the dimension sizes, content codes are turned into value columns.
+    """
+    stream: TextStream = TextStream(chunks)
+    dataset: Dict[str, Any] = {}
+    values: ArrayWriter = ArrayWriter(rows, dtype=float)
+
+    for name in stream.iter_members():
+        if name == 'value':
+            for batch in stream.iter_scalar_batches():
+                values.write(numpy.array(batch, dtype=float))
+        else:
+            dataset[name] = stream.decode_value()
+
+    dim_ids: List[str] = dataset['id']
+    sizes: List[int] = dataset['size']
+    role: Dict[str, List[str]] = dataset.get('role', {})
+    metric: List[str] = role.get('metric', [])
+    time: List[str] = role.get('time', [])
+
+    # Ordered category codes for each dimension
+    categories: Dict[str, List[str]] = {}
+    for dim_id in dim_ids:
+        index = dataset['dimension'][dim_id]['category']['index']
+        categories[dim_id] = index if isinstance(index, list) else sorted(index, key=index.get)
+
+    # Move content dimension to the end, so content values become columns
+    cube: numpy.ndarray = values.values.reshape(sizes)
+    key_dims: List[str] = [dim_id for dim_id in dim_ids if dim_id not in metric]
+    val_dims: List[str] = [dim_id for dim_id in dim_ids if dim_id in metric]
+    cube = numpy.transpose(cube, [dim_ids.index(dim_id) for dim_id in key_dims + val_dims])
+
+    key_sizes: List[int] = [len(categories[dim_id]) for dim_id in key_dims]
+    row_count: int = reduce(lambda a, b: a * b, key_sizes, 1)
+    val_array: numpy.ndarray = cube.reshape(row_count, -1)
+
+    # Cartesian product of key dimensions in row-major order
+    key_array: numpy.ndarray = numpy.empty((row_count, len(key_dims)), dtype=object)
+    repeat: int = row_count
+    for i, dim_id in enumerate(key_dims):
+        repeat //= key_sizes[i]
+        codes: numpy.ndarray = numpy.array(categories[dim_id], dtype=object)
+        key_array[:, i] = numpy.tile(numpy.repeat(codes, repeat), row_count // (repeat * key_sizes[i]))
+
+    columns: 'Columns' = []
+    for dim_id in key_dims:
+        dim_type: str = 't' if dim_id in time else 'd'
+        columns.append({'code': dim_id, 'text': dataset['dimension'][dim_id]['label'], 'type': dim_type})
+    for dim_id in val_dims:
+        for code in categories[dim_id]:
+            label: str = dataset['dimension'][dim_id]['category'].get('label', {}).get(code, code)
+            columns.append({'code': code, 'text': label, 'type': 'c'})
+
+    return columns, _build_frame(columns, key_array, val_array)
+
+
+def parse_csv(raw: IO[bytes], variables: List[Dict[str, Any]]) -> 'ParseResult':
+    """
+    Parse PX-Web CSV response with the pandas C reader. The CSV has labelled key columns and the time
+    variable pivoted into value columns named by content and time, they are converted back to long format.
+    Variables are the selected query variables with code, text, time flag, values and valueTexts.
+    """
+    df_raw: pandas.DataFrame = pandas.read_csv(raw, encoding='utf-8-sig', dtype=str, engine='c')
+
+    texts: List[str] = [var['text'] for var in variables]
+    key_cols: List[str] = [col for col in df_raw.columns if col in texts]
+    val_cols: List[str] = [col for col in df_raw.columns if col not in texts]
+
+    # Labels in key columns are converted back to codes
+    columns: 'Columns' = []
+    for col in key_cols:
+        var: Dict[str, Any] = variables[texts.index(col)]
+        mapping: Dict[str, str] = {}
+        for code, text in zip(var['values'], var['valueTexts']):
+            mapping.update({text: code, code: code, '{} {}'.format(code, text): code})
+        df_raw[col] = df_raw[col].map(mapping).fillna(df_raw[col])
+        columns.append({'code': var['code'], 'text': col, 'type': 't' if var.get('time') else 'd'})
+
+    # Split value column names into content and time
+    time_var: Dict[str, Any] = next((var for var in variables if var.get('time')), None)
+    time_values: List[str] = time_var['values'] if time_var is not None and time_var['text'] not in key_cols else []
+
+    frames: Dict[str, List[pandas.DataFrame]] = {}
+    for col in val_cols:
+        time_value: str = next((val for val in time_values if col.endswith(val)), None)
+        content: str = col[:-len(time_value)].strip() if time_value is not None else col
+
+        frame: pandas.DataFrame = df_raw[key_cols].copy()
+        if time_value is not None:
+            frame[time_var['text']] = time_value
+        frame[content] = pandas.to_numeric(df_raw[col], errors='coerce').astype(float)
+        frames.setdefault(content, []).append(frame)
+
+    if time_values:
+        columns.append({'code': time_var['code'], 'text': time_var['text'], 'type': 't'})
+        key_cols = key_cols + [time_var['text']]
+
+    df: pandas.DataFrame = None
+    for content, content_frames in frames.items():
+        df_content: pandas.DataFrame = pandas.concat(content_frames, ignore_index=True)
+        df = df_content if df is None else df.merge(df_content, on=key_cols, how='outer')
+        columns.append({'code': content, 'text': content, 'type': 'c'})
+
+    if df is None:
+        df = df_raw[key_cols]
+
+    return columns, df[[col['text'] for col in columns]]
@@ -0,0 +1,177 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy
+import pandas
+
+from scbapi.scbstat import Query, FilterItem, FilterSelection, ResponseFormatEnum
+from scbapi.scbparse import Columns
+
+
+class PlannedRequest(object):
+    """
+    Single caller waiting for the data of a query
+    """
+
+    def __init__(self, query: Query):
+        self.query: Query = query
+        self.selection: List[FilterItem] = query.query
+        self.df: pandas.DataFrame = None
+        self.error: Exception = None
+        self.done: threading.Event = threading.Event()
+
+    @property
+    def codes(self) -> Tuple[str, ...]:
+        return tuple(itm.code for itm in self.selection)
+
+    def resolve(self, df: pandas.DataFrame = None, error: Exception = None):
+        self.df = df
+        self.error = error
+        self.done.set()
+
+
+class QueryPlanner(object):
+    """
+    Merges requests against the same table into one API call for the union of their selections.
+    Requests arriving within the batching window are planned together, each caller gets its own
+    slice of the combined result.
+    """
+
+    def __init__(self, cell_limit: int = 150000, window: float = 0.05):
+        self._cell_limit: int = cell_limit
+        self._window: float = window
+        self._lock: threading.Lock = threading.Lock()
+        self._pending: Dict[str, List[PlannedRequest]] = {}
+        self.api_calls: int = 0
+
+    def execute(self, query: Query) -> pandas.DataFrame:
+        """
+        Get data frame of the query, the first caller for a table waits for the window and runs the batch
+        """
+        request: PlannedRequest = PlannedRequest(query)
+        table: str = self._table_key(query)
+
+        with self._lock:
+            batch: List[PlannedRequest] = self._pending.get(table)
+            leader: bool = batch is None
+            if leader:
+                batch = self._pending[table] = []
+            batch.append(request)
+
+        if leader:
+            time.sleep(self._window)
+            with self._lock:
+                batch = self._pending.pop(table)
+            self._run(batch)
+
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+
+        return request.df
+
+    def execute_many(self, queries: List[Query]) -> List[pandas.DataFrame]:
+        """
+        Get data frames of queued queries, they are planned together without waiting
+        """
+        requests: List[PlannedRequest] = [PlannedRequest(query) for query in queries]
+
+        tables: Dict[str, List[PlannedRequest]] = {}
+        for request in requests:
+            tables.setdefault(self._table_key(request.query), []).append(request)
+        for batch in tables.values():
+            self._run(batch)
+
+        for request in requests:
+            if request.error is not None:
+                raise request.error
+
+        return [request.df for request in requests]
+
+    def plan(self, batch: List[PlannedRequest]) -> List[List[PlannedRequest]]:
+        """
+        Group requests which can share an API call. Requests need the same variables, and the union of
+        their selections has to stay within the cell limit.
+        """
+        groups: List[List[PlannedRequest]] = []
+        for request in batch:
+            for group in groups:
+                if group[0].codes == request.codes and \
+                        Query.count_cells(self.union(group + [request])) <= self._cell_limit:
+                    group.append(request)
+                    break
+            else:
+                groups.append([request])
+
+        return groups
+
+    @staticmethod
+    def union(group: List[PlannedRequest]) -> List[FilterItem]:
+        """
+        Filter items selecting the values of all requests in the group, in order of appearance
+        """
+        selection: List[FilterItem] = []
+        for i, item in enumerate(group[0].selection):
+            values: List[str] = []
+            for request in group:
+                values.extend(val for val in request.selection[i].selection.values if val not in values)
+            selection.append(FilterItem(code=item.code, selection=FilterSelection(filter="item", values=values)))
+
+        return selection
+
+    def _run(self, batch: List[PlannedRequest]):
+        """
+        Run the API calls of the batch, every request is resolved with its data or an error
+        """
+        try:
+            groups: List[List[PlannedRequest]] = self.plan(batch)
+        except Exception as e:
+            # Requests of other callers are waiting without a timeout
+            for request in batch:
+                request.resolve(error=e)
+            return
+
+        for group in groups:
+            with self._lock:
+                self.api_calls += 1
+            try:
+                if len(group) == 1:
+                    group[0].resolve(df=group[0].query.get_dataframe())
+                    continue
+
+                scb_columns, df = group[0].query.fetch(self.union(group))
+                for request in group:
+                    request.resolve(df=request.query.load_result(*self._slice(request, scb_columns, df)))
+            except Exception as e:
+                for request in group:
+                    if not request.done.is_set():
+                        request.resolve(error=e)
+
+    @staticmethod
+    def _slice(request: PlannedRequest, scb_columns: 'Columns',
+               df: pandas.DataFrame) -> Tuple['Columns', pandas.DataFrame]:
+        """
+        Rows and value columns of the combined result selected by the request
+        """
+        key_cols: Dict[str, str] = {col['code']: col['text'] for col in scb_columns if col['type'] != 'c'}
+
+        mask: numpy.ndarray = numpy.ones(len(df), dtype=bool)
+        contents: List[str] = []
+        for itm in request.selection:
+            if itm.code in key_cols:
+                mask &= df[key_cols[itm.code]].isin(itm.selection.values).values
+            else:
+                # Content values are columns, CSV names them by text
+                contents += itm.selection.values
+                contents += request.query.info.get_value_texts(values=itm.selection.values, code=itm.code)
+
+        columns: 'Columns' = [col for col in scb_columns
+                              if col['type'] != 'c' or len(contents) == 0 or col['code'] in contents]
+        df_slice: pandas.DataFrame = df.loc[mask, [col['text'] for col in columns]].reset_index(drop=True)
+
+        return columns, df_slice
+
+    @staticmethod
+    def _table_key(query: Query) -> str:
+        return '{}{}#{}'.format(query.url, query.path, query.response_format or ResponseFormatEnum.JSON.value)
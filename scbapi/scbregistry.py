@@ -0,0 +1,173 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional
+
+from scbapi.scbstat import QueryInfo
+
+Labels = List[Dict[str, str]]
+RegistryToken = Dict[str, Any]
+
+
+def definition_digest(query_itm: Dict[str, Any]) -> str:
+    """
+    Content hash of a query definition
+    """
+    content: str = json.dumps(query_itm, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def metadata_bytes(query_itm: Dict[str, Any]) -> Optional[bytes]:
+    """
+    Binary metadata of a query definition, None if the definition has no metadata
+    """
+    info: Dict[str, Any] = query_itm["query"].get("info")
+    return QueryInfo.trusted(info).to_bytes() if info is not None else None
+
+
+class QueryRegistry(Mapping):
+    """
+    Versioned server side store for query definitions. Every saved query gets a new version number,
+    so clients only need to keep the last version they have seen and the dropdown labels.
+    The content hash and the binary metadata are stored next to the definition, so cached queries
+    can be looked up without loading and hashing the definition. Seeded default queries are marked, so
+    changed defaults replace them, while queries saved by users are kept.
+    """
+    _conn: sqlite3.Connection = None
+    _lock: threading.RLock = None
+
+    def __init__(self, database: str = ':memory:'):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(database, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS queries ('
+                'key TEXT PRIMARY KEY, '
+                'version INTEGER NOT NULL, '
+                'name TEXT NOT NULL, '
+                'definition TEXT NOT NULL, '
+                'digest TEXT NOT NULL, '
+                'metadata BLOB, '
+                'seeded INTEGER NOT NULL DEFAULT 0)'
+            )
+
+    def __getitem__(self, query_key: str) -> Dict[str, Any]:
+        """
+        Load a single query definition including its metadata
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT definition FROM queries WHERE key = ?', (query_key,)).fetchone()
+
+        if row is None:
+            raise KeyError(query_key)
+
+        return json.loads(row[0])
+
+    def __iter__(self) -> Iterator[str]:
+        with self._lock:
+            keys: List[str] = [row[0] for row in self._conn.execute('SELECT key FROM queries ORDER BY version')]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+
+    def __contains__(self, query_key: object) -> bool:
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM queries WHERE key = ?', (query_key,)).fetchone()
+        return row is not None
+
+    def digest(self, query_key: str) -> str:
+        """
+        Content hash of the stored definition
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT digest FROM queries WHERE key = ?', (query_key,)).fetchone()
+
+        if row is None:
+            raise KeyError(query_key)
+
+        return row[0]
+
+    def get_info(self, query_key: str) -> Optional[QueryInfo]:
+        """
+        Metadata of the stored definition, read from the binary form without validation
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT metadata FROM queries WHERE key = ?', (query_key,)).fetchone()
+
+        if row is None:
+            raise KeyError(query_key)
+
+        if row[0] is None:
+            return None
+
+        try:
+            return QueryInfo.from_bytes(row[0])
+        except ValueError:
+            # Written by another Python version, metadata is read from the definition instead
+            return QueryInfo.trusted(self[query_key]["query"]["info"])
+
+    @property
+    def version(self) -> int:
+        """
+        Version of the latest change in the registry
+        """
+        with self._lock:
+            return self._conn.execute('SELECT COALESCE(MAX(version), 0) FROM queries').fetchone()[0]
+
+    def put(self, query_key: str, query_itm: Dict[str, Any]) -> int:
+        """
+        Add query definition to the registry and return the new version
+        """
+        with self._lock, self._conn:
+            # raise an error if key already exists in registry
+            row = self._conn.execute('SELECT 1 FROM queries WHERE key = ?', (query_key,)).fetchone()
+            if row is not None:
+                raise KeyError('key already exists')
+
+            return self._write(query_key, query_itm, seeded=False)
+
+    def seed(self, queries: Dict[str, Dict[str, Any]]):
+        """
+        Add default query definitions, e.g. the default query collection or the definitions of a snapshot.
+        Seeded definitions which changed are replaced, queries saved by users are never replaced.
+        """
+        with self._lock, self._conn:
+            for key, value in queries.items():
+                row = self._conn.execute('SELECT digest, seeded FROM queries WHERE key = ?', (key,)).fetchone()
+                if row is None or (row[1] and row[0] != definition_digest(value)):
+                    self._write(key, value, seeded=True)
+
+    def _write(self, query_key: str, query_itm: Dict[str, Any], seeded: bool) -> int:
+        """
+        Insert or replace definition with a new version, the caller holds the lock
+        """
+        version: int = self._conn.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM queries').fetchone()[0]
+        self._conn.execute('INSERT OR REPLACE INTO queries (key, version, name, definition, digest, metadata, seeded) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (query_key, version, query_itm["query"]["name"],
+                            json.dumps(query_itm, ensure_ascii=False), definition_digest(query_itm),
+                            metadata_bytes(query_itm), int(seeded)))
+
+        return version
+
+    def labels(self, since: int = 0) -> 'Labels':
+        """
+        Dropdown labels of queries changed after the given version
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT key, name FROM queries WHERE version > ? ORDER BY version',
+                                      (since,)).fetchall()
+
+        return [{'label': name, 'value': key} for (key, name) in rows]
+
+    def token(self, since: int = 0) -> 'RegistryToken':
+        """
+        Version token with the labels of queries changed after the given version. Called with the default
+        it returns the full content for the browser store, otherwise the delta to merge into it.
+        """
+        with self._lock:
+            return {'version': self.version, 'labels': self.labels(since=since)}
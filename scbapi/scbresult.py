@@ -0,0 +1,291 @@
+import hashlib
+import json
+import numpy
+import pandas
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from scbapi.scbutils import MappingTools, Colorscale
+from scbapi.scbhierarchy import RegionHierarchy
+from scbapi.scbmemory import deep_size
+
+SortBy = List[Dict[str, str]]
+SortKey = Tuple[Tuple[str, str], ...]
+
+
+class RegionYearMatrix(object):
+    """
+    Dense region x year matrix of a query result. Rows are aligned to the map keys, regions without data
+    are NaN. Color scales are classified across all years, so selecting a year is a column lookup.
+    """
+
+    def __init__(self, df: pandas.DataFrame, value_col: str, keys: List[str], region_col: str = 'region',
+                 year_col: str = 'year'):
+        # Sum of duplicate cells, missing values stay NaN instead of being summed to zero
+        pivot: pandas.DataFrame = df.groupby([region_col, year_col])[value_col].sum(min_count=1).unstack()
+        pivot.index = pivot.index.astype(str)
+        pivot = pivot.reindex(index=[str(key) for key in keys])
+
+        self.keys: List[str] = list(pivot.index)
+        self.years: List[str] = [str(year) for year in pivot.columns]
+        self.values: numpy.ndarray = pivot.values.astype(float)
+        self._colorscales: Dict[tuple, 'Colorscale'] = {}
+
+    @property
+    def totals(self) -> numpy.ndarray:
+        """
+        Sum over all years for each region, NaN if the region has no data
+        """
+        totals: numpy.ndarray = numpy.nansum(self.values, axis=1)
+        totals[numpy.isnan(self.values).all(axis=1)] = numpy.nan
+        return totals
+
+    def column(self, year: str) -> numpy.ndarray:
+        """
+        Values of all regions in the selected year
+        """
+        return self.values[:, self.years.index(year)]
+
+    def colorscale(self, colors: List[str], classifier: str = None, totals: bool = False) -> 'Colorscale':
+        """
+        Color scale classified over the values of all years, or over the totals
+        """
+        cache_key: tuple = (tuple(colors), classifier, totals)
+        if cache_key not in self._colorscales:
+            values: numpy.ndarray = self.totals if totals else self.values.ravel()
+            df: pandas.DataFrame = pandas.DataFrame({'value': values[~numpy.isnan(values)]})
+            self._colorscales[cache_key] = MappingTools.get_colorscale(df=df, column='value', colors=colors,
+                                                                       classifier=classifier)
+
+        return self._colorscales[cache_key]
+
+
+class QueryResult(object):
+    """
+    Query result kept on server side. Sort orders and filters are computed once and cached,
+    so every page request is a slice of precomputed row positions.
+    """
+
+    # Filter operators of the data table query syntax, with the pandas comparison to use
+    FILTER_OPERATORS: List[Tuple[str, str]] = [
+        ('contains', 'contains'), ('datestartswith', 'datestartswith'),
+        ('ge', '>='), ('le', '<='), ('lt', '<'), ('gt', '>'), ('ne', '!='), ('eq', '=')
+    ]
+
+    # Number of filtered and sorted views kept in memory
+    VIEW_CACHE_SIZE: int = 8
+
+    def __init__(self, df: pandas.DataFrame, value_col: str, fingerprint: str = None, fetched_at: float = None):
+        self.df: pandas.DataFrame = df.reset_index(drop=True)
+        self.value_col: str = value_col
+        self.fingerprint: str = fingerprint
+        # Time the data was fetched from the API, None for results which do not expire
+        self.fetched_at: float = fetched_at
+        # Incremented when derived data is added, so its memory is measured again
+        self.revision: int = 0
+        self._matrices: Dict[tuple, RegionYearMatrix] = {}
+        self._region_rows: Dict[str, Dict[str, numpy.ndarray]] = {}
+        self._orders: Dict['SortKey', numpy.ndarray] = {}
+        self._views: 'OrderedDict[tuple, numpy.ndarray]' = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._digest: str = None
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.df.columns)
+
+    @property
+    def digest(self) -> str:
+        """
+        Content hash of the data frame, unlike the fingerprint it changes when the data is fetched again
+        """
+        if self._digest is None:
+            content = hashlib.sha1(json.dumps([str(col) for col in self.df.columns]).encode('utf-8'))
+            content.update(pandas.util.hash_pandas_object(self.df, index=False).values.tobytes())
+            self._digest = content.hexdigest()
+        return self._digest
+
+    def memory_usage(self) -> int:
+        """
+        Bytes used by the data frame and the derived matrices, orders, views and indexes
+        """
+        with self._lock:
+            derived: list = [list(self._matrices.values()), list(self._orders.values()), list(self._views.values()),
+                             list(self._region_rows.values())]
+
+        return deep_size(self.df) + deep_size(derived)
+
+    def get_matrix(self, keys: List[str]) -> RegionYearMatrix:
+        """
+        Region x year matrix aligned to the keys, it is pivoted once for each set of keys
+        """
+        cache_key: tuple = tuple(keys)
+        if cache_key not in self._matrices:
+            self._matrices[cache_key] = RegionYearMatrix(self.df, value_col=self.value_col, keys=keys)
+            self.revision += 1
+
+        return self._matrices[cache_key]
+
+    def rollup(self, hierarchy: RegionHierarchy, fine: str, coarse: str, region_col: str = 'region') -> 'QueryResult':
+        """
+        Result summed to the regions of a coarser layer. It is not kept here, callers cache it like a fetched
+        result, so it is freed when it leaves their cache.
+        """
+        df: pandas.DataFrame = hierarchy.rollup(self.df, fine=fine, coarse=coarse, region_col=region_col)
+        fingerprint: str = '{}-{}'.format(self.fingerprint, coarse) if self.fingerprint else None
+        return QueryResult(df, value_col=self.value_col, fingerprint=fingerprint, fetched_at=self.fetched_at)
+
+    def region_rows(self, region_col: str = 'region') -> Dict[str, numpy.ndarray]:
+        """
+        Row positions of each region, the index is built once
+        """
+        with self._lock:
+            index: Dict[str, numpy.ndarray] = self._region_rows.get(region_col)
+        if index is None:
+            index = {str(key): positions for key, positions in
+                     self.df.groupby(self.df[region_col].astype(str).values).indices.items()}
+            with self._lock:
+                if region_col not in self._region_rows:
+                    self.revision += 1
+                index = self._region_rows.setdefault(region_col, index)
+
+        return index
+
+    def region_series(self, regions: List[str], region_col: str = 'region',
+                      year_col: str = 'year') -> pandas.DataFrame:
+        """
+        Yearly sum of the value over the selected regions, only the rows of these regions are read
+        """
+        index: Dict[str, numpy.ndarray] = self.region_rows(region_col=region_col)
+        positions: List[numpy.ndarray] = [index[str(key)] for key in regions if str(key) in index]
+        rows: numpy.ndarray = numpy.sort(numpy.concatenate(positions)) if len(positions) > 0 else \
+            numpy.array([], dtype=int)
+
+        df_rows: pandas.DataFrame = self.df.iloc[rows]
+        return df_rows.groupby(by=year_col, as_index=False)[self.value_col].sum()
+
+    def sort_order(self, sort_by: 'SortBy' = None) -> Optional[numpy.ndarray]:
+        """
+        Row positions in the requested order, None keeps the original order
+        """
+        sort_key: 'SortKey' = tuple((itm['column_id'], itm['direction']) for itm in (sort_by or [])
+                                    if itm['column_id'] in self.df)
+        if len(sort_key) == 0:
+            return None
+
+        if sort_key not in self._orders:
+            df_sorted: pandas.DataFrame = self.df.sort_values(by=[col for (col, _) in sort_key],
+                                                              ascending=[direction == 'asc' for (_, direction) in
+                                                                         sort_key],
+                                                              kind='mergesort', na_position='last')
+            self._orders[sort_key] = df_sorted.index.values
+            self.revision += 1
+
+        return self._orders[sort_key]
+
+    def filter_mask(self, filter_query: str = None) -> Optional[numpy.ndarray]:
+        """
+        Boolean mask of the rows matching the data table filter query, None if there is no filter
+        """
+        if not filter_query:
+            return None
+
+        mask: numpy.ndarray = numpy.ones(len(self.df), dtype=bool)
+        for part in filter_query.split(' && '):
+            col, operator, value = self._split_filter_part(part)
+            if col not in self.df:
+                continue
+
+            column: pandas.Series = self.df[col]
+            if operator == 'contains':
+                part_mask = column.astype(str).str.contains(str(value), regex=False).values
+            elif operator == 'datestartswith':
+                part_mask = column.astype(str).str.startswith(str(value)).values
+            else:
+                if column.dtype.kind in 'fi':
+                    value = pandas.to_numeric(value, errors='coerce')
+                else:
+                    column = column.astype(str)
+                    value = str(value)
+
+                part_mask = {
+                    '>=': column >= value, '<=': column <= value, '<': column < value,
+                    '>': column > value, '!=': column != value, '=': column == value
+                }[operator].values
+
+            mask &= part_mask
+
+        return mask
+
+    def view(self, sort_by: 'SortBy' = None, filter_query: str = None) -> Optional[numpy.ndarray]:
+        """
+        Row positions of the filtered and sorted result, None if all rows are in original order
+        """
+        view_key: tuple = (tuple((itm['column_id'], itm['direction']) for itm in (sort_by or [])), filter_query or '')
+        with self._lock:
+            if view_key in self._views:
+                self._views.move_to_end(view_key)
+                return self._views[view_key]
+
+        order: numpy.ndarray = self.sort_order(sort_by)
+        mask: numpy.ndarray = self.filter_mask(filter_query)
+
+        if mask is None:
+            positions = order
+        elif order is None:
+            positions = numpy.flatnonzero(mask)
+        else:
+            # Global sort order is reused, only the rows outside of the filter are dropped
+            positions = order[mask[order]]
+
+        with self._lock:
+            self._views[view_key] = positions
+            self.revision += 1
+            while len(self._views) > self.VIEW_CACHE_SIZE:
+                self._views.popitem(last=False)
+
+        return positions
+
+    def row_count(self, filter_query: str = None) -> int:
+        """
+        Number of rows matching the filter
+        """
+        positions: numpy.ndarray = self.view(filter_query=filter_query)
+        return len(self.df) if positions is None else len(positions)
+
+    def page(self, page_current: int, page_size: int, sort_by: 'SortBy' = None,
+             filter_query: str = None) -> List[Dict[str, Any]]:
+        """
+        Records of the requested page
+        """
+        start: int = page_current * page_size
+        positions: numpy.ndarray = self.view(sort_by=sort_by, filter_query=filter_query)
+
+        if positions is None:
+            df_page: pandas.DataFrame = self.df.iloc[start:start + page_size]
+        else:
+            df_page = self.df.iloc[positions[start:start + page_size]]
+
+        return df_page.to_dict('records')
+
+    @classmethod
+    def _split_filter_part(cls, filter_part: str) -> Tuple[str, str, Any]:
+        """
+        Split single filter expression like {year} ge 2010 into column, operator and value
+        """
+        for operator_type, operator in cls.FILTER_OPERATORS:
+            for token in (' {} '.format(operator_type), ' {} '.format(operator)):
+                if token in filter_part:
+                    name_part, value_part = filter_part.split(token, 1)
+                    name: str = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                    value_part = value_part.strip()
+                    if len(value_part) > 1 and value_part[0] == value_part[-1] and value_part[0] in ('"', "'", '`'):
+                        value: Any = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+                    else:
+                        value = value_part
+
+                    return name, operator, value
+
+        return '', '', None
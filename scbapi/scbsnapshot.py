@@ -0,0 +1,222 @@
+import datetime
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, TYPE_CHECKING
+
+import pandas
+from requests.adapters import HTTPAdapter
+
+from scbapi.scbexport import ResultExporter
+
+if TYPE_CHECKING:
+    from scbapi.scbcontroller import DataController, Query
+
+Manifest = Dict[str, Any]
+
+# Name of the manifest file in the snapshot folder, it is written last
+MANIFEST_NAME: str = 'manifest.json'
+
+# Partition of results without a year column
+ALL_YEARS: str = '__all__'
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing a number of calls in a period, shared by all threads
+    """
+
+    def __init__(self, calls: int, period: float):
+        self._calls: int = calls
+        self._period: float = period
+        self._tokens: float = calls
+        self._updated: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a call is allowed
+        """
+        while True:
+            with self._lock:
+                now: float = time.monotonic()
+                self._tokens = min(self._calls, self._tokens + (now - self._updated) * self._calls / self._period)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait: float = (1 - self._tokens) * self._period / self._calls
+            time.sleep(wait)
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTP adapter waiting for the rate limiter before every request
+    """
+
+    def __init__(self, limiter: RateLimiter, **kwargs):
+        super().__init__(**kwargs)
+        self._limiter: RateLimiter = limiter
+
+    def send(self, request, **kwargs):
+        self._limiter.acquire()
+        return super().send(request, **kwargs)
+
+
+def file_checksum(path: pathlib.Path) -> str:
+    """
+    SHA-256 of the file content
+    """
+    digest = hashlib.sha256()
+    with path.open('rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SnapshotBuilder(object):
+    """
+    Fetches the results of all default queries and writes them to a Parquet dataset partitioned by
+    query key and year. The manifest records the query definitions, metadata versions and file checksums.
+    Every build is written to a new version folder, the snapshot folder is a link switched to it at once.
+    """
+
+    def __init__(self, controller: 'DataController', folder: str, workers: int = 4):
+        self._controller: 'DataController' = controller
+        self._folder: pathlib.Path = pathlib.Path(folder)
+        self._workers: int = workers
+        self._exporter: ResultExporter = ResultExporter(folder=folder)
+
+    def build(self, query_keys: List[str] = None) -> 'Manifest':
+        """
+        Build snapshot of the selected queries, by default all queries of the query collection
+        """
+        queries: Dict[str, Dict[str, Any]] = self._controller.queries
+        if query_keys is None:
+            query_keys = list(queries.keys())
+
+        # Queries are validated one by one, data is fetched in parallel
+        resolved = [(key, self._controller.get_query(query_key=key, query_dict=queries)) for key in query_keys]
+
+        # Data is written to a new version folder which replaces the previous snapshot when complete
+        version_folder: pathlib.Path = self._folder.with_name('{}.v{}'.format(self._folder.name, uuid.uuid4().hex))
+
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            entries = list(executor.map(
+                lambda itm: self._write_query(version_folder, itm[0], queries[itm[0]], itm[1]), resolved))
+
+        manifest: 'Manifest' = {
+            'created': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'queries': {key: entry for (key, _), entry in zip(resolved, entries)}
+        }
+        (version_folder / MANIFEST_NAME).write_text(json.dumps(manifest, ensure_ascii=False, indent=2),
+                                                    encoding='utf-8')
+
+        self._activate(version_folder)
+        return manifest
+
+    def _activate(self, version_folder: pathlib.Path):
+        """
+        Switch the snapshot folder to the version folder. The link is replaced atomically, so readers always
+        find a complete snapshot. The previous version is kept for sources which still read from it.
+        """
+        previous: str = os.path.basename(os.readlink(str(self._folder))) if self._folder.is_symlink() else None
+
+        link: pathlib.Path = self._folder.with_name(self._folder.name + '.link')
+        if link.is_symlink():
+            link.unlink()
+        os.symlink(version_folder.name, str(link))
+
+        if self._folder.is_dir() and not self._folder.is_symlink():
+            # Snapshot folder of an earlier build, it is kept as the previous version
+            previous = self._folder.name + '.v0'
+            shutil.rmtree(str(self._folder.with_name(previous)), ignore_errors=True)
+            os.replace(str(self._folder), str(self._folder.with_name(previous)))
+        os.replace(str(link), str(self._folder))
+
+        for itm in self._folder.parent.glob(self._folder.name + '.v*'):
+            if itm.name not in (version_folder.name, previous):
+                shutil.rmtree(str(itm), ignore_errors=True)
+
+    def _write_query(self, folder: pathlib.Path, query_key: str, query_itm: Dict[str, Any],
+                     query: 'Query') -> Dict[str, Any]:
+        """
+        Fetch query result and write one file for each year
+        """
+        df: pandas.DataFrame = query.get_dataframe()
+
+        files: List[Dict[str, Any]] = []
+        groups = df.groupby('year', sort=True) if 'year' in df else [(ALL_YEARS, df)]
+        for year, df_year in groups:
+            path: pathlib.Path = folder / 'query_key={}'.format(query_key) / 'year={}'.format(year) / 'part-0.parquet'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._exporter.write_parquet(df_year.reset_index(drop=True), path)
+            files.append({'path': path.relative_to(folder).as_posix(), 'year': str(year), 'rows': len(df_year),
+                          'sha256': file_checksum(path)})
+
+        info_json: str = query.info.json(sort_keys=True) if hasattr(query, 'info') else ''
+        return {
+            'definition': query_itm,
+            'definition_hash': self._controller.hash_definition(query_itm),
+            'metadata_version': hashlib.sha1(info_json.encode('utf-8')).hexdigest(),
+            'value_col': query.value_col,
+            'columns': list(df.columns),
+            'rows': len(df),
+            'files': files
+        }
+
+
+class SnapshotSource(object):
+    """
+    Read-only access to a snapshot built by SnapshotBuilder. The version the snapshot folder links to is
+    resolved once, so a new build does not change the files under a running source.
+    """
+
+    def __init__(self, folder: str, verify: bool = False):
+        self._folder: pathlib.Path = pathlib.Path(folder).resolve()
+        self._verify: bool = verify
+        self.manifest: 'Manifest' = json.loads((self._folder / MANIFEST_NAME).read_text(encoding='utf-8'))
+
+    def __contains__(self, query_key: object) -> bool:
+        return query_key in self.manifest['queries']
+
+    @property
+    def definitions(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Query definitions included in the snapshot
+        """
+        return {key: entry['definition'] for key, entry in self.manifest['queries'].items()}
+
+    def matches(self, query_key: str, definition_hash: str) -> bool:
+        """
+        Check if the snapshot contains the query with the given definition
+        """
+        return query_key in self and self.manifest['queries'][query_key]['definition_hash'] == definition_hash
+
+    def value_col(self, query_key: str) -> str:
+        return self.manifest['queries'][query_key]['value_col']
+
+    def get_dataframe(self, query_key: str) -> pandas.DataFrame:
+        """
+        Read result of the query from the snapshot files
+        """
+        import pyarrow.parquet
+
+        entry: Dict[str, Any] = self.manifest['queries'][query_key]
+        frames: List[pandas.DataFrame] = []
+        for itm in entry['files']:
+            path: pathlib.Path = self._folder / itm['path']
+            if self._verify and file_checksum(path) != itm['sha256']:
+                raise ValueError('checksum mismatch in {}'.format(itm['path']))
+            frames.append(pyarrow.parquet.read_table(str(path)).to_pandas())
+
+        if len(frames) == 0:
+            return pandas.DataFrame(columns=entry['columns'])
+
+        return pandas.concat(frames, ignore_index=True)[entry['columns']]
@@ -0,0 +1,57 @@
+import re
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple
+
+# Line of the python -X importtime output: self time, cumulative time and indented module name
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    level: int
+
+
+def measure_imports(statement: str) -> List[ImportTime]:
+    """
+    Run the import statement in a fresh interpreter and collect the time spent importing each module
+    """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'import failed')
+
+    times: List[ImportTime] = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is not None:
+            self_us, cumulative_us, indent, module = match.groups()
+            times.append(ImportTime(module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2))
+
+    return times
+
+
+def import_report(statement: str = 'import scbapi', top: int = 15) -> str:
+    """
+    Summary of the import time of the statement, grouped by top level package
+    """
+    times: List[ImportTime] = measure_imports(statement)
+
+    packages: Dict[str, int] = {}
+    for itm in times:
+        package: str = itm.module.split('.')[0]
+        packages[package] = packages.get(package, 0) + itm.self_us
+
+    total: int = sum(itm.self_us for itm in times)
+    lines: List[str] = ['{}: {:.1f} ms, {} modules'.format(statement, total / 1000, len(times)), '',
+                        '{:>10}  {}'.format('self ms', 'package')]
+    for package, self_us in sorted(packages.items(), key=lambda itm: -itm[1])[:top]:
+        lines.append('{:>10.1f}  {}'.format(self_us / 1000, package))
+
+    lines += ['', '{:>10}  {}'.format('cumul. ms', 'module')]
+    for itm in sorted(times, key=lambda itm: -itm.cumulative_us)[:top]:
+        lines.append('{:>10.1f}  {}{}'.format(itm.cumulative_us / 1000, '  ' * itm.level, itm.module))
+
+    return '\n'.join(lines)
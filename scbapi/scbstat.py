@@ -1,12 +1,117 @@
-from typing import List, Dict, Any
-import pandas
-import requests
+from typing import List, Dict, Any, Callable, FrozenSet, TYPE_CHECKING
+from contextlib import closing
+from functools import reduce
 import json
+import marshal
+import sys
 from enum import Enum
 from pydantic import BaseModel, validator, UrlStr
 from scbapi.scbconfig import Config
+from scbapi.scbflight import SingleFlight
+from scbapi.scbbreaker import CircuitBreaker
+
+if TYPE_CHECKING:
+    import pandas
+    import requests
+    from scbapi.scbparse import Columns, ParseResult
 
-session = requests.Session()
+_session: 'requests.Session' = None
+_crawl_session: 'requests.Session' = None
+
+# Version of the binary metadata format
+METADATA_FORMAT: int = 1
+
+# Identical API calls in flight at the same time are made once
+metadata_flight: SingleFlight = SingleFlight('metadata')
+data_flight: SingleFlight = SingleFlight('data')
+
+# Failing API is not called until it had time to recover
+api_breaker: CircuitBreaker = CircuitBreaker(failure_threshold=int(Config.api('BREAKER_FAILURES')),
+                                             reset_timeout=float(Config.api('BREAKER_RESET')))
+
+# Catalogue crawls have their own circuit, failures of a long crawl don't reject dashboard calls
+crawl_breaker: CircuitBreaker = CircuitBreaker(failure_threshold=int(Config.api('BREAKER_FAILURES')),
+                                               reset_timeout=float(Config.api('BREAKER_RESET')))
+
+
+def get_session() -> 'requests.Session':
+    """
+    HTTP session shared by all queries, requests is imported on first use
+    """
+    global _session
+    if _session is None:
+        import requests
+        _session = requests.Session()
+    return _session
+
+
+def get_crawl_session() -> 'requests.Session':
+    """
+    HTTP session of catalogue crawls, calls wait for the crawl rate limit so the dashboard keeps its share
+    of the API call limit
+    """
+    global _crawl_session
+    if _crawl_session is None:
+        import requests
+        from scbapi.scbsnapshot import RateLimiter, RateLimitedAdapter
+
+        limiter = RateLimiter(calls=int(Config.catalogue('RATE_CALLS')),
+                              period=float(Config.catalogue('RATE_PERIOD')))
+        _crawl_session = requests.Session()
+        _crawl_session.mount(Config.api('URL'), RateLimitedAdapter(limiter))
+    return _crawl_session
+
+
+def get_timeout() -> tuple:
+    """
+    Connect and read timeout of API calls
+    """
+    return float(Config.api('CONNECT_TIMEOUT')), float(Config.api('READ_TIMEOUT'))
+
+
+def call_api(call: Callable[[], Any], breaker: CircuitBreaker = api_breaker) -> Any:
+    """
+    Call the API through the circuit breaker. Connection errors, timeouts and server errors are retried.
+    """
+    import requests
+
+    return breaker.call_with_retry(call, failures=(requests.exceptions.RequestException,),
+                                       attempts=int(Config.api('RETRIES')) + 1,
+                                       backoff=float(Config.api('RETRY_BACKOFF')))
+
+
+def check_server_error(response: 'requests.Response'):
+    """
+    Raise for server errors and rate limiting, client errors are handled by the caller
+    """
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+
+
+def get_metadata(url: str) -> 'requests.Response':
+    """
+    Get metadata url, concurrent callers of the same url share one response
+    """
+    def call() -> 'requests.Response':
+        response = get_session().get(url, timeout=get_timeout())
+        check_server_error(response)
+        # Read the body once, before the response is shared
+        _ = response.content
+        return response
+
+    return metadata_flight.do(url, lambda: call_api(call))
+
+
+def get_crawl_metadata(url: str) -> 'requests.Response':
+    """
+    Get metadata url for a catalogue crawl, through the rate limited session and the crawl circuit
+    """
+    def call() -> 'requests.Response':
+        response = get_crawl_session().get(url, timeout=get_timeout())
+        check_server_error(response)
+        return response
+
+    return call_api(call, breaker=crawl_breaker)
 
 
 class QueryTypesEnum(Enum):
@@ -14,6 +119,12 @@ class QueryTypesEnum(Enum):
     CALCULATED = "CALCULATED"
 
 
+class ResponseFormatEnum(Enum):
+    JSON = "json"
+    CSV = "csv"
+    JSON_STAT2 = "json-stat2"
+
+
 class ResultColumn(BaseModel):
     # TODO Support additional variables
     code: str
@@ -33,7 +144,7 @@ class FilterItem(BaseModel):
 
 
 class QueryVariable(BaseModel):
-    # TODO Handle elimination and time correctly
+    # TODO Handle time correctly
     code: str
     text: str
     values: List[str]
@@ -41,11 +152,105 @@ class QueryVariable(BaseModel):
     elimination: bool = None
     time: bool = None
 
+    # Value sets for membership checks, built on first use
+    __slots__ = ('_value_set', '_text_set')
+
+    @classmethod
+    def trusted(cls, **data: Any) -> 'QueryVariable':
+        """
+        Create variable from metadata which was already validated, without validation. Strings are interned,
+        so codes and texts repeated in many tables are stored once, and value lists are stored as tuples.
+        """
+        values: dict = {'code': sys.intern(data['code']), 'text': sys.intern(data['text']),
+                        'values': tuple(map(sys.intern, data['values'])),
+                        'valueTexts': tuple(map(sys.intern, data['valueTexts'])),
+                        'elimination': data.get('elimination'), 'time': data.get('time')}
+        return cls.construct(values, set(data.keys()))
+
+    @property
+    def value_set(self) -> FrozenSet[str]:
+        value_set: FrozenSet[str] = getattr(self, '_value_set', None)
+        if value_set is None:
+            value_set = frozenset(self.values)
+            object.__setattr__(self, '_value_set', value_set)
+        return value_set
+
+    @property
+    def text_set(self) -> FrozenSet[str]:
+        text_set: FrozenSet[str] = getattr(self, '_text_set', None)
+        if text_set is None:
+            text_set = frozenset(self.valueTexts)
+            object.__setattr__(self, '_text_set', text_set)
+        return text_set
+
+    def get_total_value(self) -> str:
+        """
+        Value of the aggregated total, e.g. the whole country for regions. None if the variable has no total.
+        """
+        total_codes: List[str] = [code.strip() for code in Config.api('TOTAL_CODES').split(',')]
+        for value in self.values:
+            if value in total_codes:
+                return value
+
 
 class QueryInfo(BaseModel):
     title: str
     variables: List[QueryVariable]
 
+    @classmethod
+    def trusted(cls, info: Any) -> 'QueryInfo':
+        """
+        Create metadata from a dictionary which was already validated, e.g. a stored query definition
+        """
+        if isinstance(info, QueryInfo):
+            return info
+
+        values: dict = {'title': info['title'],
+                        'variables': [QueryVariable.trusted(**var) for var in info['variables']]}
+        return cls.construct(values, set(info.keys()))
+
+    def to_bytes(self) -> bytes:
+        """
+        Binary form for cache storage. Interned strings are written once, the result can only be read
+        by the same Python version.
+        """
+        variables: tuple = tuple((var.__dict__, tuple(var.__fields_set__)) for var in self.variables)
+        return marshal.dumps((METADATA_FORMAT, tuple(sys.version_info[:2]), self.title, variables))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'QueryInfo':
+        """
+        Read metadata written by to_bytes
+        """
+        version, python, title, variables = marshal.loads(data)
+        if version != METADATA_FORMAT or python != tuple(sys.version_info[:2]):
+            raise ValueError('unsupported metadata format')
+
+        values: dict = {'title': title, 'variables': [
+            QueryVariable.trusted(**{key: value for key, value in var.items() if key in fields_set})
+            for var, fields_set in variables]}
+        return cls.construct(values, {'title', 'variables'})
+
+    def dict(self, **kwargs: Any) -> Dict[str, Any]:
+        """
+        Metadata as dictionary. Without options the value lists are copied as a whole, instead of
+        converting them element by element.
+        """
+        if any(kwargs.values()):
+            return super().dict(**kwargs)
+
+        return {'title': self.title,
+                'variables': [dict(var.__dict__, values=list(var.values), valueTexts=list(var.valueTexts))
+                              for var in self.variables]}
+
+    def get_variable(self, code: str = None, text: str = None) -> QueryVariable:
+        """
+        Get variable by code or variable text
+        """
+        for var in self.variables:
+            if var.code == code or var.text == text:
+                return var
+
     def get_codes(self, texts: List[str] = None) -> List[str]:
         """
         Converts variable text values to codes
@@ -64,11 +269,12 @@ class QueryInfo(BaseModel):
         """
         val_list: List[str] = []
         if text is not None or code is not None:
+            selected: FrozenSet[str] = frozenset(value_texts) if value_texts is not None else None
             for var in self.variables:
                 if var.code == code or var.text == text:
                     # Get list of indexes with matching variable texts
                     val_ind: List[int] = [ind for ind, text in enumerate(var.valueTexts) if
-                                          (value_texts is None) or (text in value_texts)]
+                                          (selected is None) or (text in selected)]
                     # Get list of values matching indexes
                     val_list = [var.values[i] for i in val_ind]
 
@@ -80,11 +286,12 @@ class QueryInfo(BaseModel):
         """
         val_list: List[str] = []
         if text is not None or code is not None:
+            selected: FrozenSet[str] = frozenset(values) if values is not None else None
             for var in self.variables:
                 if var.code == code or var.text == text:
                     # Get list of indexes with matching variables
                     val_ind: List[int] = [ind for ind, val in enumerate(var.values) if
-                                          (values is None) or (val in values)]
+                                          (selected is None) or (val in selected)]
                     # Get list of values matching indexes
                     val_list = [var.valueTexts[i] for i in val_ind]
 
@@ -130,7 +337,7 @@ class QueryInfo(BaseModel):
         if text is not None or code is not None:
             for var in self.variables:
                 if var.code == code or var.text == text:
-                    values_missing = [val for val in values if val not in var.values]
+                    values_missing = [val for val in values if val not in var.value_set]
 
         return values_missing
 
@@ -143,7 +350,7 @@ class QueryInfo(BaseModel):
             for var in self.variables:
                 if var.code == code or var.text == text:
                     value_texts_missing = \
-                        [val_text for val_text in value_texts if val_text not in var.valueTexts]
+                        [val_text for val_text in value_texts if val_text not in var.text_set]
 
         return value_texts_missing
 
@@ -163,7 +370,7 @@ class BaseQuery(BaseModel):
             raise ValueError('cannot be empty')
         return v
 
-    def get_dataframe(self) -> pandas.DataFrame:
+    def get_dataframe(self) -> 'pandas.DataFrame':
         pass
 
     @property
@@ -197,17 +404,24 @@ class Query(BaseQuery):
     info: QueryInfo = None
     result_cols: List[ResultColumn] = None
     region_keys: List = None
+    response_format: str = ResponseFormatEnum.JSON.value
 
     @validator('path')
     def check_path(cls, v, values):
-        response = session.get(values['url'] + v)
+        response = get_metadata(values['url'] + v)
         if response.status_code != 200:
             raise ValueError('cannot reach url, invalid path')
         return v
 
+    @validator('response_format')
+    def check_response_format(cls, v):
+        if v not in [fmt.value for fmt in ResponseFormatEnum]:
+            raise ValueError('unsupported response format')
+        return v
+
     def _set_metadata(self):
         if self.info is None:
-            response = session.get(self.url + self.path)
+            response = get_metadata(self.url + self.path)
             result = json.loads(response.content.decode('utf-8-sig'))
             self.info = QueryInfo(**result)
 
@@ -238,7 +452,8 @@ class Query(BaseQuery):
             'name': self.name,
             'path': self.path,
             'query': [item.dict() for item in self.query],
-            'info': self.info.dict()
+            'info': self.info.dict(),
+            'response_format': self.response_format
         }
         return query_dict
 
@@ -246,45 +461,79 @@ class Query(BaseQuery):
     def value_col(self) -> str:
         return [col.text for col in self.result_cols if col.type == 'c'][0]
 
-    def get_dataframe(self) -> pandas.DataFrame:
+    @property
+    def request_body(self) -> dict:
         """
-        Get data from API and create data frame
+        Body of the API call for the current filter
+        """
+        return self.get_request_body(self.query)
+
+    @property
+    def row_count(self) -> int:
+        """
+        Expected number of rows in the result, used to preallocate arrays while parsing
+        """
+        return Query.count_cells(self.query)
+
+    @staticmethod
+    def count_cells(selection: List[FilterItem]) -> int:
+        """
+        Number of cells selected by the filter items
+        """
+        return reduce(lambda a, b: a * b, [len(itm.selection.values) for itm in selection], 1)
+
+    def get_request_body(self, selection: List[FilterItem]) -> dict:
+        """
+        Body of the API call for the filter items
+        """
+        return {"query": [a.dict() for a in selection], "response": {"format": self.response_format}}
+
+    def _selected_variables(self, selection: List[FilterItem]) -> List[Dict[str, Any]]:
+        """
+        Metadata of the variables in the filter
+        """
+        codes: List[str] = [itm.code for itm in selection]
+        return [var.dict() for var in self.info.variables if var.code in codes]
+
+    def fetch(self, selection: List[FilterItem] = None) -> 'ParseResult':
+        """
+        Post query for the filter items, by default the filter of the query. Concurrent callers posting the same
+        body to the same table share the call and the parsed result, which must not be modified.
+        """
+        if selection is None:
+            selection = self.query
+            request_body: dict = self.request_body
+        else:
+            request_body = self.get_request_body(selection)
+
+        flight_key: tuple = (self.url + self.path, json.dumps(request_body, sort_keys=True))
+        return data_flight.do(flight_key, lambda: call_api(lambda: self._post(selection, request_body)))
+
+    def _post(self, selection: List[FilterItem], request_body: dict) -> 'ParseResult':
+        """
+        Post request body, the response body is parsed while it is streamed
         """
-        # Construct query for API call
-        selection = [a.dict() for a in self.query]
-        query: Dict = {"query": selection, "response": {"format": "json"}}
+        from scbapi.scbparse import CHUNK_SIZE, parse_csv, parse_json, parse_json_stat2
 
         # Post query
-        response = session.post(self.url + self.path, json=query)
-        response_json = json.loads(response.content.decode('utf-8-sig'))
-        scb_data: Dict[str, List[Any]] = response_json['data']
-        scb_columns = response_json['columns']
-
-        # Create dictionary for data frame
-        df_dict: Dict[str, List[Any]] = {}
-
-        # Prepare columns and initialize lists in dictionary
-        self.result_cols = []
-        for i in range(len(scb_columns)):
-            res_column = ResultColumn(**scb_columns[i])
-            self.result_cols.append(res_column)
-            df_dict[res_column.text] = []
-
-        # Get data into dictionary
-        for i in range(len(scb_data)):
-            for j in range(len(self.result_cols)):
-                col_name: str = self.result_cols[j].text
-                col_type: str = self.result_cols[j].type
-
-                if col_type != "c":
-                    df_dict[col_name].append(scb_data[i]['key'][j])
-                else:
-                    try:
-                        df_dict[col_name].append(float(scb_data[i]['values'][0]))
-                    except ValueError:
-                        df_dict[col_name].append(float('Nan'))
+        response = get_session().post(self.url + self.path, json=request_body, stream=True, timeout=get_timeout())
+
+        with closing(response):
+            check_server_error(response)
+            if self.response_format == ResponseFormatEnum.CSV.value:
+                response.raw.decode_content = True
+                return parse_csv(response.raw, variables=self._selected_variables(selection))
+            elif self.response_format == ResponseFormatEnum.JSON_STAT2.value:
+                return parse_json_stat2(response.iter_content(CHUNK_SIZE), rows=Query.count_cells(selection))
+            else:
+                return parse_json(response.iter_content(CHUNK_SIZE), rows=Query.count_cells(selection))
 
-        df: pandas.DataFrame = pandas.DataFrame.from_dict(df_dict)
+    def load_result(self, scb_columns: 'Columns', df: 'pandas.DataFrame') -> 'pandas.DataFrame':
+        """
+        Set result columns from the parsed response and prepare data frame
+        """
+        # Prepare columns
+        self.result_cols = [ResultColumn(**col) for col in scb_columns]
 
         # Drop record with missing values
         values: List = [col.text for col in self.result_cols if col.type == "c"]
@@ -292,9 +541,63 @@ class Query(BaseQuery):
 
         return df
 
+    def get_dataframe(self) -> 'pandas.DataFrame':
+        """
+        Get data from API and create data frame
+        """
+        scb_columns, df = self.fetch()
+        return self.load_result(scb_columns, df)
+
 
 class SimpleQuery(Query):
     simple_query: Dict[str, List[str]] = None
+    aggregate: List[str] = None
+    # Values are counts or other sums, so results of finer regions can be summed to coarser ones
+    additive: bool = False
+
+    # Transformed filter and request body are memoized until one of their inputs is reassigned
+    __slots__ = ('_filter_cached', '_request_body')
+    _TRANSFORM_INPUTS = ('simple_query', 'info', 'region_keys', 'response_format', 'aggregate')
+
+    @classmethod
+    def trusted(cls, **data: Any) -> 'SimpleQuery':
+        """
+        Create query from a stored definition which was validated when it was saved, e.g. in the registry or
+        a snapshot. The path is not checked against the API. Definitions without metadata are validated.
+        """
+        if data.get('info') is None:
+            return cls(**data)
+
+        values: dict = {name: field.default for name, field in cls.__fields__.items()}
+        values.update(data)
+        values['info'] = QueryInfo.trusted(data['info'])
+        return cls.construct(values, set(data.keys()))
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in self._TRANSFORM_INPUTS:
+            self._invalidate_query()
+
+    def copy(self, **kwargs: Any) -> 'SimpleQuery':
+        """
+        Duplicate query, keeping the memoized filter when the transform inputs are unchanged
+        """
+        query: 'SimpleQuery' = super().copy(**kwargs)
+
+        update: dict = kwargs.get('update') or {}
+        unchanged: bool = all(update[name] == getattr(self, name) for name in self._TRANSFORM_INPUTS if name in update)
+        if unchanged and kwargs.get('include') is None and kwargs.get('exclude') is None and not kwargs.get('deep'):
+            object.__setattr__(query, '_filter_cached', getattr(self, '_filter_cached', False))
+            object.__setattr__(query, '_request_body', getattr(self, '_request_body', None))
+
+        return query
+
+    def _invalidate_query(self):
+        """
+        Drop memoized filter and request body
+        """
+        object.__setattr__(self, '_filter_cached', False)
+        object.__setattr__(self, '_request_body', None)
 
     def _prepare_simple_query(self):
         # TODO Implement query to simple query conversion
@@ -321,19 +624,36 @@ class SimpleQuery(Query):
             'name': self.name,
             'path': self.path,
             'simple_query': self.simple_query,
-            'info': self.info.dict()
+            'info': self.info.dict(),
+            'response_format': self.response_format
         }
+        # Only marked queries store the flag, so definitions of other queries keep their digest
+        if self.additive:
+            query_dict['additive'] = True
 
         return query_dict
 
     @property
     def query(self) -> List[FilterItem]:
-        self._transform_query()
+        if not getattr(self, '_filter_cached', False):
+            self._transform_query()
+            object.__setattr__(self, '_filter_cached', True)
         return self.filter
 
+    @property
+    def request_body(self) -> dict:
+        request_body: dict = getattr(self, '_request_body', None)
+        if request_body is None:
+            request_body = super().request_body
+            object.__setattr__(self, '_request_body', request_body)
+        return request_body
+
     def _transform_query(self):
         """
-        Transform the simplified query into executable format
+        Transform the simplified query into executable format. The result is memoized by the query property,
+        reassign simple_query, info or region_keys instead of mutating them in place.
+        Variables in aggregate are summed by the API: they are eliminated if the metadata allows it,
+        otherwise only their total value is selected. Without either, the variable is queried as is.
         """
         self.filter = []
         for par, par_val in self.simple_query.items():
@@ -346,6 +666,13 @@ class SimpleQuery(Query):
             else:
                 values = self.info.get_values(value_texts=par_val, text=par)
 
+            if self.aggregate is not None and par in self.aggregate:
+                variable: QueryVariable = self.info.get_variable(text=par)
+                if variable.elimination:
+                    continue
+                if variable.get_total_value() is not None:
+                    values = [variable.get_total_value()]
+
             selection = FilterSelection(filter="item", values=values)
             code: List[str] = self.info.get_codes([par])
             filteritem: FilterItem = FilterItem(code=code[0], selection=selection)
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+import pathlib
+import threading
+from typing import Any, Dict, Optional, Set, Tuple
+
+# Object content, None if the object was not modified since the given ETag
+StoreResult = Tuple[str, Optional[bytes]]
+
+
+class LocalStore(object):
+    """
+    Object store backed by a local folder, a stand-in for S3 in tests and offline use. Keys are paths below
+    the folder, ETags are the MD5 of the content like for single part S3 uploads.
+    """
+
+    def __init__(self, folder: str):
+        self._folder: pathlib.Path = pathlib.Path(folder)
+        self.name: str = self._folder.resolve().as_uri()
+
+    def get(self, key: str, etag: str = None) -> 'StoreResult':
+        """
+        Get object content, or only the ETag if it matches the given one
+        """
+        data: bytes = self.path(key).read_bytes()
+        current: str = '"{}"'.format(hashlib.md5(data).hexdigest())
+        return current, None if current == etag else data
+
+    def path(self, key: str) -> pathlib.Path:
+        return self._folder / key
+
+    def read_text(self, key: str) -> str:
+        return self.path(key).read_text(encoding='utf-8-sig')
+
+
+class S3Store(object):
+    """
+    Objects of a S3 bucket, modified objects are detected with conditional requests
+    """
+
+    def __init__(self, bucket: str, s3: Any = None, region_name: str = None):
+        if s3 is None:
+            import boto3
+            from botocore.handlers import disable_signing
+
+            s3 = boto3.resource('s3', region_name=region_name)
+            s3.meta.client.meta.events.register('choose-signer.s3.*', disable_signing)
+
+        self._s3: Any = s3
+        self._bucket: str = bucket
+        self.name: str = 's3://{}'.format(bucket)
+
+    def get(self, key: str, etag: str = None) -> 'StoreResult':
+        """
+        Get object content, or only the ETag if it matches the given one
+        """
+        from botocore.exceptions import ClientError
+
+        kwargs: Dict[str, str] = {'IfNoneMatch': etag} if etag else {}
+        try:
+            response: Dict[str, Any] = self._s3.meta.client.get_object(Bucket=self._bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                return etag, None
+            raise
+
+        return response['ETag'], response['Body'].read()
+
+
+class CachedStore(object):
+    """
+    Content addressed disk cache in front of an object store. Objects are revalidated by ETag once per process,
+    and cached objects are used while the store can't be reached.
+    """
+
+    def __init__(self, store: Any, folder: str):
+        self._store: Any = store
+        self._folder: pathlib.Path = pathlib.Path(folder)
+        self._index_path: pathlib.Path = self._folder / 'index-{}.json'.format(
+            hashlib.sha1(store.name.encode('utf-8')).hexdigest()[:16])
+        self._lock: threading.Lock = threading.Lock()
+        self._validated: Set[str] = set()
+        self.offline: bool = False
+
+        try:
+            self._index: Dict[str, Dict[str, str]] = json.loads(self._index_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self._index = {}
+
+    @property
+    def name(self) -> str:
+        return self._store.name
+
+    def path(self, key: str) -> pathlib.Path:
+        """
+        Local copy of the object, it is downloaded if missing or modified
+        """
+        with self._lock:
+            entry: Dict[str, str] = self._index.get(key)
+        suffix: str = pathlib.PurePosixPath(key).suffix
+        cached: pathlib.Path = self._object_path(entry['sha256'], suffix) if entry is not None else None
+        if cached is not None and not cached.exists():
+            cached = None
+
+        if cached is not None and key in self._validated:
+            return cached
+
+        try:
+            etag, data = self._store.get(key, etag=entry['etag'] if cached is not None else None)
+        except Exception:
+            if cached is None:
+                raise
+            # Store can't be reached, the cached copy may be stale
+            self.offline = True
+            return cached
+
+        if data is not None:
+            digest: str = hashlib.sha256(data).hexdigest()
+            cached = self._object_path(digest, suffix)
+            if not cached.exists():
+                cached.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path: pathlib.Path = cached.with_name('{}.{}.tmp'.format(cached.name, threading.get_ident()))
+                tmp_path.write_bytes(data)
+                os.replace(str(tmp_path), str(cached))
+
+            with self._lock:
+                self._index[key] = {'etag': etag, 'sha256': digest}
+                self._save_index()
+
+        with self._lock:
+            self._validated.add(key)
+
+        return cached
+
+    def get(self, key: str, etag: str = None) -> 'StoreResult':
+        data: bytes = self.path(key).read_bytes()
+        with self._lock:
+            current: str = self._index[key]['etag']
+        return current, None if current == etag else data
+
+    def read_text(self, key: str) -> str:
+        return self.path(key).read_text(encoding='utf-8-sig')
+
+    def _object_path(self, digest: str, suffix: str = '') -> pathlib.Path:
+        # Readers like GDAL detect the format by the file extension, so it is kept
+        return self._folder / 'objects' / digest[:2] / (digest + suffix)
+
+    def _save_index(self):
+        self._folder.mkdir(parents=True, exist_ok=True)
+        tmp_path: pathlib.Path = self._index_path.with_name(self._index_path.name + '.tmp')
+        tmp_path.write_text(json.dumps(self._index, indent=2), encoding='utf-8')
+        os.replace(str(tmp_path), str(self._index_path))
@@ -1,5 +1,5 @@
 from typing import List, Dict
-import mapclassify
+import numpy
 import pandas
 
 Colorscale = List[List[str]]
@@ -31,6 +31,9 @@ class MappingTools(object):
 
         norm_vals: List = ((col_to_norm - min(col_to_norm)) / (max(col_to_norm) - min(col_to_norm))).astype(float)
 
+        # Classifiers are loaded on first use, mapclassify is slow to import
+        import mapclassify
+
         if classifier is None:
             bins = mapclassify.Fisher_Jenks(norm_vals, k=len(colors) - 1).bins.tolist()
         elif MappingTools.CLASSIFIERS[classifier] == MappingTools.CLASSIFIERS["FISHER_JENKS"]:
@@ -48,3 +51,26 @@ class MappingTools(object):
 
         colorscale: 'Colorscale' = [list(a) for a in zip(bins, colors)]
         return colorscale
+
+
+    @staticmethod
+    def get_class_colors(df: pandas.DataFrame, column: str, colorscale: 'Colorscale', vmin: float = None,
+                         vmax: float = None) -> List[str]:
+        """
+        Returns the color of the class for each row, using the bins of the color scale. Values are normalized
+        with the minimum and maximum of the column unless the range is provided.
+        """
+        if column not in df or len(colorscale) == 0:
+            return []
+
+        col_to_norm: pandas.Series = df[column]
+        vmin = col_to_norm.min() if vmin is None else vmin
+        vmax = col_to_norm.max() if vmax is None else vmax
+        norm_vals: pandas.Series = (col_to_norm - vmin) / (vmax - vmin)
+
+        # Class is the first bin which is not lower than the value
+        bins: List[float] = [float(itm[0]) for itm in colorscale]
+        colors: List[str] = [itm[1] for itm in colorscale]
+        classes = numpy.searchsorted(bins, norm_vals.fillna(0).values, side='left').clip(0, len(colors) - 1)
+
+        return [colors[i] for i in classes]
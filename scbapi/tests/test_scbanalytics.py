@@ -0,0 +1,87 @@
+import numpy
+import pandas
+import pytest
+from scbapi.scbanalytics import AnalyticsCube
+from scbapi.scbresult import QueryResult
+
+KEYS = ['0114', '0115', '0180', '1280']
+
+
+@pytest.fixture
+def cube():
+    population = QueryResult(pandas.DataFrame({'region': ['0114', '0115', '0180', '1280'] * 2,
+                                               'year': ['2017'] * 4 + ['2018'] * 4,
+                                               'Population': [10.0, 20.0, 30.0, 40.0, 11.0, 22.0, 30.0, 36.0]}),
+                             value_col='Population')
+    income = QueryResult(pandas.DataFrame({'region': ['0114', '0115', '0180', '0114', '0115', '0180', '1280'],
+                                           'year': ['2016'] * 3 + ['2018'] * 4,
+                                           'Income': [1.0, 2.0, 3.0, 8.0, 6.0, 4.0, 2.0]}),
+                         value_col='Income')
+    return AnalyticsCube([population.get_matrix(KEYS), income.get_matrix(KEYS)], statistics=['POP', 'INC'])
+
+
+def test_alignment(cube):
+    assert cube.years == ['2016', '2017', '2018']
+    assert cube.values.shape == (4, 3, 2)
+    assert numpy.isnan(cube.values[:, 0, 0]).all()
+    assert numpy.isnan(cube.values[3, 0, 1])
+    assert cube.values[:, 2, 1].tolist() == [8.0, 6.0, 4.0, 2.0]
+
+
+def test_zscores(cube):
+    values = cube.values[:, 1, 0]
+    numpy.testing.assert_allclose(cube.zscores[:, 1, 0], (values - values.mean()) / values.std())
+    assert numpy.isnan(cube.zscores[:, 0, 0]).all()
+
+
+@pytest.mark.parametrize(
+    'year,stat,exp',
+    [
+        (1, 0, [4, 3, 2, 1]),
+        (0, 1, [3, 2, 1, None]),
+        (2, 1, [1, 2, 3, 4]),
+    ],
+)
+def test_ranks(cube, year, stat, exp):
+    ranks = cube.ranks[:, year, stat]
+    assert [None if numpy.isnan(rank) else int(rank) for rank in ranks] == exp
+
+
+def test_deltas(cube):
+    assert cube.deltas[:, 2, 0].tolist() == [1.0, 2.0, 0.0, -4.0]
+    numpy.testing.assert_allclose(cube.growth[:, 2, 0], [0.1, 0.1, 0.0, -0.1])
+    assert numpy.isnan(cube.deltas[:, 0, :]).all()
+    # Income of 2017 is missing, there is no change to 2018
+    assert numpy.isnan(cube.deltas[:, 2, 1]).all()
+
+
+def test_correlation(cube):
+    exp = numpy.corrcoef(cube.values[:, 2, 0], cube.values[:, 2, 1])[0, 1]
+    numpy.testing.assert_allclose(cube.correlation_frame('2018').loc['POP', 'INC'], exp)
+    numpy.testing.assert_allclose(numpy.diag(cube.correlation_frame('2018').values), [1.0, 1.0])
+    assert numpy.isnan(cube.correlation_frame('2017').loc['POP', 'INC'])
+
+    # Pooled over the years where both statistics have values
+    numpy.testing.assert_allclose(cube.correlation_frame().loc['INC', 'POP'], exp)
+
+
+def test_year_frame(cube):
+    df = cube.year_frame('2018')
+    assert df['region'].tolist() == KEYS
+    assert df['INC_rank'].tolist() == [1.0, 2.0, 3.0, 4.0]
+    assert df['POP_delta'].tolist() == [1.0, 2.0, 0.0, -4.0]
+
+
+def test_missing_value():
+    population = QueryResult(pandas.DataFrame({'region': KEYS, 'year': ['2018'] * 4,
+                                               'Population': [10.0, 20.0, 30.0, 40.0]}), value_col='Population')
+    income = QueryResult(pandas.DataFrame({'region': KEYS, 'year': ['2018'] * 4,
+                                           'Income': [4.0, 1.0, numpy.nan, 3.0]}), value_col='Income')
+    cube = AnalyticsCube([population.get_matrix(KEYS), income.get_matrix(KEYS)], statistics=['POP', 'INC'])
+
+    # Missing value (..) of a region has no z-score or rank and is left out of the correlation
+    assert numpy.isnan(cube.values[2, 0, 1])
+    assert numpy.isnan(cube.zscores[2, 0, 1]) and numpy.isnan(cube.ranks[2, 0, 1])
+    assert cube.ranks[:, 0, 1].tolist()[:2] == [1.0, 3.0]
+    exp = numpy.corrcoef([10.0, 20.0, 40.0], [4.0, 1.0, 3.0])[0, 1]
+    numpy.testing.assert_allclose(cube.correlation_frame('2018').loc['POP', 'INC'], exp)
@@ -0,0 +1,87 @@
+import pytest
+from scbapi.scbbreaker import CircuitBreaker, CircuitOpenError, CircuitStateEnum
+
+
+def failing(calls):
+    def call():
+        calls.append(1)
+        raise ConnectionError('down')
+    return call
+
+
+def test_opens_after_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    calls = []
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(failing(calls))
+
+    assert breaker.state == CircuitStateEnum.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(failing(calls))
+    assert len(calls) == 2 and breaker.stats['rejected'] == 1
+
+
+@pytest.mark.parametrize(
+    'trial_fails,exp_state',
+    [
+        (False, CircuitStateEnum.CLOSED),
+        (True, CircuitStateEnum.OPEN),
+    ],
+)
+def test_half_open(trial_fails, exp_state):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    with pytest.raises(ConnectionError):
+        breaker.call(failing([]))
+    assert breaker.state == CircuitStateEnum.HALF_OPEN
+
+    if trial_fails:
+        with pytest.raises(ConnectionError):
+            breaker.call(failing([]))
+    else:
+        assert breaker.call(lambda: 'ok') == 'ok'
+
+    assert breaker._state == exp_state
+
+
+def test_retry():
+    breaker = CircuitBreaker(failure_threshold=10)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError('down')
+        return 'ok'
+
+    assert breaker.call_with_retry(flaky, failures=(ConnectionError,), attempts=3, backoff=0) == 'ok'
+    assert len(attempts) == 3 and breaker.stats['failures'] == 0
+
+    # Other exceptions are not retried and do not count as failures
+    with pytest.raises(KeyError):
+        breaker.call_with_retry(lambda: {}['x'], failures=(ConnectionError,), attempts=3, backoff=0)
+    assert breaker.stats['failures'] == 0
+
+
+def test_retry_stops_when_open():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call_with_retry(failing(calls), failures=(ConnectionError,), attempts=5, backoff=0)
+    assert len(calls) == 2
+
+
+def test_trial_other_exception():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    with pytest.raises(ConnectionError):
+        breaker.call(failing([]), failures=(ConnectionError,))
+
+    def parse_error():
+        raise ValueError('maintenance page')
+
+    # Trial ends without a decision, the next call is tried again instead of being rejected
+    with pytest.raises(ValueError):
+        breaker.call(parse_error, failures=(ConnectionError,))
+    assert breaker.state == CircuitStateEnum.HALF_OPEN
+    assert breaker.call(lambda: 'ok', failures=(ConnectionError,)) == 'ok'
+    assert breaker.state == CircuitStateEnum.CLOSED
@@ -0,0 +1,84 @@
+import pytest
+import requests
+import scbapi.scbstat
+from scbapi.scbbreaker import CircuitBreaker, CircuitOpenError, CircuitStateEnum
+from scbapi.scbcatalogue import TableCatalogue
+from scbapi.scbconfig import Config
+from scbapi.scbcontroller import DataController
+from scbapi.scbsnapshot import RateLimitedAdapter
+
+
+def variable(code, text):
+    return {'code': code, 'text': text, 'values': ['00'], 'valueTexts': ['Sweden']}
+
+
+API = {
+    '': [{'id': 'BE', 'type': 'l', 'text': 'Population'}, {'id': 'HE', 'type': 'l', 'text': 'Household finances'}],
+    'BE/': [{'id': 'BefolkningNy', 'type': 't', 'text': 'Population by region and year', 'updated': '2019-02-21'},
+            {'id': 'FodDod', 'type': 't', 'text': 'Live births by region', 'updated': '2019-02-21'}],
+    'HE/': [{'id': 'Inkomst', 'type': 't', 'text': 'Income of households', 'updated': '2019-01-10'}],
+    'BE/BefolkningNy': {'title': 'Population', 'variables': [variable('Region', 'region'), variable('Tid', 'year')]},
+    'BE/FodDod': {'title': 'Births', 'variables': [variable('Region', 'region'), variable('Kon', 'sex')]},
+    'HE/Inkomst': {'title': 'Income', 'variables': [variable('Region', 'region'), variable('Tid', 'year')]},
+}
+
+
+@pytest.fixture
+def catalogue():
+    catalogue = TableCatalogue()
+    catalogue.crawl(API.__getitem__)
+    return catalogue
+
+
+@pytest.mark.parametrize(
+    'text,exp',
+    [
+        ('population', ['BE/BefolkningNy']),
+        ('region', ['BE/FodDod', 'BE/BefolkningNy', 'HE/Inkomst']),
+        ('region yea', ['BE/BefolkningNy', 'HE/Inkomst']),
+        ('births se', ['BE/FodDod']),
+        ('unknown', []),
+        ('', []),
+    ],
+)
+def test_search(catalogue, text, exp):
+    assert [itm['path'] for itm in catalogue.search(text)] == exp
+
+
+def test_suggest(catalogue):
+    assert catalogue.suggest('Ho') == ['households']
+    assert catalogue.suggest('b', limit=1) == ['births']
+
+
+def test_crawl_incremental(catalogue):
+    fetched = []
+
+    def fetch(path):
+        fetched.append(path)
+        return api[path]
+
+    api = dict(API)
+    api['HE/'] = [{'id': 'Inkomst', 'type': 't', 'text': 'Disposable income', 'updated': '2019-03-01'}]
+    api['BE/'] = API['BE/'][:1]
+
+    assert catalogue.crawl(fetch) == 2
+    assert fetched == ['', 'HE/', 'HE/Inkomst', 'BE/']
+    assert [itm['path'] for itm in catalogue.search('disposable')] == ['HE/Inkomst']
+    assert catalogue.search('births') == [] and len(catalogue) == 2
+    assert catalogue.suggest('dis') == ['disposable'] and catalogue.suggest('birth') == []
+
+
+def test_crawl_circuit(monkeypatch):
+    class Unavailable(object):
+        def get(self, url, timeout):
+            raise requests.exceptions.ConnectionError('no API access')
+
+    assert isinstance(scbapi.scbstat.get_crawl_session().get_adapter(Config.api('URL')), RateLimitedAdapter)
+
+    # Failing crawl opens its own circuit, dashboard calls are still let through
+    monkeypatch.setattr(scbapi.scbstat, '_crawl_session', Unavailable())
+    monkeypatch.setattr(scbapi.scbstat, 'crawl_breaker', CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    with pytest.raises(CircuitOpenError):
+        DataController.fetch_catalogue('')
+    assert scbapi.scbstat.crawl_breaker.state == CircuitStateEnum.OPEN
+    assert scbapi.scbstat.api_breaker.state == CircuitStateEnum.CLOSED
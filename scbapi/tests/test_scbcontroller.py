@@ -0,0 +1,290 @@
+import json
+import threading
+import time
+import zipfile
+import pandas
+import pytest
+import scbapi.scbstat
+from scbapi.scbbreaker import CircuitOpenError
+from scbapi.scbconfig import Config
+from scbapi.scbcontroller import DataController
+from scbapi.scbexport import ResultExporter
+from scbapi.scbresult import QueryResult
+
+MUNICIPALITIES = {'0114': (0, 0), '0180': (1, 0), '1280': (0, 1), '1281': (1, 1)}
+
+
+def write_map(folder, name, key_col, cells):
+    import geopandas
+    from shapely.geometry import box
+
+    gdf = geopandas.GeoDataFrame({key_col: list(cells.keys()), 'name': list(cells.keys())},
+                                 geometry=[box(x, y, x + 1, y + 1) for (x, y) in cells.values()])
+    gdf.crs = {'init': 'epsg:4326'}
+    shp_folder = folder / name
+    gdf.to_file(str(shp_folder))
+
+    path = folder / '{}.zip'.format(name)
+    with zipfile.ZipFile(str(path), 'w') as archive:
+        for file in shp_folder.iterdir():
+            archive.write(str(file), arcname=file.name)
+    return str(path)
+
+
+def make_controller(tmp_path, queries):
+    """
+    Controller over local maps and the default query collection
+    """
+    (tmp_path / 'map').mkdir()
+    (tmp_path / 'queries').mkdir()
+    regions = {
+        'MUNICIPALITIES': {'key_col': 'KnKod', 'name_col': 'name',
+                           'url': write_map(tmp_path, 'kommuner', 'KnKod', MUNICIPALITIES)},
+        'COUNTIES': {'key_col': 'LnKod', 'name_col': 'name',
+                     'url': write_map(tmp_path, 'lan', 'LnKod', {'01': (0, 0), '12': (0, 1)})},
+    }
+    (tmp_path / 'map' / 'regions.json').write_text(json.dumps(regions))
+    (tmp_path / 'queries' / 'queries.json').write_text(json.dumps(queries))
+
+    return DataController(local_path=str(tmp_path), registry_path=str(tmp_path / 'registry.sqlite3'))
+
+
+@pytest.fixture
+def controller(tmp_path):
+    controller = make_controller(tmp_path, {})
+    yield controller
+    controller.jobs.shutdown()
+
+
+def put_result(controller, query_key, values, fetched_at=None, aggregate=None, additive=False):
+    """
+    Store a result for a query of the registry, as if it was fetched from the API
+    """
+    if query_key not in controller.registry:
+        definition = {'name': query_key, 'path': 'x', 'simple_query': {}}
+        if additive:
+            definition['additive'] = True
+        controller.registry.put(query_key, {'type': 'SIMPLE', 'query': definition})
+    cache_key = (query_key, controller.resolve_map_key(), controller.registry.digest(query_key),
+                 tuple(aggregate) if aggregate is not None else None)
+    df = pandas.DataFrame({'region': list(MUNICIPALITIES.keys()) * 2, 'year': ['2017'] * 4 + ['2018'] * 4,
+                           'value': values})
+    result = QueryResult(df, value_col='value', fingerprint=query_key, fetched_at=fetched_at)
+    controller._store_result(cache_key, result)
+    return result
+
+
+def query_definition(total=False):
+    """
+    Definition of a query with metadata
+    """
+    regions = list(MUNICIPALITIES.keys()) + (['00'] if total else [])
+    info = {'title': 'Population', 'variables': [
+        {'code': 'Region', 'text': 'region', 'values': regions, 'valueTexts': regions},
+        {'code': 'Tid', 'text': 'year', 'values': ['2017', '2018'], 'valueTexts': ['2017', '2018'], 'time': True}]}
+    return {'type': 'SIMPLE', 'query': {
+        'name': 'Population', 'path': 'BE/BE0101', 'simple_query': {'region': ['*'], 'year': ['2018']},
+        'info': info, 'response_format': 'csv'}}
+
+
+def put_query(controller, query_key, total=False):
+    """
+    Register a query definition with metadata and get the query object
+    """
+    controller.registry.put(query_key, query_definition(total=total))
+    return controller.get_query(query_key)
+
+
+def test_stale_query_error(controller, monkeypatch):
+    stale = put_result(controller, 'POP', [float(i) for i in range(8)], fetched_at=time.time() - 10 ** 6)
+
+    def unavailable(*args, **kwargs):
+        raise CircuitOpenError('service unavailable, retry later')
+
+    # Validating the query needs the API, the last known result is served instead
+    monkeypatch.setattr(controller, 'get_query', unavailable)
+    assert controller.get_result('POP') is stale
+
+    controller._result_cache.clear()
+    with pytest.raises(CircuitOpenError):
+        controller.get_result('POP')
+
+
+def test_export_refetched(controller, tmp_path):
+    controller._exporter = ResultExporter(folder=str(tmp_path / 'exports'))
+    put_result(controller, 'POP', [float(i) for i in range(8)], fetched_at=time.time())
+    path = controller.export_result('POP', 'csv')
+
+    # Result fetched again keeps its fingerprint, the export follows the new data
+    put_result(controller, 'POP', [float(i + 1) for i in range(8)], fetched_at=time.time())
+    path_new = controller.export_result('POP', 'csv')
+    assert path_new != path
+    assert pandas.read_csv(str(path_new))['value'].tolist() == [float(i + 1) for i in range(8)]
+
+
+def test_job_keeps_no_result(controller):
+    put_result(controller, 'POP', [float(i) for i in range(8)])
+    put_result(controller, 'POP', [float(i) for i in range(8)], aggregate=['region'])
+    job = controller.submit_result(owner='a', query_key='POP')
+    for _ in range(500):
+        if not job.pending:
+            break
+        time.sleep(0.01)
+
+    assert job.state.value == 'done', job.error
+    assert job.result is None
+
+
+@pytest.fixture
+def memory_config(monkeypatch):
+    config = {'BUDGET_MB': '1024', 'SIMPLIFY_TOLERANCE': '0.5'}
+    monkeypatch.setattr(Config, 'memory', classmethod(lambda cls, key: config[key]))
+    return config
+
+
+def test_memory_report(controller, memory_config):
+    put_result(controller, 'POP', [float(i) for i in range(8)])
+    report = controller.memory_report()
+
+    assert [itm['category'] for itm in report['entries']] == ['maps', 'maps', 'results']
+    assert report['entries'][-1]['key'][0] == 'POP'
+    assert report['totals']['results'] == report['entries'][-1]['bytes'] > 0
+    assert report['total'] == sum(report['totals'].values())
+
+
+def test_derived_data_measured(controller, memory_config):
+    result = put_result(controller, 'POP', [float(i) for i in range(8)])
+    entry = ('results', ('POP', controller.resolve_map_key(), controller.registry.digest('POP'), None))
+    size = controller._entry_size(entry)
+
+    # Matrix added after the result was stored is counted when the budget is checked
+    result.get_matrix(controller.maps['MUNICIPALITIES'].get_keys())
+    assert controller._entry_size(entry) > size
+
+
+def test_budget_evicts_least_recently_used(controller, memory_config):
+    for key in ('A', 'B', 'C'):
+        put_result(controller, key, [float(i) for i in range(8)])
+    size = controller.memory_report()['entries'][-1]['bytes']
+    for key in controller.map_keys:
+        controller._get_map(key)
+    controller.get_result('A')
+
+    # Maps in use are kept, B is the least recently used result
+    memory_config['BUDGET_MB'] = str((controller.memory_report()['total'] + size / 2) / 1024 / 1024)
+    put_result(controller, 'D', [float(i) for i in range(8)])
+    assert sorted(key[0] for key in controller._result_cache.keys()) == ['A', 'C', 'D']
+    assert not any(itm.downgraded for itm in controller.maps.values())
+
+
+def test_budget_downgrades_maps(controller, memory_config):
+    maphandler = controller.maps['MUNICIPALITIES']
+    controller.map_dict('MUNICIPALITIES')
+    keys = maphandler.get_keys()
+    assert maphandler.region_at(0.5, 0.5) == '0114'
+
+    # Result just stored is kept even if it alone exceeds the budget
+    memory_config['BUDGET_MB'] = '0'
+    put_result(controller, 'POP', [float(i) for i in range(8)])
+    assert len(controller._result_cache) == 1
+    assert all(itm.downgraded for itm in controller.maps.values())
+    assert 'MUNICIPALITIES' not in controller._map_dicts
+
+    # Downgraded maps keep their regions and lookups
+    assert maphandler.get_keys() == keys
+    assert maphandler.region_at(0.5, 0.5) == '0114'
+    assert len(controller.map_dict('MUNICIPALITIES')['features']) == len(keys)
+
+
+def test_query_without_api(controller, monkeypatch):
+    def unavailable(url):
+        raise ConnectionError('no API access')
+
+    # Stored definitions were validated when they were saved, the path is not checked again
+    monkeypatch.setattr(scbapi.scbstat, 'get_metadata', unavailable)
+    query = put_query(controller, 'POP')
+    assert query.url == Config.api('URL') and query.response_format == 'csv'
+    assert query.request_body['query'][0]['selection']['values'] == controller.maps['MUNICIPALITIES'].get_keys()
+    assert query.request_body['query'][1]['selection']['values'] == ['2018']
+
+
+def test_query_cache_default_map(controller):
+    put_query(controller, 'POP')
+    controller.get_query('POP', map_key='MUNICIPALITIES')
+    assert len(controller._query_cache) == 1
+
+
+def test_query_cache_threads(controller, monkeypatch):
+    monkeypatch.setattr(DataController, 'QUERY_CACHE_SIZE', 2)
+    for i in range(4):
+        put_query(controller, 'Q{}'.format(i))
+    errors = []
+
+    def use_queries():
+        try:
+            for i in range(200):
+                controller.get_query('Q{}'.format(i % 4))
+                controller.memory_report(measure=False)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=use_queries) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(controller._query_cache) == 2
+
+
+@pytest.mark.parametrize('additive,exp', [(True, [1.0, 5.0, 9.0, 13.0]), (False, None)])
+def test_rollup_additive(controller, additive, exp):
+    put_result(controller, 'POP', [float(i) for i in range(8)], additive=additive)
+    cache_key = ('POP', 'COUNTIES', controller.registry.digest('POP'), None)
+    result = controller._rollup_result(cache_key, controller.registry)
+
+    # Ratios and averages are not summed, they are fetched for the coarser map
+    if exp is None:
+        assert result is None
+    else:
+        assert result.df.sort_values(['year', 'region'])['value'].tolist() == exp
+
+
+@pytest.mark.parametrize('total,exp_fetched', [(False, []), (True, [('POP', ('region',))])])
+def test_time_series_reuses_result(controller, monkeypatch, total, exp_fetched):
+    put_query(controller, 'POP', total=total)
+    put_result(controller, 'POP', [float(i) for i in range(8)], fetched_at=time.time())
+    fetched = []
+
+    def fetch_results(items):
+        fetched.extend((cache_key[0], cache_key[3]) for cache_key, _ in items)
+        return [QueryResult(pandas.DataFrame({'year': ['2017', '2018'], 'value': [6.0, 22.0]}), value_col='value')
+                for _ in items]
+
+    # Without a total or elimination the aggregated query is the plain one, the map result is summed
+    monkeypatch.setattr(controller, '_fetch_results', fetch_results)
+    series = controller.time_series('POP')
+    assert series['value'].tolist() == [6.0, 22.0]
+    assert fetched == exp_fetched
+
+
+def test_rollup_seeded(tmp_path, monkeypatch):
+    class Reachable(object):
+        status_code = 200
+
+    # Default queries are validated against the API when they are loaded
+    monkeypatch.setattr(scbapi.scbstat, 'get_metadata', lambda url: Reachable())
+    definition = query_definition()
+    definition['query']['additive'] = True
+    controller = make_controller(tmp_path, {'POP': definition})
+    try:
+        assert controller.registry['POP']['query']['additive']
+        put_result(controller, 'POP', [float(i) for i in range(8)], fetched_at=time.time())
+
+        # Counts of the default collection are summed for the counties without a fetch
+        monkeypatch.setattr(controller, '_fetch_results', None)
+        result = controller.get_result('POP', map_key='COUNTIES')
+        assert result.df.sort_values(['year', 'region'])['value'].tolist() == [1.0, 5.0, 9.0, 13.0]
+    finally:
+        controller.jobs.shutdown()
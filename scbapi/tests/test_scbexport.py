@@ -0,0 +1,93 @@
+import os
+import threading
+import pandas
+import pytest
+from scbapi.scbexport import ResultExporter
+from scbapi.scbresult import QueryResult
+
+
+@pytest.fixture
+def df():
+    return pandas.DataFrame({'region': ['0114', '0115', '0180', '1280', '1281'],
+                             'year': ['2017', '2017', '2018', '2018', '2018'],
+                             'Population': [45543.0, 33032.0, 962154.0, 344166.0, 1.5]})
+
+
+@pytest.mark.parametrize('chunk_rows,exp_chunks', [(2, 4), (5, 2), (100, 2)])
+def test_csv_chunks(df, chunk_rows, exp_chunks):
+    chunks = list(ResultExporter(chunk_rows=chunk_rows).iter_csv(df))
+    assert len(chunks) == exp_chunks
+    assert b''.join(chunks).decode('utf-8') == df.to_csv(index=False)
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_round_trip(tmp_path, df, file_format):
+    path = ResultExporter(folder=str(tmp_path), chunk_rows=2).export_file(df, name='result', file_format=file_format)
+    if file_format == 'csv':
+        df_read = pandas.read_csv(str(path), dtype={'region': str, 'year': str})
+    else:
+        df_read = pandas.read_parquet(str(path))
+
+    pandas.testing.assert_frame_equal(df_read, df)
+    assert [itm.name for itm in tmp_path.iterdir()] == [path.name]
+
+
+def test_unsupported_format(tmp_path, df):
+    with pytest.raises(ValueError):
+        ResultExporter(folder=str(tmp_path)).export_file(df, name='result', file_format='xls')
+
+
+def test_reuse_and_refresh(tmp_path, df):
+    exporter = ResultExporter(folder=str(tmp_path))
+    result = QueryResult(df, value_col='Population', fingerprint='POP')
+    path = exporter.export_file(result.df, name=result.digest, file_format='csv')
+    path.write_text('cached')
+
+    # Same content is served from the existing file
+    same = QueryResult(df.copy(), value_col='Population', fingerprint='POP')
+    assert exporter.export_file(same.df, name=same.digest, file_format='csv').read_text() == 'cached'
+
+    # Data fetched again with other values gets a new file
+    df_new = df.assign(Population=df['Population'] + 1)
+    refreshed = QueryResult(df_new, value_col='Population', fingerprint='POP')
+    path_new = exporter.export_file(refreshed.df, name=refreshed.digest, file_format='csv')
+    assert path_new != path
+    assert path_new.read_text(encoding='utf-8') == df_new.to_csv(index=False)
+
+
+def test_cleanup(tmp_path, df):
+    exporter = ResultExporter(folder=str(tmp_path), max_files=2)
+    paths = [exporter.export_file(df, name=name, file_format='csv') for name in ('a', 'b')]
+    os.utime(str(paths[0]), (0, 0))
+    os.utime(str(paths[1]), (1, 1))
+
+    # Reused export is used most recently, the least recently used one is removed for a new export
+    exporter.export_file(df, name='a', file_format='csv')
+    exporter.export_file(df, name='c', file_format='parquet')
+    assert sorted(itm.name for itm in tmp_path.iterdir()) == ['a.csv', 'c.parquet']
+
+
+def test_concurrent_exports(tmp_path, df, monkeypatch):
+    exporter = ResultExporter(folder=str(tmp_path))
+    writing = threading.Event()
+    release = threading.Event()
+    iter_csv = exporter.iter_csv
+
+    def slow_csv(df_export):
+        writing.set()
+        release.wait(timeout=5)
+        return iter_csv(df_export)
+
+    # Export of another file is not blocked by a slow export
+    monkeypatch.setattr(exporter, 'iter_csv', slow_csv)
+    thread = threading.Thread(target=exporter.export_file, args=(df, 'slow', 'csv'))
+    thread.start()
+    writing.wait(timeout=5)
+    try:
+        path = exporter.export_file(df, name='other', file_format='parquet')
+        assert path.exists() and not (tmp_path / 'slow.csv').exists()
+    finally:
+        release.set()
+        thread.join()
+
+    assert (tmp_path / 'slow.csv').read_text(encoding='utf-8') == df.to_csv(index=False)
@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from scbapi.scbflight import SingleFlight
+
+
+def slow_call(release, calls, result):
+    def call():
+        calls.append(result)
+        release.wait(timeout=5)
+        return result
+    return call
+
+
+def run_concurrent(flight, keys, release, calls):
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        futures = [executor.submit(flight.do, key, slow_call(release, calls, key)) for key in keys]
+        # Wait until every caller has either started a call or joined one
+        while flight.stats['executed'] + flight.stats['coalesced'] < len(keys):
+            threading.Event().wait(0.01)
+        release.set()
+        return [future.result() for future in futures]
+
+
+@pytest.mark.parametrize(
+    'keys,exp_calls',
+    [
+        (['a', 'a', 'a', 'a'], 1),
+        (['a', 'b', 'a', 'b'], 2),
+        (['a', 'b', 'c'], 3),
+    ],
+)
+def test_coalesce(keys, exp_calls):
+    flight = SingleFlight()
+    calls = []
+    results = run_concurrent(flight, keys, threading.Event(), calls)
+
+    assert results == keys
+    assert len(calls) == exp_calls
+    assert flight.stats == {'executed': exp_calls, 'coalesced': len(keys) - exp_calls, 'in_flight': 0}
+
+
+def test_error_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fail():
+        release.wait(timeout=5)
+        raise ValueError('failed')
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        futures = [executor.submit(flight.do, 'a', fail) for _ in range(3)]
+        while flight.stats['executed'] + flight.stats['coalesced'] < 3:
+            threading.Event().wait(0.01)
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
+
+    # Failed calls are not kept, the next caller runs the call again
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.stats['executed'] == 2
+
+
+def test_completed_not_cached():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('a', lambda: 2) == 2
+    assert flight.stats == {'executed': 2, 'coalesced': 0, 'in_flight': 0}
@@ -0,0 +1,61 @@
+import numpy
+import pandas
+import pytest
+from scbapi.scbhierarchy import RegionHierarchy, NATIONAL_LAYER
+from scbapi.scbresult import QueryResult
+
+
+@pytest.fixture
+def hierarchy():
+    return RegionHierarchy({'MUNICIPALITIES': ['0114', '0180', '1280', '1281'], 'COUNTIES': ['01', '12'],
+                            'OTHER': ['A1', 'B2']})
+
+
+@pytest.fixture
+def df():
+    return pandas.DataFrame({'region': ['0114', '0180', '1280', '1281', '9999'] * 2,
+                             'year': ['2017'] * 5 + ['2018'] * 5,
+                             'value': [1.0, 2.0, 3.0, numpy.nan, 100.0, 5.0, 6.0, numpy.nan, numpy.nan, 100.0]})
+
+
+@pytest.mark.parametrize(
+    'fine,coarse,exp',
+    [
+        ('MUNICIPALITIES', 'COUNTIES', True),
+        ('MUNICIPALITIES', NATIONAL_LAYER, True),
+        ('COUNTIES', NATIONAL_LAYER, True),
+        ('COUNTIES', 'MUNICIPALITIES', False),
+        ('MUNICIPALITIES', 'OTHER', False),
+    ],
+)
+def test_is_nested(hierarchy, fine, coarse, exp):
+    assert hierarchy.is_nested(fine, coarse) == exp
+
+
+def test_parents(hierarchy):
+    assert hierarchy.parents('MUNICIPALITIES', 'COUNTIES').tolist() == [0, 0, 1, 1]
+    assert hierarchy.finer('COUNTIES') == ['MUNICIPALITIES']
+    assert hierarchy.finer(NATIONAL_LAYER) == ['COUNTIES', 'OTHER', 'MUNICIPALITIES']
+
+
+@pytest.mark.parametrize(
+    'coarse,exp',
+    [
+        ('COUNTIES', [['01', '2017', 3.0], ['01', '2018', 11.0], ['12', '2017', 3.0], ['12', '2018', None]]),
+        (NATIONAL_LAYER, [['00', '2017', 6.0], ['00', '2018', 11.0]]),
+    ],
+)
+def test_rollup(hierarchy, df, coarse, exp):
+    df_rollup = hierarchy.rollup(df, fine='MUNICIPALITIES', coarse=coarse)
+
+    assert df_rollup.columns.tolist() == ['region', 'year', 'value']
+    assert df_rollup.where(df_rollup.notnull(), None).values.tolist() == exp
+
+
+def test_result_rollup(hierarchy, df):
+    result = QueryResult(df, value_col='value', fingerprint='fp')
+    rollup = result.rollup(hierarchy, fine='MUNICIPALITIES', coarse='COUNTIES')
+
+    pandas.testing.assert_frame_equal(rollup.df, result.rollup(hierarchy, fine='MUNICIPALITIES', coarse='COUNTIES').df)
+    assert rollup.fingerprint == 'fp-COUNTIES'
+    assert rollup.get_matrix(keys=['01', '12']).totals.tolist() == [14.0, 3.0]
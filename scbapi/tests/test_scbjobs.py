@@ -0,0 +1,165 @@
+import threading
+import pytest
+from scbapi.scbjobs import JobQueue, JobStateEnum, JobLimitError
+
+
+def wait_done(job, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if job.state not in (JobStateEnum.QUEUED, JobStateEnum.RUNNING):
+            return
+        threading.Event().wait(0.01)
+
+
+def blocking_call(release):
+    def call(job):
+        job.update(0.5, 'waiting')
+        release.wait(timeout=5)
+        job.update(0.9, 'finishing')
+        return job.key
+    return call
+
+
+def test_result():
+    queue = JobQueue(workers=2)
+    job = queue.submit('a', 'K', lambda itm: itm.key * 2)
+    wait_done(job)
+
+    assert job.state == JobStateEnum.DONE
+    assert job.result == 'KK' and job.progress == 1.0
+    assert queue.get(job.id) is job
+
+
+def test_failure():
+    queue = JobQueue(workers=1)
+    job = queue.submit('a', 'K', lambda itm: 1 / 0)
+    wait_done(job)
+
+    assert job.state == JobStateEnum.FAILED
+    assert job.status()['error'] == 'division by zero'
+
+
+def test_cancel_running():
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    job = queue.submit('a', 'K', blocking_call(release))
+    while job.progress < 0.5:
+        threading.Event().wait(0.01)
+
+    assert queue.cancel(job.id)
+    release.set()
+    wait_done(job)
+
+    # Call stops at the next progress update
+    assert job.state == JobStateEnum.CANCELLED
+    assert job.progress == 0.5 and job.result is None
+    assert not queue.cancel(job.id)
+
+
+@pytest.mark.parametrize(
+    'owners,exp_error',
+    [
+        (['a', 'a'], False),
+        (['a', 'a', 'a'], True),
+        (['a', 'b', 'a', 'b'], False),
+    ],
+)
+def test_owner_limit(owners, exp_error):
+    queue = JobQueue(workers=1, owner_limit=2)
+    release = threading.Event()
+    try:
+        if exp_error:
+            with pytest.raises(JobLimitError):
+                for i, owner in enumerate(owners):
+                    queue.submit(owner, str(i), blocking_call(release))
+        else:
+            for i, owner in enumerate(owners):
+                queue.submit(owner, str(i), blocking_call(release))
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_cancel_owner():
+    queue = JobQueue(workers=1, owner_limit=3)
+    release = threading.Event()
+    jobs = [queue.submit('a', key, blocking_call(release)) for key in ('K1', 'K2', 'K3')]
+    other = queue.submit('b', 'K1', blocking_call(release))
+
+    assert queue.cancel_owner('a', keep='K3') == 2
+    assert queue.find('a', 'K3') is jobs[2] and queue.find('a', 'K1') is None
+
+    release.set()
+    for job in jobs + [other]:
+        wait_done(job)
+
+    assert [job.state for job in jobs] == [JobStateEnum.CANCELLED, JobStateEnum.CANCELLED, JobStateEnum.DONE]
+    assert other.state == JobStateEnum.DONE
+
+
+def test_cancelled_running_limit():
+    queue = JobQueue(workers=2, owner_limit=1)
+    release = threading.Event()
+    try:
+        job = queue.submit('a', 'K1', blocking_call(release))
+        while job.progress < 0.5:
+            threading.Event().wait(0.01)
+
+        # Cancelled call still holds a worker until its next progress update, the new job waits behind it
+        queue.cancel_owner('a')
+        waiting = queue.submit('a', 'K2', lambda itm: itm.key)
+        threading.Event().wait(0.05)
+        assert waiting.state == JobStateEnum.QUEUED and not waiting.started
+
+        # Only jobs the owner still waits for count toward the limit
+        with pytest.raises(JobLimitError):
+            queue.submit('a', 'K3', lambda itm: itm.key)
+
+        release.set()
+        wait_done(job)
+        wait_done(waiting)
+        assert job.state == JobStateEnum.CANCELLED
+        assert waiting.state == JobStateEnum.DONE and waiting.result == 'K2'
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_cancel_waiting():
+    queue = JobQueue(workers=2, owner_limit=1)
+    release = threading.Event()
+    try:
+        job = queue.submit('a', 'K1', blocking_call(release))
+        queue.cancel_owner('a')
+        waiting = queue.submit('a', 'K2', blocking_call(release))
+
+        # Selecting another statistic cancels the waiting job, the newest one starts next
+        queue.cancel_owner('a')
+        assert waiting.state == JobStateEnum.CANCELLED
+        newest = queue.submit('a', 'K3', lambda itm: itm.key)
+
+        release.set()
+        for itm in (job, newest):
+            wait_done(itm)
+        assert newest.state == JobStateEnum.DONE and not waiting.started
+    finally:
+        release.set()
+        queue.shutdown()
+
+
+def test_selections_in_a_row():
+    queue = JobQueue(workers=4, owner_limit=2)
+    release = threading.Event()
+    try:
+        # Each selection cancels the previous one, as DataController.submit_result does
+        jobs = []
+        for key in ('K1', 'K2', 'K3', 'K4'):
+            queue.cancel_owner('a')
+            jobs.append(queue.submit('a', key, blocking_call(release)))
+
+        release.set()
+        for job in jobs:
+            wait_done(job)
+        assert jobs[-1].state == JobStateEnum.DONE and jobs[-1].result == 'K4'
+    finally:
+        release.set()
+        queue.shutdown()
@@ -0,0 +1,59 @@
+import pytest
+from scbapi.scbmap import MapHandler, Region
+
+# Unit squares, the lower left corner of each region
+CELLS = {'0114': (0, 0), '0180': (1, 0), '1280': (0, 1), '1281': (3, 3)}
+
+
+@pytest.fixture
+def maphandler(monkeypatch):
+    import geopandas
+    from shapely.geometry import box
+
+    gdf = geopandas.GeoDataFrame({'KnKod': list(CELLS.keys()), 'KnNamn': list(CELLS.keys())},
+                                 geometry=[box(x, y, x + 1, y + 1) for (x, y) in CELLS.values()])
+    gdf.crs = {'init': 'epsg:4326'}
+    monkeypatch.setattr(geopandas, 'read_file', lambda path: gdf)
+    return MapHandler(Region(key_col='KnKod', name_col='KnNamn'), path='regions.zip')
+
+
+@pytest.mark.parametrize(
+    'lon,lat,exp',
+    [
+        (0.5, 0.5, '0114'),
+        (1.5, 0.2, '0180'),
+        (0.5, 1.5, '1280'),
+        (2.5, 2.5, None),
+        (3.5, 3.5, '1281'),
+    ],
+)
+def test_region_at(maphandler, lon, lat, exp):
+    assert maphandler.region_at(lon, lat) == exp
+
+
+@pytest.mark.parametrize(
+    'bbox,exp',
+    [
+        ((0.2, 0.2, 0.8, 0.8), ['0114']),
+        ((0.5, 0.5, 1.5, 1.5), ['0114', '0180', '1280']),
+        ((2.1, 2.1, 2.9, 2.9), []),
+        ((-10, -10, 10, 10), ['0114', '0180', '1280', '1281']),
+    ],
+)
+def test_regions_in(maphandler, bbox, exp):
+    assert maphandler.regions_in(*bbox) == exp
+
+
+def test_regions_within(maphandler):
+    # Triangle touching the lower squares only, its bounding box also covers 1280
+    assert maphandler.regions_within([(0.1, 0.1), (1.9, 0.1), (1.9, 1.5)]) == ['0114', '0180']
+    assert maphandler.regions_within([(2.1, 2.1), (2.9, 2.1), (2.1, 2.9)]) == []
+
+
+def test_downgrade(maphandler):
+    maphandler.region_at(0.5, 0.5)
+    maphandler.downgrade(tolerance=0.1)
+
+    assert maphandler.downgraded
+    assert maphandler.get_keys() == list(CELLS.keys())
+    assert maphandler.region_at(1.5, 0.5) == '0180'
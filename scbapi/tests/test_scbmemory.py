@@ -0,0 +1,40 @@
+import numpy
+import pandas
+import pytest
+from shapely.geometry import Point
+from scbapi.scbmemory import deep_size, geometry_size
+from scbapi.scbresult import QueryResult
+
+
+@pytest.fixture
+def df():
+    return pandas.DataFrame({'region': ['0114', '0115', '0180', '1280'],
+                             'year': ['2017', '2017', '2018', '2018'],
+                             'Population': [45543.0, 33032.0, 962154.0, 344166.0]})
+
+
+def test_frame(df):
+    assert deep_size(df) == df.memory_usage(index=False, deep=True).sum() + df.index.memory_usage(deep=True)
+    assert deep_size(numpy.zeros(100)) == 800
+
+
+def test_shared(df):
+    values = list(range(1000))
+    assert deep_size([values, values]) == deep_size([values]) + 8
+    assert deep_size({'a': {'b': df}}) > deep_size(df)
+
+
+@pytest.mark.parametrize('points', [1, 10, 100])
+def test_geometry(points):
+    geom = Point(0, 0).buffer(1, resolution=points)
+    assert geometry_size(geom) > 16 * len(geom.exterior.coords)
+    assert deep_size([geom]) == deep_size([]) + 8 + geometry_size(geom)
+
+
+def test_result(df):
+    result = QueryResult(df, value_col='Population')
+    size = result.memory_usage()
+    assert size >= deep_size(df)
+
+    result.get_matrix(['0114', '0180'])
+    assert result.memory_usage() > size
@@ -0,0 +1,85 @@
+import io
+import json
+import math
+import pytest
+from scbapi.scbparse import TextStream, parse_csv, parse_json, parse_json_stat2
+
+
+def chunked(text, size):
+    data = text.encode('utf-8-sig')
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.fixture
+def px_json():
+    return json.dumps({
+        'columns': [{'code': 'Region', 'text': 'region', 'type': 'd'},
+                    {'code': 'Tid', 'text': 'year', 'type': 't'},
+                    {'code': 'BE0101N1', 'text': 'Population', 'type': 'c'}],
+        'comments': [],
+        'data': [{'key': ['0114', '2017'], 'values': ['45543']},
+                 {'key': ['0114', '2018'], 'values': ['..']},
+                 {'key': ['0115', '2017'], 'values': ['33032']},
+                 {'key': ['0115', '2018'], 'values': ['33726']}]
+    })
+
+
+@pytest.mark.parametrize('chunk_size,rows', [(1, 4), (7, 1), (1024, 4), (1024, 0)])
+def test_parse_json(px_json, chunk_size, rows):
+    columns, df = parse_json(chunked(px_json, chunk_size), rows=rows)
+    assert [col['text'] for col in columns] == ['region', 'year', 'Population']
+    assert df['region'].tolist() == ['0114', '0114', '0115', '0115']
+    assert df['year'].tolist() == ['2017', '2018', '2017', '2018']
+    assert df['Population'][0] == 45543.0
+    assert math.isnan(df['Population'][1])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1024])
+def test_parse_json_stat2(chunk_size):
+    dataset = json.dumps({
+        'class': 'dataset',
+        'id': ['Region', 'ContentsCode', 'Tid'],
+        'size': [2, 1, 2],
+        'role': {'time': ['Tid'], 'metric': ['ContentsCode']},
+        'dimension': {
+            'Region': {'label': 'region', 'category': {'index': {'0114': 0, '0115': 1}}},
+            'ContentsCode': {'label': 'contents', 'category': {'index': {'BE0101N1': 0},
+                                                               'label': {'BE0101N1': 'Population'}}},
+            'Tid': {'label': 'year', 'category': {'index': {'2017': 0, '2018': 1}}}
+        },
+        'value': [45543, None, 33032, 33726]
+    })
+    columns, df = parse_json_stat2(chunked(dataset, chunk_size), rows=4)
+    assert [col['type'] for col in columns] == ['d', 't', 'c']
+    assert df['region'].tolist() == ['0114', '0114', '0115', '0115']
+    assert df['year'].tolist() == ['2017', '2018', '2017', '2018']
+    assert df['Population'].tolist()[2:] == [33032.0, 33726.0]
+
+
+@pytest.mark.parametrize('body', [[b'[1.5, 2'], [b'[1.5, ', b'2'], [b'[1.5'], [b'[']])
+def test_scalar_batches_truncated(body):
+    # Connection dropped in the middle of the array
+    with pytest.raises(ValueError):
+        list(TextStream(body).iter_scalar_batches())
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1024])
+def test_parse_json_truncated(px_json, chunk_size):
+    with pytest.raises(ValueError):
+        parse_json(chunked(px_json[:px_json.index('33726')], chunk_size), rows=4)
+
+
+def test_parse_csv():
+    text = '"region","Population 2017","Population 2018"\n' \
+           '"0114 Upplands Väsby",45543,..\n' \
+           '"0115 Vallentuna",33032,33726\n'
+    variables = [{'code': 'Region', 'text': 'region', 'values': ['0114', '0115'],
+                  'valueTexts': ['Upplands Väsby', 'Vallentuna']},
+                 {'code': 'Tid', 'text': 'year', 'values': ['2017', '2018'],
+                  'valueTexts': ['2017', '2018'], 'time': True}]
+    columns, df = parse_csv(io.BytesIO(text.encode('utf-8-sig')), variables=variables)
+    assert [col['text'] for col in columns] == ['region', 'year', 'Population']
+    assert df['region'].tolist() == ['0114', '0115', '0114', '0115']
+    assert df['year'].tolist() == ['2017', '2017', '2018', '2018']
+    assert df['Population'].tolist()[:2] == [45543.0, 33032.0]
+    assert math.isnan(df['Population'][2])
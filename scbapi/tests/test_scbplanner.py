@@ -0,0 +1,97 @@
+import itertools
+import threading
+import pandas
+import pytest
+from scbapi.scbstat import QueryInfo, QueryVariable, SimpleQuery
+from scbapi.scbplanner import QueryPlanner
+
+
+@pytest.fixture
+def query_info():
+    region = QueryVariable(code='Region', text='region', values=['01', '03', '04'], valueTexts=['A', 'B', 'C'])
+    year = QueryVariable(code='Tid', text='year', values=['2017', '2018'], valueTexts=['2017', '2018'], time=True)
+    contents = QueryVariable(code='ContentsCode', text='observations', values=['POP', 'BIRTHS'],
+                             valueTexts=['Population', 'Births'])
+    return QueryInfo(title='test', variables=[region, year, contents])
+
+
+def make_query(query_info, simple_query):
+    values = {'name': 'test', 'path': 'test', 'url': 'http://api/', 'info': query_info, 'simple_query': simple_query,
+              'region_keys': ['01', '03', '04'], 'response_format': 'json', 'aggregate': None}
+    return SimpleQuery.construct(values, set(values.keys()))
+
+
+def fake_fetch(calls):
+    def fetch(self, selection=None):
+        # Cartesian product of the selection, value is derived from the keys
+        selection = selection or self.query
+        calls.append(selection)
+        keys, contents = selection[:2], selection[2].selection.values
+        columns = [{'code': 'Region', 'text': 'region', 'type': 'd'}, {'code': 'Tid', 'text': 'year', 'type': 't'}]
+        columns += [{'code': code, 'text': code, 'type': 'c'} for code in contents]
+        rows = [list(key) + [float(key[0] + key[1]) + i for i in range(len(contents))]
+                for key in itertools.product(*[itm.selection.values for itm in keys])]
+        return columns, pandas.DataFrame(rows, columns=[col['text'] for col in columns])
+    return fetch
+
+
+def test_execute_many(monkeypatch, query_info):
+    calls = []
+    monkeypatch.setattr(SimpleQuery, 'fetch', fake_fetch(calls))
+
+    query_a = make_query(query_info, {'region': ['*'], 'year': ['2017'], 'observations': ['Population']})
+    query_b = make_query(query_info, {'region': ['A'], 'year': ['2018'], 'observations': ['Births']})
+    df_a, df_b = QueryPlanner().execute_many([query_a, query_b])
+
+    assert len(calls) == 1
+    assert [itm.selection.values for itm in calls[0]] == [['01', '03', '04'], ['2017', '2018'], ['POP', 'BIRTHS']]
+    assert df_a.columns.tolist() == ['region', 'year', 'POP']
+    assert df_a.region.tolist() == ['01', '03', '04'] and df_a.year.unique().tolist() == ['2017']
+    assert df_b.values.tolist() == [['01', '2018', 12019.0]]
+    assert query_a.value_col == 'POP' and query_b.value_col == 'BIRTHS'
+
+
+@pytest.mark.parametrize(
+    'cell_limit,exp',
+    [
+        (150000, 1),
+        (5, 2),
+    ],
+)
+def test_cell_limit(monkeypatch, query_info, cell_limit, exp):
+    calls = []
+    monkeypatch.setattr(SimpleQuery, 'fetch', fake_fetch(calls))
+
+    query_a = make_query(query_info, {'region': ['*'], 'year': ['2017'], 'observations': ['Population']})
+    query_b = make_query(query_info, {'region': ['*'], 'year': ['2018'], 'observations': ['Population']})
+    df_a, df_b = QueryPlanner(cell_limit=cell_limit).execute_many([query_a, query_b])
+
+    assert len(calls) == exp
+    assert df_b.POP.tolist() == [12018.0, 32018.0, 42018.0]
+
+
+def test_plan_error(monkeypatch, query_info):
+    def failing_plan(self, batch):
+        raise ValueError('invalid selection')
+
+    monkeypatch.setattr(QueryPlanner, 'plan', failing_plan)
+    planner = QueryPlanner(window=0.2)
+    query = make_query(query_info, {'region': ['*'], 'year': ['2017'], 'observations': ['Population']})
+
+    # Leader and follower of the batch both get the error
+    errors = []
+
+    def execute():
+        try:
+            planner.execute(query)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=execute) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 2
@@ -0,0 +1,71 @@
+import pytest
+from scbapi.scbregistry import QueryRegistry, definition_digest
+from scbapi.scbstat import QueryInfo
+
+
+@pytest.fixture
+def registry():
+    registry = QueryRegistry()
+    registry.seed({
+        'A': {'type': 'SIMPLE', 'query': {'name': 'Query A', 'path': 'a', 'simple_query': {}}},
+        'B': {'type': 'SIMPLE', 'query': {'name': 'Query B', 'path': 'b', 'simple_query': {}}},
+    })
+    return registry
+
+
+def test_token(registry):
+    assert registry.token() == {'version': 2, 'labels': [{'label': 'Query A', 'value': 'A'},
+                                                         {'label': 'Query B', 'value': 'B'}]}
+
+
+def test_delta(registry):
+    version = registry.put('C', {'type': 'SIMPLE', 'query': {'name': 'Query C', 'path': 'c', 'simple_query': {}}})
+    assert version == 3
+    assert registry.token(since=2) == {'version': 3, 'labels': [{'label': 'Query C', 'value': 'C'}]}
+
+
+def test_get(registry):
+    assert registry['B']['query']['path'] == 'b'
+    assert list(registry) == ['A', 'B']
+    with pytest.raises(KeyError):
+        registry['C']
+
+
+def test_duplicate(registry):
+    with pytest.raises(KeyError):
+        registry.put('A', {'type': 'SIMPLE', 'query': {'name': 'Query A', 'path': 'a', 'simple_query': {}}})
+
+
+def test_seed_changed(registry):
+    registry.put('C', {'type': 'SIMPLE', 'query': {'name': 'Query C', 'path': 'c', 'simple_query': {}}})
+    digest = registry.digest('B')
+
+    # Changed default replaces the seeded definition with a new version, saved queries are kept
+    registry.seed({
+        'A': {'type': 'SIMPLE', 'query': {'name': 'Other', 'path': 'x', 'simple_query': {}}},
+        'B': {'type': 'SIMPLE', 'query': {'name': 'Query B', 'path': 'b', 'simple_query': {}}},
+        'C': {'type': 'SIMPLE', 'query': {'name': 'Other', 'path': 'x', 'simple_query': {}}},
+    })
+    assert registry['A']['query']['name'] == 'Other'
+    assert registry.digest('B') == digest
+    assert registry['C']['query']['name'] == 'Query C'
+    assert registry.token(since=3) == {'version': 4, 'labels': [{'label': 'Other', 'value': 'A'}]}
+
+
+def test_metadata(registry):
+    info = {'title': 'test', 'variables': [{'code': 'A', 'text': 'T_A', 'values': ['C'], 'valueTexts': ['T_C']}]}
+    query_itm = {'type': 'SIMPLE', 'query': {'name': 'Query C', 'path': 'c', 'simple_query': {}, 'info': info}}
+    registry.put('C', query_itm)
+    assert registry.digest('C') == definition_digest(query_itm)
+    assert registry.get_info('C').dict() == QueryInfo(**info).dict()
+    assert registry.get_info('A') is None
+
+
+def test_reopen_keeps_saved(tmp_path):
+    database = str(tmp_path / 'registry.sqlite3')
+    QueryRegistry(database).put('A', {'type': 'SIMPLE', 'query': {'name': 'Query A', 'path': 'a'}})
+
+    # Query saved by a user is not replaced by a default with the same key after a restart
+    registry = QueryRegistry(database)
+    registry.seed({'A': {'type': 'SIMPLE', 'query': {'name': 'Other', 'path': 'x', 'simple_query': {}}}})
+    assert registry['A']['query']['name'] == 'Query A'
@@ -0,0 +1,67 @@
+import numpy
+import pandas
+import pytest
+from scbapi.scbresult import QueryResult
+
+
+@pytest.fixture
+def result():
+    df = pandas.DataFrame({'region': ['0114', '0115', '0180', '1280'],
+                           'year': ['2017', '2017', '2018', '2018'],
+                           'Population': [45543.0, 33032.0, 962154.0, 344166.0]})
+    return QueryResult(df, value_col='Population')
+
+
+@pytest.mark.parametrize(
+    'page_current,page_size,sort_by,filter_query,exp',
+    [
+        (0, 2, None, None, ['0114', '0115']),
+        (1, 3, None, None, ['1280']),
+        (0, 4, [{'column_id': 'Population', 'direction': 'desc'}], None, ['0180', '1280', '0114', '0115']),
+        (1, 2, [{'column_id': 'Population', 'direction': 'asc'}], None, ['1280', '0180']),
+        (0, 4, None, '{year} = 2018', ['0180', '1280']),
+        (0, 4, None, '{Population} gt 40000 && {region} contains 01', ['0114', '0180']),
+        (0, 4, [{'column_id': 'Population', 'direction': 'asc'}], '{year} eq "2017"', ['0115', '0114']),
+        (0, 4, None, '{unknown} = 1', ['0114', '0115', '0180', '1280']),
+    ],
+)
+def test_page(result, page_current, page_size, sort_by, filter_query, exp):
+    records = result.page(page_current, page_size, sort_by=sort_by, filter_query=filter_query)
+    assert [rec['region'] for rec in records] == exp
+
+
+def test_row_count(result):
+    assert result.row_count() == 4
+    assert result.row_count('{year} = 2017') == 2
+
+
+def test_matrix(result):
+    matrix = result.get_matrix(['0114', '0180', '2580'])
+    assert matrix.years == ['2017', '2018']
+    assert matrix.column('2018')[1] == 962154.0
+    assert numpy.isnan(matrix.values[2]).all()
+    assert matrix.totals[0] == 45543.0 and numpy.isnan(matrix.totals[2])
+    assert result.get_matrix(['0114', '0180', '2580']) is matrix
+
+
+@pytest.mark.parametrize(
+    'regions,exp',
+    [
+        (['0114', '0180'], [['2017', 45543.0], ['2018', 962154.0]]),
+        (['0115', '9999'], [['2017', 33032.0]]),
+        ([], []),
+    ],
+)
+def test_region_series(result, regions, exp):
+    assert result.region_rows()['1280'].tolist() == [3]
+    assert result.region_series(regions).values.tolist() == exp
+
+
+def test_matrix_missing_value():
+    df = pandas.DataFrame({'region': ['0114', '0114', '0180', '0180'], 'year': ['2018', '2019'] * 2,
+                           'Population': [1.0, numpy.nan, 2.0, 3.0]})
+    matrix = QueryResult(df, value_col='Population').get_matrix(['0114', '0180'])
+
+    # Missing values (..) stay missing instead of being summed to zero
+    assert matrix.values[0, 0] == 1.0 and numpy.isnan(matrix.values[0, 1])
+    assert matrix.totals.tolist() == [1.0, 5.0]
@@ -0,0 +1,83 @@
+import time
+import pandas
+import pytest
+from scbapi.scbstat import QueryInfo
+from scbapi.scbsnapshot import RateLimiter, SnapshotBuilder, SnapshotSource
+
+
+class FakeQuery(object):
+    info = QueryInfo(title='test', variables=[])
+    value_col = 'Population'
+
+    def get_dataframe(self):
+        return pandas.DataFrame({'region': ['0114', '0180', '0114'], 'year': ['2017', '2017', '2018'],
+                                 'Population': [45543.0, 962154.0, 46000.0]})
+
+
+class FakeController(object):
+    queries = {'POP': {'type': 'SIMPLE', 'query': {'name': 'Population'}}}
+
+    def get_query(self, query_key, query_dict=None):
+        return FakeQuery()
+
+    @staticmethod
+    def hash_definition(query_itm):
+        return 'hash'
+
+
+@pytest.fixture
+def snapshot_folder(tmp_path):
+    folder = tmp_path / 'snapshot'
+    SnapshotBuilder(FakeController(), folder=str(folder), workers=2).build()
+    return folder
+
+
+def test_snapshot_files(snapshot_folder):
+    source = SnapshotSource(str(snapshot_folder), verify=True)
+    entry = source.manifest['queries']['POP']
+    assert [itm['path'] for itm in entry['files']] == ['query_key=POP/year=2017/part-0.parquet',
+                                                       'query_key=POP/year=2018/part-0.parquet']
+    assert entry['rows'] == 3 and len(entry['files'][0]['sha256']) == 64
+    assert source.definitions == FakeController.queries
+
+
+def test_snapshot_source(snapshot_folder):
+    source = SnapshotSource(str(snapshot_folder))
+    assert source.matches('POP', 'hash') and not source.matches('POP', 'other') and 'OTHER' not in source
+    df = source.get_dataframe('POP')
+    assert df.columns.tolist() == ['region', 'year', 'Population']
+    assert df.Population.tolist() == [45543.0, 962154.0, 46000.0]
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(calls=2, period=0.2)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_rebuild(snapshot_folder):
+    source = SnapshotSource(str(snapshot_folder))
+    FakeController.queries = dict(FakeController.queries, OTHER={'type': 'SIMPLE', 'query': {'name': 'Other'}})
+    try:
+        SnapshotBuilder(FakeController(), folder=str(snapshot_folder), workers=2).build()
+    finally:
+        del FakeController.queries['OTHER']
+
+    # New build is switched in at once, a running source keeps reading the version it started with
+    assert 'OTHER' in SnapshotSource(str(snapshot_folder)) and 'OTHER' not in source
+    assert source.get_dataframe('POP').Population.tolist() == [45543.0, 962154.0, 46000.0]
+
+    SnapshotBuilder(FakeController(), folder=str(snapshot_folder), workers=2).build()
+    assert len(list(snapshot_folder.parent.glob('snapshot.v*'))) == 2
+
+
+def test_replace_folder(tmp_path):
+    folder = tmp_path / 'snapshot'
+    folder.mkdir()
+    (folder / 'old.txt').write_text('old')
+
+    # Snapshot folder of an earlier build is replaced by the link
+    SnapshotBuilder(FakeController(), folder=str(folder), workers=2).build()
+    assert folder.is_symlink() and 'POP' in SnapshotSource(str(folder))
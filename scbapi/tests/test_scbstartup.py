@@ -0,0 +1,14 @@
+import pytest
+from scbapi.scbstartup import measure_imports
+
+
+@pytest.mark.parametrize(
+    'statement',
+    [
+        'import scbapi',
+        'from scbapi.scbstat import QueryInfo',
+    ],
+)
+def test_lazy_imports(statement):
+    modules = {itm.module.split('.')[0] for itm in measure_imports(statement)}
+    assert modules.isdisjoint({'pandas', 'geopandas', 'fiona', 'boto3', 'mapclassify', 'requests'})
@@ -108,4 +108,76 @@ def test_check_codes(varaibles, codes, exp):
 )
 def test_check_texts(varaibles, texts, exp):
     query_info = QueryInfo(title='test', variables=varaibles)
-    assert query_info.check_texts(texts=texts) == exp
\ No newline at end of file
+    assert query_info.check_texts(texts=texts) == exp
+
+@pytest.fixture
+def simple_query(varaibles):
+    from scbapi.scbstat import SimpleQuery
+    query_info = QueryInfo(title='test', variables=varaibles)
+    values = {'name': 'test', 'path': 'test', 'info': query_info, 'simple_query': {'T_A': ['T_C'], 'T_B': ['*']},
+              'response_format': 'json', 'aggregate': None}
+    return SimpleQuery.construct(values, set(values.keys()))
+
+
+def test_query_memoized(simple_query):
+    query = simple_query.query
+    request_body = simple_query.request_body
+    assert simple_query.query is query
+    assert simple_query.request_body is request_body
+    assert request_body['query'] == [{'code': 'A', 'selection': {'filter': 'item', 'values': ['C']}},
+                                     {'code': 'B', 'selection': {'filter': 'item', 'values': ['D', 'D1', 'Y']}}]
+
+
+def test_query_invalidated(simple_query):
+    request_body = simple_query.request_body
+    simple_query.simple_query = {'T_A': ['T_Z']}
+    assert simple_query.request_body is not request_body
+    assert simple_query.query[0].selection.values == ['Z']
+
+
+def test_query_copy(simple_query):
+    request_body = simple_query.request_body
+    query_copy = simple_query.copy(update={'simple_query': dict(simple_query.simple_query)})
+    assert query_copy.request_body is request_body
+
+    query_copy = simple_query.copy(update={'simple_query': {'T_A': ['T_Z']}})
+    assert query_copy.request_body is not request_body
+    assert simple_query.request_body is request_body
+
+
+@pytest.mark.parametrize(
+    'elimination,values,exp',
+    [
+        (True, ['00', '01', '03'], [('B', ['D', 'D1', 'Y'])]),
+        (None, ['00', '01', '03'], [('A', ['00']), ('B', ['D', 'D1', 'Y'])]),
+        (None, ['01', '03'], [('A', ['01', '03']), ('B', ['D', 'D1', 'Y'])]),
+    ],
+)
+def test_query_aggregate(varaibles, elimination, values, exp):
+    from scbapi.scbstat import SimpleQuery, QueryVariable
+    region = QueryVariable(code='A', text='region', values=values, valueTexts=values, elimination=elimination)
+    query_info = QueryInfo(title='test', variables=[region, varaibles[1]])
+    values = {'name': 'test', 'path': 'test', 'info': query_info, 'simple_query': {'region': ['*'], 'T_B': ['*']},
+              'region_keys': ['01', '03'], 'response_format': 'json', 'aggregate': None}
+    query = SimpleQuery.construct(values, set(values.keys()))
+    assert query.query[0].selection.values == ['01', '03']
+
+    query_total = query.copy(update={'aggregate': ['region']})
+    assert [(itm.code, itm.selection.values) for itm in query_total.query] == exp
+
+
+def test_trusted_info(varaibles):
+    query_info = QueryInfo(title='test', variables=varaibles)
+    trusted = QueryInfo.trusted(query_info.dict())
+    assert trusted.dict() == query_info.dict()
+    assert trusted.json() == query_info.json()
+    assert trusted.get_values(['T_D1'], text='T_B') == ['D1']
+    assert trusted.check_values(['C', 'X'], code='A') == ['X']
+
+
+def test_info_bytes(varaibles):
+    varaibles[0] = varaibles[0].copy(update={'elimination': True})
+    query_info = QueryInfo.trusted(QueryInfo(title='test', variables=varaibles).dict(skip_defaults=True))
+    restored = QueryInfo.from_bytes(query_info.to_bytes())
+    assert restored.json(skip_defaults=True) == query_info.json(skip_defaults=True)
+    assert restored.variables[1].values[0] is query_info.variables[1].values[0]
@@ -0,0 +1,75 @@
+import pytest
+from scbapi.scbstorage import LocalStore, CachedStore
+
+
+class CountingStore(LocalStore):
+    """
+    Local store recording requests, and failing while offline
+    """
+
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.requests = []
+        self.offline = False
+
+    def get(self, key, etag=None):
+        if self.offline:
+            raise ConnectionError('offline')
+        current, data = super().get(key, etag=etag)
+        self.requests.append((key, etag, data is not None))
+        return current, data
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / 'bucket' / 'map').mkdir(parents=True)
+    (tmp_path / 'bucket' / 'map' / 'regions.json').write_text('{"a": 1}', encoding='utf-8')
+    return CountingStore(str(tmp_path / 'bucket'))
+
+
+def test_local_etag(store):
+    etag, data = store.get('map/regions.json')
+
+    assert data == b'{"a": 1}'
+    assert store.get('map/regions.json', etag=etag) == (etag, None)
+    assert store.read_text('map/regions.json') == '{"a": 1}'
+
+
+def test_cached_download(store, tmp_path):
+    cache = CachedStore(store, folder=str(tmp_path / 'cache'))
+    path = cache.path('map/regions.json')
+
+    assert path.read_bytes() == b'{"a": 1}'
+    assert path.parent.parent.name == 'objects'
+
+    # Validated once per process
+    assert cache.path('map/regions.json') == path
+    assert len(store.requests) == 1
+
+
+def test_cached_revalidate(store, tmp_path):
+    CachedStore(store, folder=str(tmp_path / 'cache')).path('map/regions.json')
+
+    # New process revalidates with the ETag, unchanged objects are not downloaded again
+    cache = CachedStore(store, folder=str(tmp_path / 'cache'))
+    assert cache.read_text('map/regions.json') == '{"a": 1}'
+    assert store.requests[-1][1] is not None and store.requests[-1][2] is False
+
+    # Modified objects are downloaded
+    (tmp_path / 'bucket' / 'map' / 'regions.json').write_text('{"a": 2}', encoding='utf-8')
+    cache = CachedStore(store, folder=str(tmp_path / 'cache'))
+    assert cache.read_text('map/regions.json') == '{"a": 2}'
+    assert store.requests[-1][2] is True
+
+
+def test_cached_offline(store, tmp_path):
+    CachedStore(store, folder=str(tmp_path / 'cache')).path('map/regions.json')
+
+    store.offline = True
+    cache = CachedStore(store, folder=str(tmp_path / 'cache'))
+    assert cache.read_text('map/regions.json') == '{"a": 1}'
+    assert cache.offline
+
+    # Objects missing from the cache can't be served
+    with pytest.raises(ConnectionError):
+        cache.path('map/other.json')